@@ -1,27 +1,42 @@
 import os
+from datetime import datetime
 from pathlib import Path
-from shutil import move
+from shutil import move, rmtree
 from typing import Optional
 
 import pyclamd
 
 from .config import _cfg, _cfgi, site_logger
-from .objects import User
-from .email import send_mod_locked
+from .blobs import release_blobs, store_blob
+from .changes import record_mod_change, record_version_change
+from .database import db
+from .objects import User, ModVersion
+from .email import send_mod_locked, send_update_notification
 from .notification import send_change_notifications
+from .purge import purge_download
+from .search import get_mod_score
 
 clam_daemon = None
 
 
-def file_contains_malware(where: str) -> bool:
+def scan_file(where: str) -> bool:
+    """Whether ClamAV finds malware in the file, raises if it couldn't scan it"""
     global clam_daemon
+    if not clam_daemon:
+        clam_daemon = pyclamd.ClamdNetworkSocket(host=_cfg('clamav-host'), port=_cfgi('clamav-port', 3310))
+    result = clam_daemon.scan_file(where)
+    if result:
+        status, reason = next(iter(result.values()))
+        if status == 'ERROR':
+            raise OSError(f'ClamAV could not scan {where}: {reason}')
+        site_logger.error(f'ClamAV says {where} contains malware')
+        return True
+    return False
+
+
+def file_contains_malware(where: str) -> bool:
     try:
-        if not clam_daemon:
-            clam_daemon = pyclamd.ClamdNetworkSocket(host=_cfg('clamav-host'), port=_cfgi('clamav-port', 3310))
-        result = clam_daemon.scan_file(where)
-        if result:
-            site_logger.error(f'ClamAV says {where} contains malware')
-            return True
+        return scan_file(where)
     except Exception as exc:
         # No ClamAV daemon found, log it and let the file through
         site_logger.error(f'Failed to connect to ClamAV, skipping scan of {where}', exc_info=exc)
@@ -46,3 +61,66 @@ def punish_malware(user: User) -> None:
             other_mod.lock_reason = 'Malware detected in upload'
             send_mod_locked(other_mod, user)
             send_change_notifications(other_mod, 'locked', True)
+
+
+def release_version(version: ModVersion, uploader: Optional[User], update: bool, notify_followers: bool) -> None:
+    """Links the upload of a version that scanned clean to its download_path, replacing the file it had,
+    and makes the version the mod's default if it's an update"""
+    storage = _cfg('storage')
+    mod = version.mod
+    created = version.pending_scan
+    old_sha256 = version.download_sha256
+    if storage and version.pending_path:
+        full_path = os.path.join(storage, version.download_path)
+        store_blob(storage, os.path.join(storage, version.pending_path), version.pending_sha256, full_path)
+        if not created:
+            purge_download(version.download_path)
+        version.download_size = version.pending_size
+        version.download_sha256 = version.pending_sha256
+        version.created = datetime.now()
+    version.pending_path = version.pending_size = version.pending_sha256 = None
+    version.pending_scan = False
+    # Changes the mod's ETag and tells the change feed about it, whether the version is new or only its file
+    mod.updated = datetime.now()
+    record_version_change(version, 'created' if created else 'updated')
+    if update:
+        mod.default_version = version
+        record_mod_change(mod, 'updated')
+        mod.score = get_mod_score(mod)
+        if notify_followers and uploader:
+            send_update_notification(mod, version, uploader)
+        send_change_notifications(mod, 'update')
+    if storage and old_sha256 and old_sha256 != version.download_sha256:
+        db.flush()
+        release_blobs(storage, [old_sha256])
+
+
+def reject_version(version: ModVersion, uploader: Optional[User]) -> None:
+    """Quarantines the upload of a version with malware. A new version is removed,
+    along with the mod if it was its only one, a version whose file was being replaced keeps its old one."""
+    storage = _cfg('storage')
+    mod = version.mod
+    sha256 = version.pending_sha256
+    if storage and version.pending_path:
+        full_path = os.path.join(storage, version.pending_path)
+        if os.path.isfile(full_path):
+            quarantine_malware(full_path)
+    version.pending_path = version.pending_size = version.pending_sha256 = None
+    if uploader:
+        punish_malware(uploader)
+    if version.pending_scan:
+        others = [v for v in mod.versions if v.id != version.id]
+        if not others:
+            if storage:
+                rmtree(os.path.join(storage, mod.base_path()), ignore_errors=True)
+            record_mod_change(mod, 'deleted')
+            db.delete(mod)
+        else:
+            if mod.default_version_id == version.id:
+                mod.default_version = next((v for v in others if not v.pending_scan), others[0])
+            db.delete(version)
+    if storage and sha256:
+        db.flush()
+        # Uploads only become blobs once they scanned clean, but the same file may have been stored before.
+        # Unless another version still links to it, it mustn't stay downloadable from the blob store.
+        release_blobs(storage, [sha256], grace=False)
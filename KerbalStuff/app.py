@@ -14,7 +14,6 @@ import requests
 import werkzeug.wrappers
 from flask import Flask, render_template, g, url_for, Response, request
 from flask_login import LoginManager, current_user
-from markupsafe import Markup
 from werkzeug.exceptions import HTTPException, InternalServerError, NotFound
 from flask.typing import ResponseReturnValue
 from jinja2 import ChainableUndefined
@@ -29,11 +28,13 @@ from .blueprints.mods import mods
 from .blueprints.profile import profiles
 from .middleware.session_interface import OnlyLoggedInSessionInterface
 from .celery import update_from_github
-from .common import first_paragraphs, many_paragraphs, json_output, jsonify_exception, dumb_object, sanitize_text, markdown_renderer
+from .common import first_paragraphs, many_paragraphs, json_output, jsonify_exception, dumb_object, sanitize_text, convert_markdown, \
+    page_url
 from .config import _cfg, _cfgb, _cfgd, _cfgi, site_logger
 from .custom_json import CustomJSONEncoder
 from .database import db
 from .helpers import is_admin, following_mod
+from .kerbdown import resolve_mentions
 from .objects import User
 
 app = Flask(__name__, template_folder='../templates')
@@ -58,7 +59,8 @@ app.jinja_env.auto_reload = app.debug
 app.secret_key = _cfg("secret-key")
 app.json_encoder = CustomJSONEncoder  # type: ignore[attr-defined]
 app.session_interface = OnlyLoggedInSessionInterface()
-app.jinja_env.filters['markdown'] = lambda md: Markup(markdown_renderer.convert(md))
+app.jinja_env.filters['markdown'] = convert_markdown
+app.jinja_env.filters['mentions'] = resolve_mentions
 login_manager = LoginManager(app)
 
 prof_dir = _cfg('profile-dir')
@@ -314,6 +316,7 @@ def inject() -> Dict[str, Any]:
         'first_visit': first_visit,
         'request': request,
         'url_for': url_for,
+        'page_url': page_url,
         'strftime': strftime,
         'site_name': _cfg('site-name'),
         'caption': _cfg('caption'),
@@ -0,0 +1,60 @@
+import atexit
+import threading
+import time
+from typing import List, Optional
+
+from .config import site_logger
+from .database import db
+
+
+class BackgroundFlusher:
+    """Base class for work that requests queue up in memory and a daemon thread
+    carries out every interval seconds, all at once."""
+
+    name = 'background-flusher'
+
+    def __init__(self, interval: int) -> None:
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def flush(self) -> int:
+        raise NotImplementedError()
+
+    def ensure_started(self) -> None:
+        # Started on demand, so it runs in the process that serves requests, not in its forking parent
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    if self._thread is None:
+                        _started.append(self)
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                site_logger.exception('Unable to flush %s', self.name)
+            finally:
+                db.remove()
+
+
+_started: List[BackgroundFlusher] = []
+
+
+def flush_all() -> None:
+    """Flushes what the started flushers have queued up. Their daemon threads die with the process,
+    so this runs when it exits, gunicorn and celery workers exit normally when they're stopped."""
+    for flusher in _started:
+        try:
+            flusher.flush()
+        except Exception:
+            site_logger.exception('Unable to flush %s', flusher.name)
+        finally:
+            db.remove()
+
+
+atexit.register(flush_all)
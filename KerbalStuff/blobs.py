@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import time
+from typing import Iterable
+
+from .config import site_logger
+from .objects import ModVersion
+
+# Relative to storage, every distinct zip is stored once in here, named by its SHA-256.
+# ModVersion.download_path is a hard link to its blob, so downloads keep their file names.
+BLOBS_PATH = 'blobs'
+
+READ_SIZE = 1024 * 1024
+
+# Uploads store their blob a moment before their version is committed,
+# so blobs changed more recently than this aren't removed even if nothing references them yet
+BLOB_GRACE_SECONDS = 3600
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOBS_PATH, sha256[:2], sha256)
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _link(source: str, target: str) -> None:
+    """Replaces target with a hard link to source, or a copy where hard links aren't possible"""
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def store_blob(storage: str, path: str, sha256: str, target: str) -> None:
+    """Moves the file at path into the blob store, or drops it if an identical one is already stored,
+    and puts a link to the blob at target"""
+    blob = os.path.join(storage, blob_path(sha256))
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    if os.path.isfile(blob):
+        try:
+            # Recent again, so release_blobs leaves it to the version that's about to be committed
+            os.utime(blob)
+            _link(blob, target)
+        except FileNotFoundError:
+            # Released by another process meanwhile, this upload becomes the blob
+            pass
+        else:
+            os.remove(path)
+            return
+    os.replace(path, blob)
+    _link(blob, target)
+
+
+def link_existing(storage: str, path: str, sha256: str) -> bool:
+    """Puts a file that's already in place into the blob store, keeping it where it is.
+    Returns whether it was a duplicate, replaced by a link to the blob that was already stored."""
+    blob = os.path.join(storage, blob_path(sha256))
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    if not os.path.isfile(blob):
+        try:
+            os.link(path, blob)
+        except FileExistsError:
+            # Another process stored the same content meanwhile
+            pass
+        except OSError:
+            shutil.copyfile(path, blob)
+            return False
+        else:
+            return False
+    if os.path.samefile(path, blob):
+        return False
+    _link(blob, path)
+    return True
+
+
+def release_blobs(storage: str, hashes: Iterable[str], grace: bool = True) -> None:
+    """Removes the blobs no version references anymore, call it once the versions are deleted or changed.
+    Recently stored blobs are kept for an upload that may be about to reference them,
+    `spacedock admin store_blobs` removes them later if nothing does. Without grace they're removed right away."""
+    recent = time.time() - BLOB_GRACE_SECONDS if grace else None
+    for sha256 in set(hashes):
+        if sha256 and not ModVersion.query.filter(ModVersion.download_sha256 == sha256).count():
+            blob = os.path.join(storage, blob_path(sha256))
+            if os.path.isfile(blob) and (recent is None or os.path.getmtime(blob) < recent):
+                site_logger.info('Removing unreferenced blob %s', sha256)
+                os.remove(blob)
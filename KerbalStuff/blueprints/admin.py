@@ -12,11 +12,14 @@ from sqlalchemy import or_, func
 from sqlalchemy.orm import Query
 import werkzeug.wrappers
 
+from ..cache import all_caches
 from ..common import adminrequired, with_session, TRUE_STR
 from ..config import _cfg
 from ..database import db
 from ..email import send_bulk_email
 from ..objects import Mod, GameVersion, Game, Publisher, User, Notification
+from ..search import invalidate_game_versions
+from ..changes import record_game_change
 
 admin = Blueprint('admin', __name__)
 ITEMS_PER_PAGE = 10
@@ -48,7 +51,8 @@ def profiling(page: int) -> Union[str, werkzeug.wrappers.Response]:
     profilings = profilings[(page - 1) * ITEMS_PER_PAGE : page * ITEMS_PER_PAGE]
     return render_template("admin-profiling.html",
                            profilings=profilings, query=query,
-                           page=page, total_pages=total_pages)
+                           page=page, total_pages=total_pages,
+                           caches=all_caches())
 
 
 def parse_prof_filename(p: Path) -> Dict[str, Any]:
@@ -367,8 +371,10 @@ def create_game() -> werkzeug.wrappers.Response:
         return games(1, 'Publisher is required!')
     if any(Game.query.filter(Game.name == name)):
         return games(1, 'A game by that name already exists!')
-    db.add(Game(name=name, publisher_id=pid, short=sname, active=True))
+    game = Game(name=name, publisher_id=pid, short=sname, active=True)
+    db.add(game)
     db.commit()
+    record_game_change(game.id, 'created')
     return redirect(url_for('admin.games', page=1, **request.args))
 
 
@@ -387,7 +393,9 @@ def create_version() -> werkzeug.wrappers.Response:
             GameVersion.friendly_version == friendly)):
         return game_versions(1, 'A version by that name already exists for that game!')
     db.add(GameVersion(friendly_version=friendly, game_id=gid))
+    record_game_change(int(gid), 'updated')
     db.commit()
+    invalidate_game_versions(int(gid))
     return redirect(url_for('admin.game_versions', page=1, **request.args))
 
 
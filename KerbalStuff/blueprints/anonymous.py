@@ -5,8 +5,8 @@ from flask import Blueprint, render_template, abort, request, Response, make_res
 from flask_login import current_user
 from datetime import timezone
 
-from ..common import dumb_object, paginate_query, get_paginated_mods, get_game_info, get_games, \
-    get_featured_mods, get_top_mods, get_new_mods, get_updated_mods, sendfile
+from ..common import dumb_object, keyset_paginate, get_paginated_mods, get_game_info, get_games, \
+    get_featured_mods, get_top_mods, get_new_mods, get_updated_mods, sendfile, send_thumbnail
 from ..config import _cfg
 from ..database import db
 from ..objects import Featured, Mod, ModVersion, User, ModList
@@ -67,7 +67,7 @@ def game_thumbnail(gameshort: str) -> werkzeug.wrappers.Response:
         # This won't happen normally, as thumbnail_url() only redirects here if background is set.
         # However, it's possible that someone calls this manually.
         abort(404)
-    return sendfile(ga.thumbnail, False)
+    return send_thumbnail(ga.thumbnail)
 
 
 @anonymous.route("/content/<path:path>")
@@ -90,11 +90,10 @@ def browse() -> str:
 @anonymous.route("/browse/new")
 def browse_new() -> str:
     query = request.args.get('query', '')
-    mods, page, total_pages = paginate_query(apply_search_to_query(
-        Mod.query.filter(Mod.published).order_by(Mod.created.desc()),
-        query))
-    return render_template("browse-list.html", mods=mods, sort='new', query=query,
-                           page=page, total_pages=total_pages,
+    page = keyset_paginate(apply_search_to_query(Mod.query.filter(Mod.published), query),
+                           [Mod.created, Mod.id])
+    return render_template("browse-list.html", mods=page.items, sort='new', query=query,
+                           pagination=page,
                            url="/browse/new", name="Newest Mods", rss="/browse/new.rss")
 
 
@@ -112,11 +111,11 @@ def browse_new_rss() -> Response:
 @anonymous.route("/browse/updated")
 def browse_updated() -> str:
     query = request.args.get('query', '')
-    mods, page, total_pages = paginate_query(apply_search_to_query(
-        Mod.query.filter(Mod.published, Mod.versions.any(ModVersion.id != Mod.default_version_id)).order_by(Mod.updated.desc()),
-        query))
-    return render_template("browse-list.html", mods=mods, sort='updated', query=query,
-                           page=page, total_pages=total_pages,
+    page = keyset_paginate(apply_search_to_query(
+        Mod.query.filter(Mod.published, Mod.versions.any(ModVersion.id != Mod.default_version_id)),
+        query), [Mod.updated, Mod.id])
+    return render_template("browse-list.html", mods=page.items, sort='updated', query=query,
+                           pagination=page,
                            url="/browse/updated", name="Recently Updated Mods", rss="/browse/updated.rss")
 
 
@@ -135,20 +134,19 @@ def browse_updated_rss() -> Response:
 @anonymous.route("/browse/top")
 def browse_top() -> str:
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(query=query)
+    page = get_paginated_mods(query=query)
     return render_template("browse-list.html",
-                           mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages,
+                           mods=page.items, sort='popularity', query=query,
+                           pagination=page,
                            url="/browse/top", name="Popular Mods")
 
 
 @anonymous.route("/browse/featured")
 def browse_featured() -> str:
-    featured = Featured.query.order_by(Featured.priority.desc())
-    featured, page, total_pages = paginate_query(featured)
-    mods = [f.mod for f in featured]
-    return render_template("browse-list.html", mods=mods, featured=featured,
-                           page=page, total_pages=total_pages,
+    page = keyset_paginate(Featured.query, [Featured.priority, Featured.id])
+    mods = [f.mod for f in page.items]
+    return render_template("browse-list.html", mods=mods, featured=page.items,
+                           pagination=page,
                            url="/browse/featured", name="Featured Mods", rss="/browse/featured.rss")
 
 
@@ -172,9 +170,9 @@ def browse_featured_rss() -> Response:
 @anonymous.route("/browse/all")
 def browse_all() -> str:
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(query=query)
-    return render_template("browse-list.html", mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages,
+    page = get_paginated_mods(query=query)
+    return render_template("browse-list.html", mods=page.items, sort='popularity', query=query,
+                           pagination=page,
                            url="/browse/all", name="All Mods")
 
 
@@ -191,11 +189,11 @@ def singlegame_browse(gameshort: str) -> str:
 def singlegame_browse_new(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     query = request.args.get('query', '')
-    mods, page, total_pages = paginate_query(apply_search_to_query(
-        Mod.query.filter(Mod.published, Mod.game_id == ga.id).order_by(Mod.created.desc()),
-        query))
-    return render_template("browse-list.html", mods=mods, sort='new', query=query,
-                           page=page, total_pages=total_pages, ga=ga,
+    page = keyset_paginate(apply_search_to_query(
+        Mod.query.filter(Mod.published, Mod.game_id == ga.id),
+        query), [Mod.created, Mod.id])
+    return render_template("browse-list.html", mods=page.items, sort='new', query=query,
+                           pagination=page, ga=ga,
                            url="/browse/new", name="Newest Mods", rss="/browse/new.rss")
 
 
@@ -216,11 +214,11 @@ def singlegame_browse_new_rss(gameshort: str) -> Response:
 def singlegame_browse_updated(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     query = request.args.get('query', '')
-    mods, page, total_pages = paginate_query(apply_search_to_query(
-        Mod.query.filter(Mod.published, Mod.game_id == ga.id, Mod.versions.any(ModVersion.id != Mod.default_version_id)).order_by(Mod.updated.desc()),
-        query))
-    return render_template("browse-list.html", mods=mods, sort='updated', query=query,
-                           page=page, total_pages=total_pages, ga=ga,
+    page = keyset_paginate(apply_search_to_query(
+        Mod.query.filter(Mod.published, Mod.game_id == ga.id, Mod.versions.any(ModVersion.id != Mod.default_version_id)),
+        query), [Mod.updated, Mod.id])
+    return render_template("browse-list.html", mods=page.items, sort='updated', query=query,
+                           pagination=page, ga=ga,
                            url="/browse/updated", name="Recently Updated Mods", rss="/browse/updated.rss")
 
 
@@ -242,9 +240,9 @@ def singlegame_browse_updated_rss(gameshort: str) -> Response:
 def singlegame_browse_top(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(ga, query)
-    return render_template("browse-list.html", mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages, ga=ga,
+    page = get_paginated_mods(ga, query)
+    return render_template("browse-list.html", mods=page.items, sort='popularity', query=query,
+                           pagination=page, ga=ga,
                            url="/browse/top", name="Popular Mods")
 
 
@@ -252,11 +250,10 @@ def singlegame_browse_top(gameshort: str) -> str:
 def singlegame_browse_featured(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     featured = Featured.query.outerjoin(Mod)\
-        .filter(Mod.game_id == ga.id)\
-        .order_by(Featured.priority.desc())
-    featured, page, total_pages = paginate_query(featured)
-    mods = [f.mod for f in featured]
-    return render_template("browse-list.html", mods=mods, featured=featured, page=page, total_pages=total_pages, ga=ga,
+        .filter(Mod.game_id == ga.id)
+    page = keyset_paginate(featured, [Featured.priority, Featured.id])
+    mods = [f.mod for f in page.items]
+    return render_template("browse-list.html", mods=mods, featured=page.items, pagination=page, ga=ga,
                            url="/browse/featured", name="Featured Mods", rss="/browse/featured.rss")
 
 
@@ -282,9 +279,9 @@ def singlegame_browse_featured_rss(gameshort: str) -> Response:
 def singlegame_browse_all(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(ga, query)
-    return render_template("browse-list.html", mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages, ga=ga,
+    page = get_paginated_mods(ga, query)
+    return render_template("browse-list.html", mods=page.items, sort='popularity', query=query,
+                           pagination=page, ga=ga,
                            url="/browse/all", name="All Mods")
 
 
@@ -306,15 +303,15 @@ def privacy() -> str:
 @anonymous.route("/search")
 def search() -> str:
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(query=query)
-    return render_template("browse-list.html", mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages, search=True)
+    page = get_paginated_mods(query=query)
+    return render_template("browse-list.html", mods=page.items, sort='popularity', query=query,
+                           pagination=page, search=True)
 
 
 @anonymous.route("/<gameshort>/search")
 def singlegame_search(gameshort: str) -> str:
     ga = get_game_info(short=gameshort)
     query = request.args.get('query', '')
-    mods, page, total_pages = get_paginated_mods(ga, query)
-    return render_template("browse-list.html", mods=mods, sort='popularity', query=query,
-                           page=page, total_pages=total_pages, search=True, ga=ga)
+    page = get_paginated_mods(ga, query)
+    return render_template("browse-list.html", mods=page.items, sort='popularity', query=query,
+                           pagination=page, search=True, ga=ga)
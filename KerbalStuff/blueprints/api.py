@@ -1,4 +1,3 @@
-import math
 import os
 import time
 import re
@@ -8,25 +7,33 @@ from functools import wraps
 from shutil import rmtree
 from typing import Dict, Any, Callable, Optional, Tuple, Iterable, List, Union
 
+import werkzeug.wrappers
 from flask import Blueprint, url_for, current_app, request, abort
 from flask_login import login_user, current_user, logout_user
-from sqlalchemy import desc, asc
-from sqlalchemy.orm import Query
+from sqlalchemy import case, func
+from sqlalchemy.orm import Query, joinedload
 from werkzeug.utils import secure_filename
 
 from .accounts import check_password_criteria
 from ..notification import send_add_notifications, send_change_notifications
-from ..common import json_output, paginate_query, with_session, get_paginated_mods, json_response, \
-    check_mod_editable, check_pack_editable, set_game_info, TRUE_STR, get_page, render_markdown
+from ..common import json_output, with_session, get_paginated_mods, json_response, \
+    check_mod_editable, check_pack_editable, set_game_info, TRUE_STR, render_markdown, \
+    keyset_paginate, add_page_links, cached_count, json_stream_response, conditional, make_etag, \
+    sendfile
 from ..config import _cfg, _cfgi
 from ..database import db
-from ..email import send_update_notification, send_grant_notice, send_password_changed
+from ..email import send_grant_notice, send_password_changed
+from ..kerbdown import resolve_mentions
 from ..objects import GameVersion, Game, Publisher, Mod, Featured, User, ModVersion, SharedAuthor, \
     ModList, EnabledNotification
-from ..search import search_mods, search_users, typeahead_mods, get_mod_score
-from ..thumbnail import thumb_path_from_background_path
+from ..search import search_users, typeahead_mods, get_mod_score
+from ..thumbnail import thumb_path_from_background_path, queue_thumbnail, thumbnail_variants, variant_path
 from ..antivirus import file_contains_malware, quarantine_malware, punish_malware
-from ..purge import purge_download
+from ..celery import scan_mod_version
+from ..changes import changes_since, record_mod_change, record_version_change
+from ..snapshot import SNAPSHOT_PATH, MANIFEST_PATH
+from ..uploads import CompletedUpload, UploadError, discard_pending, discard_upload, hold_upload, receive_chunk, \
+    upload_status
 
 api = Blueprint('api', __name__)
 
@@ -89,6 +96,7 @@ def version_info(mod: Mod, version: ModVersion) -> Dict[str, Any]:
                                  version=version.friendly_version),
         "changelog": version.changelog,
         "downloads": version.download_count,
+        "sha256": version.download_sha256,
     }
 
 
@@ -129,6 +137,35 @@ def publisher_info(publisher: Publisher) -> Dict[str, str]:
     }
 
 
+def mod_etag(mod_id: int) -> Optional[str]:
+    """Changes whenever any of the data that the mod APIs return could have changed"""
+    # description_html only changes along with description
+    mod = db.query(*(c for c in Mod.__table__.columns if c.name != 'description_html'))\
+        .filter(Mod.id == mod_id).first()
+    if not mod or not mod.published:
+        # Errors or only visible to some users
+        return None
+    # Versions waiting for their scan are hidden, releasing them only changes pending_scan
+    versions = db.query(func.count(ModVersion.id), func.max(ModVersion.id),
+                        func.sum(ModVersion.download_count),
+                        func.sum(case((ModVersion.pending_scan, 1), else_=0)))\
+        .filter(ModVersion.mod_id == mod_id).first()
+    authors = db.query(SharedAuthor.user_id, SharedAuthor.accepted)\
+        .filter(SharedAuthor.mod_id == mod_id).order_by(SharedAuthor.id).all()
+    return make_etag(tuple(mod), tuple(versions), authors)
+
+
+def games_etag() -> str:
+    return make_etag(db.query(*Game.__table__.columns).filter(Game.active == True).order_by(Game.id).all())
+
+
+def game_versions_etag(gameid: str) -> str:
+    return make_etag(gameid,
+                     db.query(Game.active).filter(Game.id == gameid).scalar(),
+                     db.query(func.count(GameVersion.id), func.max(GameVersion.id))
+                       .filter(GameVersion.game_id == gameid).first())
+
+
 def user_required(func: Callable[..., Any]) -> Callable[..., Any]:
     @wraps(func)
     def wrapper(*args: str, **kwargs: int) -> str:
@@ -209,6 +246,19 @@ def try_remove_file_and_folder(path: str) -> None:
         pass
 
 
+def _remove_thumbnails(old_background: Optional[str], thumbnail: Optional[str]) -> None:
+    """Removes all the variants of the thumbnail, and of the one that belonged to the old background"""
+    storage = _cfg('storage')
+    if not storage:
+        return
+    thumbnails = {thumbnail} if thumbnail else set()
+    if old_background:
+        thumbnails.add(thumb_path_from_background_path(old_background))
+    for thumb_path in thumbnails:
+        for scale, fmt in thumbnail_variants():
+            try_remove_file_and_folder(os.path.join(storage, variant_path(thumb_path, scale, fmt)))
+
+
 def _get_modversion_paths(mod_name: str, friendly_version: str) -> Tuple[str, str]:
     mod_name_sec = secure_filename(mod_name)
     base_path = os.path.join(current_user.base_path(), mod_name_sec)
@@ -224,13 +274,125 @@ def _get_modversion_paths(mod_name: str, friendly_version: str) -> Tuple[str, st
     return full_path, os.path.join(base_path, filename)
 
 
-def serialize_mod_list(mods: Iterable[Mod]) -> Iterable[Dict[str, Any]]:
-    results = list()
-    for m in mods:
-        a = mod_info(m)
-        a['versions'] = [version_info(m, v) for v in m.versions]
-        results.append(a)
-    return results
+def _receive_zipball() -> Optional[CompletedUpload]:
+    """Stores the chunk of the zipball in this request, returns the upload once all of its chunks arrived"""
+    storage = _cfg('storage')
+    if not storage:
+        abort(json_response({'error': True, 'reason': 'Storage not configured'}, 400))
+    try:
+        return receive_chunk(storage, current_user.id, request.form, request.files['zipball'].stream)
+    except UploadError as e:
+        abort(json_response({'error': True, 'reason': str(e)}, e.status))
+
+
+def _hold_upload(upload: CompletedUpload, version: ModVersion) -> None:
+    """Puts the upload aside for the version until it scanned clean, see antivirus.release_version"""
+    storage = _cfg('storage')
+    if not storage:
+        # _receive_zipball checked it
+        abort(json_response({'error': True, 'reason': 'Storage not configured'}, 400))
+    discard_pending(storage, version.pending_path)
+    version.pending_path = hold_upload(storage, upload)
+    version.pending_size = upload.size
+    version.pending_sha256 = upload.sha256
+
+
+class UrlTemplate:
+    """Builds the same URLs as url_for, without matching the endpoint's rules for every call"""
+
+    def __init__(self, endpoint: str, **converters: str) -> None:
+        url_map = current_app.url_map
+        self.converters = {name: url_map.converters[conv](url_map) for name, conv in converters.items()}
+        placeholders: Dict[str, Any] = {name: (i + 987654321 if conv == 'int' else f'PLACEHOLDER{i}')
+                                        for i, (name, conv) in enumerate(converters.items())}
+        self.template = url_for(endpoint, **placeholders).replace('{', '{{').replace('}', '}}')
+        for name, placeholder in placeholders.items():
+            self.template = self.template.replace(str(placeholder), '{' + name + '}')
+
+    def __call__(self, **values: Any) -> str:
+        return self.template.format(**{name: self.converters[name].to_url(value)
+                                       for name, value in values.items()})
+
+
+class ModUrls:
+    """What serialize_mod_list needs from the request context"""
+
+    def __init__(self) -> None:
+        self.protocol = _cfg('protocol')
+        self.cdn_domain = _cfg('cdn-domain')
+        self.mod = UrlTemplate('mods.mod', mod_id='int', mod_name='path')
+        self.background = UrlTemplate('mods.mod_background', mod_id='int', mod_name='path')
+        self.download = UrlTemplate('mods.download', mod_id='int', mod_name='path', version='default')
+
+
+def iter_mod_list(mods: Iterable[Mod], batch_size: int = 50) -> Iterable[Dict[str, Any]]:
+    """serialize_mod_list for a few mods at a time, for json_stream_response"""
+    urls = ModUrls()
+
+    def batches() -> Iterable[Dict[str, Any]]:
+        batch = []
+        for mod in mods:
+            batch.append(mod)
+            if len(batch) >= batch_size:
+                yield from serialize_mod_list(batch, urls)
+                batch = []
+        if batch:
+            yield from serialize_mod_list(batch, urls)
+
+    return batches()
+
+
+def serialize_mod_list(mods: Iterable[Mod], urls: Optional[ModUrls] = None) -> Iterable[Dict[str, Any]]:
+    """The same as mod_info with version_info for each of the versions,
+    but with a fixed number of queries instead of several per mod"""
+    mods = list(mods)
+    if not mods:
+        return []
+    if urls is None:
+        urls = ModUrls()
+    game_names = dict(db.query(Game.id, Game.name).filter(Game.id.in_({m.game_id for m in mods})))
+    usernames = dict(db.query(User.id, User.username).filter(User.id.in_({m.user_id for m in mods})))
+    versions: Dict[int, List[Any]] = {m.id: [] for m in mods}
+    for v in db.query(ModVersion.mod_id, ModVersion.id, ModVersion.friendly_version,
+                      GameVersion.friendly_version.label('game_version'), ModVersion.created,
+                      ModVersion.changelog, ModVersion.download_count, ModVersion.download_sha256)\
+               .outerjoin(GameVersion, GameVersion.id == ModVersion.gameversion_id)\
+               .filter(ModVersion.mod_id.in_(versions), ModVersion.pending_scan == False)\
+               .order_by(ModVersion.sort_index.desc(), ModVersion.id):
+        versions[v.mod_id].append(v)
+    return [{
+        "name": mod.name,
+        "id": mod.id,
+        "game": game_names.get(mod.game_id),
+        "game_id": mod.game_id,
+        "short_description": mod.short_description,
+        "downloads": mod.download_count,
+        "followers": mod.follower_count,
+        "author": usernames.get(mod.user_id),
+        "default_version_id": mod.default_version_id,
+        "shared_authors": list(),
+        # Mod.background_url
+        "background": (None if not mod.background
+                       else f'{urls.protocol}://{urls.cdn_domain}/{mod.background}'
+                       if urls.protocol and urls.cdn_domain
+                       else urls.background(mod_id=mod.id, mod_name=mod.name)),
+        "bg_offset_y": mod.bgOffsetY,
+        "license": mod.license,
+        "website": mod.external_link,
+        "donations": mod.donation_link,
+        "source_code": mod.source_link,
+        "url": urls.mod(mod_id=mod.id, mod_name=mod.name),
+        "versions": [{
+            "friendly_version": v.friendly_version,
+            "game_version": v.game_version,
+            "id": v.id,
+            "created": v.created,
+            "download_path": urls.download(mod_id=mod.id, mod_name=mod.name, version=v.friendly_version),
+            "changelog": v.changelog,
+            "downloads": v.download_count,
+            "sha256": v.download_sha256,
+        } for v in versions[mod.id]],
+    } for mod in mods]
 
 
 @api.route("/api/kspversions")
@@ -241,6 +403,7 @@ def kspversions_list() -> Tuple[Dict[str, Any], int]:
 
 
 @api.route("/api/<gameid>/versions")
+@conditional(game_versions_etag)
 @json_output
 def gameversions_list(gameid: str) -> Union[List[Dict[str, Any]], Tuple[List[Dict[str, Any]], int]]:
     game = Game.query.get(gameid)
@@ -271,6 +434,7 @@ def game_notifications_list(gameid: str) -> Union[List[Dict[str, Any]], Tuple[Li
 
 
 @api.route("/api/games")
+@conditional(games_etag)
 @json_output
 def games_list() -> List[Dict[str, Any]]:
     results = list()
@@ -298,11 +462,11 @@ def typeahead_mod() -> Iterable[Dict[str, Any]]:
 
 @api.route("/api/search/mod")
 @json_output
-def search_mod() -> Iterable[Dict[str, Any]]:
+def search_mod() -> werkzeug.wrappers.Response:
     query = request.args.get('query')
     query = '' if not query else query
-    page = get_page()
-    return serialize_mod_list(search_mods(None, query, page, 30)[0])
+    page = get_paginated_mods(query=query)
+    return add_page_links(json_stream_response(iter_mod_list(page.items)), page)
 
 
 @api.route("/api/search/user")
@@ -336,7 +500,7 @@ def game_filters(query: Query, game_id: Optional[int], game_version_id: Optional
 
 @api.route("/api/browse")
 @json_output
-def browse() -> Dict[str, Any]:
+def browse() -> werkzeug.wrappers.Response:
     # get params
     per_page = request.args.get('count', 30)
     game_id = request.args.get('game_id')
@@ -350,9 +514,8 @@ def browse() -> Dict[str, Any]:
     # get mods
     mods = Mod.query.filter(Mod.published)
     mods = game_filters(mods, game_id, game_version_id, game_version)
-    # detect total pages
-    count = mods.count()
-    total_pages = max(math.ceil(count / per_page), 1)
+    # detect total (cached for a while)
+    count = cached_count(mods)
     # order by field
     orderby = request.args.get('orderby')
     if orderby == "name":
@@ -361,54 +524,76 @@ def browse() -> Dict[str, Any]:
         orderby = Mod.updated
     else:
         orderby = Mod.created
-    # order direction
-    order = request.args.get('order')
-    if order == "desc":
-        mods = mods.order_by(desc(orderby))
-    else:
-        mods = mods.order_by(asc(orderby))
-    # current page
-    page = request.args.get('page', 1)
-    try:
-        page = max(int(page), 1)
-    except (ValueError, TypeError):
-        page = 1
-    mods = mods.offset(per_page * (page - 1)).limit(per_page)
+    # order direction, the cursors for the previous and next page are in the Link header
+    page = keyset_paginate(mods, [orderby, Mod.id], per_page, descending=request.args.get('order') == "desc")
     # generate result
-    return {
+    return add_page_links(json_stream_response(iter_mod_list(page.items), {
         "total": count,
         "count": per_page,
-        "pages": total_pages,
-        "page": page,
-        "result": serialize_mod_list(mods)
-    }
+        "pages": max(page.total_pages, 1),
+        "page": page.page,
+    }, "result"), page)
 
 
 @api.route("/api/browse/new")
 @json_output
-def browse_new() -> Iterable[Dict[str, Any]]:
+def browse_new() -> werkzeug.wrappers.Response:
     game_id = request.args.get('game_id')
     game_version = request.args.get('game_version')
     game_version_id = request.args.get('game_version_id')
-    mods = Mod.query.filter(Mod.published).order_by(Mod.created.desc())
+    mods = Mod.query.filter(Mod.published)
     mods = game_filters(mods, game_id, game_version_id, game_version)
-    mods, page, total_pages = paginate_query(mods)
-    return serialize_mod_list(mods)
+    page = keyset_paginate(mods, [Mod.created, Mod.id])
+    return add_page_links(json_stream_response(iter_mod_list(page.items)), page)
 
 
 @api.route("/api/browse/top")
 @json_output
-def browse_top() -> Iterable[Dict[str, Any]]:
-    mods, *_ = get_paginated_mods()
-    return serialize_mod_list(mods)
+def browse_top() -> werkzeug.wrappers.Response:
+    page = get_paginated_mods()
+    return add_page_links(json_response(serialize_mod_list(page.items)), page)
 
 
 @api.route("/api/browse/featured")
 @json_output
-def browse_featured() -> Iterable[Dict[str, Any]]:
-    mods = Featured.query.order_by(Featured.priority.desc())
-    mods, page, total_pages = paginate_query(mods)
-    return serialize_mod_list((f.mod for f in mods))
+def browse_featured() -> werkzeug.wrappers.Response:
+    page = keyset_paginate(Featured.query.options(joinedload(Featured.mod)), [Featured.priority, Featured.id])
+    return add_page_links(json_stream_response(iter_mod_list(f.mod for f in page.items)), page)
+
+
+@api.route("/api/changes")
+@json_output
+def changes() -> Union[Dict[str, Any], Tuple[Dict[str, Any], int]]:
+    # Pass the last response's "next" as since to get what changed after it
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(max(int(request.args.get('count', 100)), 1), 500)
+    except (ValueError, TypeError):
+        return {'error': True, 'reason': 'since and count have to be numbers.'}, 400
+    events, more = changes_since(since, limit)
+    return {
+        "changes": [{
+            "type": e.object_type,
+            "id": e.object_id,
+            "mod_id": e.mod_id,
+            "change": e.change_type,
+            "time": e.created,
+            "cursor": e.id,
+        } for e in events],
+        "next": events[-1].id if events else since,
+        "more": more,
+    }
+
+
+@api.route("/api/snapshot")
+def snapshot() -> werkzeug.wrappers.Response:
+    # Written by celery every snapshot-interval seconds
+    return sendfile(SNAPSHOT_PATH)
+
+
+@api.route("/api/snapshot/manifest")
+def snapshot_manifest() -> werkzeug.wrappers.Response:
+    return sendfile(MANIFEST_PATH, attachment=False)
 
 
 @api.route("/api/login", methods=['POST'])
@@ -430,7 +615,9 @@ def login() -> Union[Dict[str, Any], Tuple[Dict[str, Any], int]]:
 
 
 @api.route("/api/mod/<int:mod_id>")
+@conditional(mod_etag)
 @json_output
+@with_session
 def mod_info_api(mod_id: int) -> Union[Dict[str, Any], Tuple[Dict[str, Any], int]]:
     mod = Mod.query.get(mod_id)
     if not mod:
@@ -446,9 +633,13 @@ def mod_info_api(mod_id: int) -> Union[Dict[str, Any], Tuple[Dict[str, Any], int
         if author.accepted:
             info["shared_authors"].append(user_info(author.user))
     for v in mod.versions:
-        info["versions"].append(version_info(mod, v))
+        if not v.pending_scan:
+            info["versions"].append(version_info(mod, v))
+    if mod.description_html is None and mod.description:
+        # Saved before the HTML was stored, render_mod_descriptions hasn't caught up yet
+        mod.description_html = render_markdown(mod.description)
     info["description"] = mod.description
-    info["description_html"] = str(current_app.jinja_env.filters['markdown'](mod.description))
+    info["description_html"] = resolve_mentions(mod.description_html)
     return info
 
 
@@ -461,7 +652,8 @@ def mod_version(mod_id: int, version: str) -> Union[Dict[str, Any], Tuple[Dict[s
         v = mod.default_version
     elif version.isdigit():
         v = ModVersion.query.filter(ModVersion.mod == mod,
-                                    ModVersion.id == int(version)).first()
+                                    ModVersion.id == int(version),
+                                    ModVersion.pending_scan == False).first()
     else:
         return {'error': True, 'reason': 'Invalid version.'}, 400
     if not v:
@@ -471,6 +663,7 @@ def mod_version(mod_id: int, version: str) -> Union[Dict[str, Any], Tuple[Dict[s
 
 
 @api.route("/api/ksp-avc/<int:mod_id>")
+@conditional(mod_etag)
 @json_output
 def remote_version_file(mod_id: int) -> Dict[str, Any]:
     mod = _get_mod(mod_id)
@@ -609,15 +802,11 @@ def update_mod_background(mod_id: int) -> Dict[str, Any]:
     if new_path:
         mod.background = new_path
         # Remove the old thumbnail
-        storage = _cfg('storage')
-        if storage:
-            if mod.thumbnail:
-                try_remove_file_and_folder(os.path.join(storage, mod.thumbnail))
-            if old_path and (calc_path := thumb_path_from_background_path(old_path)) != mod.thumbnail:
-                try_remove_file_and_folder(os.path.join(storage, calc_path))
+        _remove_thumbnails(old_path, mod.thumbnail)
         mod.thumbnail = None
-        # Generate the new thumbnail
-        mod.background_thumb()
+        # Celery has to see the new background
+        db.commit()
+        queue_thumbnail('mod', mod)
         send_change_notifications(mod, 'update-background')
         return {'path': mod.background_url(_cfg('protocol'), _cfg('cdn-domain'))}
     return {'path': None}
@@ -658,15 +847,11 @@ def update_pack_background(pack_id: int) -> Union[Dict[str, Any], Tuple[Dict[str
         if new_path:
             pack.background = new_path
             # Remove the old thumbnail
-            storage = _cfg('storage')
-            if storage:
-                if pack.thumbnail:
-                    try_remove_file_and_folder(os.path.join(storage, pack.thumbnail))
-                if old_path and (calc_path := thumb_path_from_background_path(old_path)) != pack.thumbnail:
-                    try_remove_file_and_folder(os.path.join(storage, calc_path))
+            _remove_thumbnails(old_path, pack.thumbnail)
             pack.thumbnail = None
-            # Generate the new thumbnail
-            pack.background_thumb()
+            # Celery has to see the new background
+            db.commit()
+            queue_thumbnail('pack', pack)
             return {'path': pack.background_url(_cfg('protocol'), _cfg('cdn-domain'))}
     except Exception as exc:
         return {'error': True, 'reason': f'{exc}'}, 200
@@ -686,14 +871,11 @@ def update_game_background(game_id: int) -> Union[Dict[str, Any], Tuple[Dict[str
             new_path = _update_image(old_path, base_name, 'game')
             if new_path:
                 game.background = new_path
-                storage = _cfg('storage')
-                if storage:
-                    if game.thumbnail:
-                        try_remove_file_and_folder(os.path.join(storage, game.thumbnail))
-                    if old_path and  (calc_path := thumb_path_from_background_path(old_path)) != game.thumbnail:
-                        try_remove_file_and_folder(os.path.join(storage, calc_path))
+                _remove_thumbnails(old_path, game.thumbnail)
                 game.thumbnail = None
-                game.background_thumb()
+                # Celery has to see the new background
+                db.commit()
+                queue_thumbnail('game', game)
                 return {'path': game.background_url(_cfg('protocol'), _cfg('cdn-domain'))}
         except Exception as exc:
             return {'error': True, 'reason': f'{exc}'}, 200
@@ -782,9 +964,13 @@ def revoke_mod(mod_id: int) -> Tuple[Dict[str, Any], int]:
 def set_default_version(mod_id: int, vid: int) -> Tuple[Dict[str, Any], int]:
     mod = _get_mod(mod_id)
     _check_mod_editable(mod)
-    if not any([v.id == vid for v in mod.versions]):
+    version = next((v for v in mod.versions if v.id == vid), None)
+    if not version:
         return {'error': True, 'reason': 'This mod does not have the specified version.'}, 404
+    if version.pending_scan:
+        return {'error': True, 'reason': 'This version has not been scanned for malware yet.'}, 400
     mod.default_version_id = vid
+    record_mod_change(mod, 'updated')
     send_change_notifications(mod, 'default-version-set')
     return {'error': False}, 200
 
@@ -854,36 +1040,24 @@ def create_mod() -> Tuple[Dict[str, Any], int]:
     if not game_version:
         return {'error': True, 'reason': 'Game version does not exist.'}, 400
 
-    full_path, relative_path = _get_modversion_paths(mod_name, mod_friendly_version)
-    how_many_chunks = int(request.form.get('dztotalchunkcount', 1))
-    which_chunk = int(request.form.get('dzchunkindex', 0))
-    if which_chunk == 0:
-        if os.path.isfile(full_path):
-            os.remove(full_path)
-
-    with open(full_path, 'ab') as f:
-        f.seek(int(request.form.get('dzchunkbyteoffset', 0)))
-        f.write(request.files['zipball'].stream.read())
-
-    if which_chunk + 1 == how_many_chunks:
+    upload = _receive_zipball()
+    if upload:
         # Last chunk, create the records
-        if not zipfile.is_zipfile(full_path):
-            os.remove(full_path)
+        full_path, relative_path = _get_modversion_paths(mod_name, mod_friendly_version)
+        if not zipfile.is_zipfile(upload.path):
+            discard_upload(upload)
             return {'error': True, 'reason': f'{full_path} is not a valid zip file.'}, 400
-
-        if file_contains_malware(full_path):
-            quarantine_malware(full_path)
-            punish_malware(current_user)
-            return {'error': True, 'reason': 'Malware detected in upload'}, 400
-
         version = ModVersion(friendly_version=mod_friendly_version,
                              gameversion_id=game_version.id,
-                             download_path=relative_path)
+                             download_path=relative_path,
+                             pending_scan=True)
+        _hold_upload(upload, version)
         # create the mod
         mod = Mod(user=current_user,
                   name=mod_name,
                   short_description=short_description,
                   description=description,
+                  description_html=render_markdown(description),
                   license=mod_license,
                   game=game,
                   default_version=version)
@@ -891,6 +1065,8 @@ def create_mod() -> Tuple[Dict[str, Any], int]:
         # Save database entry
         db.add(mod)
         db.commit()
+        # The version is recorded once it's released
+        record_mod_change(mod, 'created')
         for notif_id in map(int, filter(lambda x: x.isdigit(),
                                         request.form.getlist('notifications'))):
             # Make sure it's allowed for this game
@@ -899,16 +1075,35 @@ def create_mod() -> Tuple[Dict[str, Any], int]:
                                            mod_id=mod.id))
         mod.score = get_mod_score(mod)
         db.commit()
+        scan_mod_version.delay(version.id, current_user.id)
         set_game_info(game)
         # We never send notifications here because it's not published yet
         return {
             'url': url_for("mods.mod", mod_id=mod.id, mod_name=mod.name) + '?new=true',
             "id": mod.id,
-            "name": mod.name
+            "name": mod.name,
+            "sha256": upload.sha256
         }, 202
 
     return { }, 202
 
+
+@api.route('/api/upload/<session_id>')
+@json_output
+@user_required
+def upload_info(session_id: str) -> Tuple[Dict[str, Any], int]:
+    storage = _cfg('storage')
+    if not storage:
+        return {'error': True, 'reason': 'Storage not configured'}, 400
+    try:
+        status = upload_status(storage, current_user.id, session_id)
+    except UploadError as e:
+        return {'error': True, 'reason': str(e)}, e.status
+    if not status:
+        return {'error': True, 'reason': 'Upload not found.'}, 404
+    return status, 200
+
+
 # This is called by dropzone
 @api.route('/api/mod/<int:mod_id>/update', methods=['POST'])
 @with_session
@@ -935,51 +1130,33 @@ def update_mod(mod_id: int) -> Tuple[Dict[str, Any], int]:
                           'Did you mistype the version number?'
             }, 400
 
-    full_path, relative_path = _get_modversion_paths(mod.name, friendly_version)
-    how_many_chunks = int(request.form.get('dztotalchunkcount', 1))
-    which_chunk = int(request.form.get('dzchunkindex', 0))
-    if which_chunk == 0:
-        if os.path.isfile(full_path):
-            os.remove(full_path)
-
-    with open(full_path, 'ab') as f:
-        f.seek(int(request.form.get('dzchunkbyteoffset', 0)))
-        f.write(request.files['zipball'].stream.read())
-
-    if which_chunk + 1 == how_many_chunks:
+    upload = _receive_zipball()
+    if upload:
         # Last chunk, make records
-        if not zipfile.is_zipfile(full_path):
-            os.remove(full_path)
-            return {'error': True, 'reason': f'{full_path} {which_chunk}/{how_many_chunks} is not a valid zip file.'}, 400
-
-        if file_contains_malware(full_path):
-            quarantine_malware(full_path)
-            punish_malware(current_user)
-            return {'error': True, 'reason': f'Malware detected in upload'}, 400
-
+        full_path, relative_path = _get_modversion_paths(mod.name, friendly_version)
+        if not zipfile.is_zipfile(upload.path):
+            discard_upload(upload)
+            return {'error': True, 'reason': f'{full_path} is not a valid zip file.'}, 400
         changelog: Optional[str] = request.form.get('changelog')
         version = ModVersion(friendly_version=friendly_version,
                              gameversion_id=game_version.id,
                              download_path=relative_path,
                              changelog=changelog,
-                             changelog_html=render_markdown(changelog))
+                             changelog_html=render_markdown(changelog),
+                             pending_scan=True)
+        _hold_upload(upload, version)
         # Assign a sort index
         if mod.versions:
             version.sort_index = max(v.sort_index for v in mod.versions) + 1
         version.mod = mod
-        version.download_size = os.path.getsize(full_path)
-        mod.default_version = version
-        mod.updated = datetime.now()
-        db.commit()
-        mod.score = get_mod_score(mod)
         db.commit()
+        # Becomes the default and gets announced once it scanned clean
         notify = request.form.get('notify-followers', '').lower()
-        if notify in TRUE_STR:
-            send_update_notification(mod, version, current_user)
-        send_change_notifications(mod, 'update')
+        scan_mod_version.delay(version.id, current_user.id, update=True, notify_followers=notify in TRUE_STR)
         return {
             'url': url_for("mods.mod", mod_id=mod.id, mod_name=mod.name),
-            'id': version.id
+            'id': version.id,
+            'sha256': upload.sha256
         }, 202
 
     return { }, 202
@@ -1004,25 +1181,16 @@ def edit_version(mod_id: int) -> Tuple[Dict[str, Any], int]:
     version.changelog = request.form.get('changelog')
     version.changelog_html = render_markdown(version.changelog)
     mod.updated = datetime.now()
+    record_version_change(version, 'updated')
 
     # Handle the chunks if sent
-    if 'dztotalchunkcount' in request.form:
-        storage = _cfg('storage')
-        if not storage:
-            return {'error': True, 'reason': 'Storage not configured'}, 400
-        full_path = os.path.join(storage, version.download_path)
-        how_many_chunks = int(request.form.get('dztotalchunkcount', 1))
-        which_chunk = int(request.form.get('dzchunkindex', 0))
-        if which_chunk == 0:
-            if os.path.isfile(full_path):
-                os.remove(full_path)
-                purge_download(full_path)
-        with open(full_path, 'ab') as f:
-            f.seek(int(request.form.get('dzchunkbyteoffset', 0)))
-            f.write(request.files['zipball'].stream.read())
-        if which_chunk + 1 == how_many_chunks:
-            version.download_size = os.path.getsize(full_path)
-            version.created = datetime.now()
+    if 'zipball' in request.files:
+        upload = _receive_zipball()
+        if upload:
+            # The old file stays downloadable until the new one scanned clean
+            _hold_upload(upload, version)
+            db.commit()
+            scan_mod_version.delay(version.id, current_user.id)
     return {
         'url': url_for("mods.mod", _anchor='changelog',
                        mod_id=mod.id, mod_name=mod.name),
@@ -7,7 +7,7 @@ from sqlalchemy import or_
 import werkzeug.wrappers
 
 from ..config import _cfg
-from ..common import loginrequired, with_session, get_game_info, paginate_query, sendfile
+from ..common import loginrequired, with_session, get_game_info, paginate_query, sendfile, send_thumbnail
 from ..database import db
 from ..objects import Mod, ModList, ModListItem, Game
 
@@ -162,4 +162,4 @@ def list_thumbnail(pack_id: int, pack_name: str) -> werkzeug.wrappers.Response:
         # However, it's possible that someone calls this manually.
         abort(404)
 
-    return sendfile(pack.thumbnail, False)
+    return send_thumbnail(pack.thumbnail)
@@ -1,35 +1,47 @@
+import csv
+import io
 import logging
 import os
 import random
 import re
 from datetime import datetime, timedelta
 from shutil import rmtree
-from typing import Any, Dict, Tuple, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, Tuple, Optional, Union
 
 from sqlalchemy import func
 import werkzeug.wrappers
-import user_agents
 
-from flask import Blueprint, render_template, make_response, url_for, abort, session, \
-    redirect, request
+from flask import Blueprint, render_template, url_for, abort, session, \
+    redirect, request, Response, stream_with_context
 from flask_login import current_user
 from urllib.parse import urlparse
 
 from .api import default_description
 from ..notification import send_add_notifications, send_change_notifications, send_add_notification, send_change_notification
-from ..common import get_game_info, set_game_info, with_session, dumb_object, loginrequired, \
+from ..common import get_game_info, set_game_info, with_session, loginrequired, \
     json_output, adminrequired, check_mod_editable, TRUE_STR, \
-    get_referral_events, get_download_events, get_follow_events, get_games, sendfile, render_markdown
+    get_referral_events, get_games, sendfile, send_thumbnail, render_markdown
 from ..config import _cfg
 from ..database import db
 from ..email import send_autoupdate_notification, send_mod_locked
-from ..objects import Mod, ModVersion, DownloadEvent, FollowEvent, ReferralEvent, \
+from ..objects import Mod, ModVersion, FollowEvent, ReferralEvent, \
     Featured, GameVersion, Game, Following, Notification, EnabledNotification
 from ..search import get_mod_score
 from ..purge import purge_download
+from ..blobs import release_blobs
+from ..download_counter import download_counter
+from ..referral_counter import referral_counter
+from ..user_agent import classify_user_agent
+from ..changes import record_mod_change, record_version_change
+from ..uploads import discard_pending
+from ..rollups import GRANULARITIES, STREAM_BATCH, get_download_stats, get_follow_stats, \
+    iter_download_stats, iter_follow_stats, hourly_stats_since
 
 mods = Blueprint('mods', __name__)
 
+# CSV exports are sent in pieces of about this many characters
+CSV_CHUNK_SIZE = 64 * 1024
+
 SOURCE_REPOSITORY_URL_PATTERN = re.compile(
     r'^https://git(hub|lab).com/(?P<repo_short>[^/]+/[^/]+)/?'
 )
@@ -114,30 +126,21 @@ def mod(mod_id: int, mod_name: str) -> Union[str, werkzeug.wrappers.Response]:
             editable = True
     if not mod.published and not editable:
         abort(403, 'Unfortunately we couldn\'t display the requested mod. Maybe it\'s not public yet?')
+    if mod.description_html is None and mod.description:
+        mod.description_html = render_markdown(mod.description)
     latest = mod.default_version or (mod.versions[0] if len(mod.versions) > 0 else None)
     referral = request.referrer
     if referral:
         host = urlparse(referral).hostname
-        event = ReferralEvent.query\
-            .filter(ReferralEvent.mod_id == mod.id, ReferralEvent.host == host)\
-            .first()
-        if not event:
-            event = ReferralEvent()
-            event.mod = mod
-            event.events = 1
-            event.host = host
-            db.add(event)
-            db.flush()
-            db.commit()
-            mod.referrals.append(event)
-        else:
-            event.events += 1
+        if host:
+            referral_counter.count(mod.id, host)
     referrals = [{'host': ref.host, 'count': ref.events} for ref in get_referral_events(mod.id, 10)]
-    download_stats = [dumb_object(d) for d in get_download_events(mod.id, timedelta(days=30))][::-1]
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    download_stats = [d._asdict() for d in get_download_stats(mod.id, thirty_days_ago)]
     downloads_per_version = [(ver.id, ver.friendly_version, ver.download_count)
                              for ver
                              in sorted(mod.versions, key=lambda ver: ver.id)]
-    follower_stats = [dumb_object(f) for f in get_follow_events(mod.id, timedelta(days=30))]
+    follower_stats = [f._asdict() for f in get_follow_stats(mod.id, thirty_days_ago)]
 
     json_versions = list()
     size_versions = dict()
@@ -265,7 +268,7 @@ def mod_thumbnail(mod_id: int, mod_name: str) -> werkzeug.wrappers.Response:
         # However, it's possible that someone calls this manually.
         abort(404)
 
-    return sendfile(mod.thumbnail, False)
+    return send_thumbnail(mod.thumbnail)
 
 
 @mods.route("/mod/<int:mod_id>/<path:mod_name>/edit", methods=['GET', 'POST'])
@@ -303,6 +306,7 @@ def edit_mod(mod_id: int, mod_name: str) -> Union[str, werkzeug.wrappers.Respons
         if not isinstance(description, str):
             description = str(description)
         mod.description = description.replace('\r\n', '\n')
+        mod.description_html = render_markdown(mod.description)
         mod.score = get_mod_score(mod)
         if not mod.license:
             return render_template("edit_mod.html", mod=mod, error="All mods must have a license.")
@@ -311,6 +315,10 @@ def edit_mod(mod_id: int, mod_name: str) -> Union[str, werkzeug.wrappers.Respons
         newly_published = False
         if request.form.get('publish', None):
             if not mod.published:
+                if mod.default_version.pending_scan:
+                    return render_template("edit_mod.html", mod=mod,
+                                           error="The mod can be published once its download "
+                                                 "has been scanned for malware.")
                 newly_published = True
                 mod.published = True
         # Get the checked notification checkboxes, filtering by whether they're allowed for this game
@@ -339,6 +347,7 @@ def edit_mod(mod_id: int, mod_name: str) -> Union[str, werkzeug.wrappers.Respons
             mod.bgOffsetY = int(bgOffsetY)
         except:
             pass
+        record_mod_change(mod, 'published' if newly_published else 'updated')
         return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
 
 
@@ -350,37 +359,73 @@ def create_mod() -> str:
     return render_template("create.html", games=get_games(), ga=ga)
 
 
+def _stats_range() -> Tuple[Optional[datetime], Optional[datetime], str]:
+    """The from and to dates and the granularity of a stats export, from the query string"""
+    try:
+        since, until = (datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                        for name in ('from', 'to'))
+    except ValueError:
+        abort(400)
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        abort(400)
+    if granularity == 'hour':
+        # Older hours are only left in the daily rollups, so they would look like hours without downloads
+        kept_since = hourly_stats_since()
+        if not since:
+            since = kept_since
+        elif since < kept_since:
+            abort(400, f'Hourly stats are only kept since {kept_since:%Y-%m-%d}, use a later from date or days')
+    return since, until, granularity
+
+
+def _stream_csv(filename: str, header: Iterable[str], rows: Iterable[Iterable[Any]]) -> werkzeug.wrappers.Response:
+    def generate() -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CSV_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    # The rows are fetched while the response is sent, so the request's database session has to stay around
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment;filename={filename}'})
+
+
 @mods.route("/mod/<int:mod_id>/stats/downloads", defaults={'mod_name': None})
 @mods.route("/mod/<int:mod_id>/<path:mod_name>/stats/downloads")
 def export_downloads(mod_id: int, mod_name: str) -> werkzeug.wrappers.Response:
     mod, game = _get_mod_game_info(mod_id)
-    download_stats = get_download_events(mod.id)
-    response = make_response(render_template("downloads.csv", stats=download_stats))
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment;filename=downloads.csv'
-    return response
+    versions = dict(ModVersion.query.with_entities(ModVersion.id, ModVersion.friendly_version)
+                    .filter(ModVersion.mod_id == mod.id))
+    return _stream_csv('downloads.csv', ('Date', 'Downloads', 'Mod Version'),
+                       ((s.created, s.downloads, versions.get(s.version_id, ''))
+                        for s in iter_download_stats(mod.id, *_stats_range())))
 
 
 @mods.route("/mod/<int:mod_id>/stats/followers", defaults={'mod_name': None})
 @mods.route("/mod/<int:mod_id>/<path:mod_name>/stats/followers")
 def export_followers(mod_id: int, mod_name: str) -> werkzeug.wrappers.Response:
     mod, game = _get_mod_game_info(mod_id)
-    follower_stats = get_follow_events(mod.id)
-    response = make_response(render_template("followers.csv", stats=follower_stats))
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment;filename=followers.csv'
-    return response
+    return _stream_csv('followers.csv', ('Date', 'Delta', 'Events'),
+                       ((s.created, s.delta, s.events)
+                        for s in iter_follow_stats(mod.id, *_stats_range())))
 
 
 @mods.route("/mod/<int:mod_id>/stats/referrals", defaults={'mod_name': None})
 @mods.route("/mod/<int:mod_id>/<path:mod_name>/stats/referrals")
 def export_referrals(mod_id: int, mod_name: str) -> werkzeug.wrappers.Response:
     mod, game = _get_mod_game_info(mod_id)
-    referral_stats = get_referral_events(mod.id)
-    response = make_response(render_template("referrals.csv", stats=referral_stats))
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment;filename=referrals.csv'
-    return response
+    return _stream_csv('referrals.csv', ('Events', 'Host'),
+                       ReferralEvent.query.with_entities(ReferralEvent.events, ReferralEvent.host)
+                       .filter(ReferralEvent.mod_id == mod.id)
+                       .order_by(ReferralEvent.events.desc())
+                       .yield_per(STREAM_BATCH))
 
 
 @mods.route("/mod/<int:mod_id>/delete", methods=['POST'])
@@ -402,8 +447,15 @@ def delete(mod_id: int) -> werkzeug.wrappers.Response:
     if storage:
         full_path = os.path.join(storage, mod.base_path())
         rmtree(full_path, ignore_errors=True)
+    record_mod_change(mod, 'deleted')
+    hashes = [v.download_sha256 for v in mod.versions]
+    if storage:
+        for v in mod.versions:
+            discard_pending(storage, v.pending_path)
     db.delete(mod)
     db.commit()
+    if storage:
+        release_blobs(storage, hashes)
     send_change_notifications(mod, 'delete', True)
 
     return redirect("/profile/" + current_user.username)
@@ -562,9 +614,12 @@ def publish(mod_id: int, mod_name: str) -> werkzeug.wrappers.Response:
         abort(400)
     if mod.description == default_description:
         return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name, stupid_user=True))
+    if mod.default_version.pending_scan:
+        abort(400, 'The mod can be published once its download has been scanned for malware.')
     mod.published = True
     mod.updated = datetime.now()
     mod.score = get_mod_score(mod)
+    record_mod_change(mod, 'published')
     send_add_notifications(mod)
     return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
 
@@ -581,6 +636,7 @@ def lock(mod_id: int) -> werkzeug.wrappers.Response:
     mod.published = False
     mod.locked_by = current_user
     mod.lock_reason = request.form.get('reason')
+    record_mod_change(mod, 'locked')
     send_mod_locked(mod, mod.user)
     send_change_notifications(mod, 'locked', True)
     return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
@@ -601,9 +657,9 @@ def unlock(mod_id: int) -> werkzeug.wrappers.Response:
     return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
 
 
-def _allow_download(mod: Mod) -> bool:
+def _allow_download(published: bool, owner_id: int) -> bool:
     # Anyone can download published mods
-    if mod.published:
+    if published:
         return True
     # No user context, can't access unpublished
     if not current_user:
@@ -612,59 +668,55 @@ def _allow_download(mod: Mod) -> bool:
     if current_user.admin:
         return True
     # Mod authors can download their own unpublished mods
-    if current_user.id == mod.user_id:
+    if current_user.id == owner_id:
         return True
     # But nobody else can
     return False
 
 
+def _download_target(mod_id: int, version: Optional[str]) -> Any:
+    """Only the columns a download needs, in one query that goes through the primary keys or the mod's versions"""
+    target = db.query(ModVersion.id, ModVersion.download_path, ModVersion.pending_scan,
+                      Mod.name, Mod.published, Mod.user_id, Mod.game_id)
+    if not version or version == 'download':
+        target = target.join(Mod, Mod.default_version_id == ModVersion.id)
+    else:
+        target = target.join(Mod, Mod.id == ModVersion.mod_id)\
+            .filter(ModVersion.friendly_version == version)\
+            .order_by(ModVersion.sort_index.desc())
+    return target.filter(Mod.id == mod_id).first()
+
+
 @mods.route('/mod/<int:mod_id>/download/<version>', defaults={'mod_name': None})
 @mods.route('/mod/<int:mod_id>/download', defaults={'mod_name': None, 'version': None})
 @mods.route('/mod/<int:mod_id>/<path:mod_name>/download', defaults={'version': None})
 @mods.route('/mod/<int:mod_id>/<path:mod_name>/download/<version>')
-@with_session
-def download(mod_id: int, mod_name: Optional[str], version: Optional[str]) -> Optional[werkzeug.wrappers.Response]:
-    mod, game = _get_mod_game_info(mod_id)
-    if not _allow_download(mod):
-        abort(403, 'Unfortunately the requested mod isn\'t available for download. Maybe it\'s not public yet?')
-    mod_version = mod.default_version if not version or version == 'download' \
-        else next(filter(lambda v: v.friendly_version == version, mod.versions), None)
-    if not mod_version:
+def download(mod_id: int, mod_name: Optional[str], version: Optional[str]) -> werkzeug.wrappers.Response:
+    # Most requests to the site are downloads, so this doesn't load the mod, write to the session or the database,
+    # the downloads are counted in the background
+    target = _download_target(mod_id, version)
+    if not target or not target.game_id:
         abort(404, 'Unfortunately we couldn\'t find the requested mod version. Maybe it got deleted?')
-    ua = user_agents.parse(request.user_agent.string)
+    if not _allow_download(target.published, target.user_id):
+        abort(403, 'Unfortunately the requested mod isn\'t available for download. Maybe it\'s not public yet?')
+    if target.pending_scan:
+        abort(404, 'This version is being scanned for malware, it can be downloaded once that\'s done.')
+    ua = classify_user_agent(request.user_agent.string)
     # Only count download events from non-bots
     if not ua.is_bot:
         if 'Range' not in request.headers:
-            # Events are aggregated hourly
-            an_hour_ago = datetime.now() - timedelta(hours=1)
-            download = DownloadEvent.query\
-                .filter(DownloadEvent.version_id == mod_version.id, DownloadEvent.created > an_hour_ago)\
-                .order_by(DownloadEvent.created.desc())\
-                .first()
-            if not download:
-                download = DownloadEvent()
-                download.mod = mod
-                download.version = mod_version
-                download.downloads = 1
-                db.add(download)
-                db.flush()
-                db.commit()
-                mod.downloads.append(download)
-            else:
-                download.downloads += 1
-            mod.download_count += 1
-            mod_version.download_count += 1
-            mod.score = get_mod_score(mod)
-    elif 'discord'.casefold() in ua.browser.family.casefold():
+            # Written to the database in the background, aggregated hourly
+            download_counter.count(mod_id, target.id)
+    elif ua.is_discord:
         # Send HTML to Discord so it can see the OpenGraph tags
-        return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
+        return redirect(url_for("mods.mod", mod_id=mod_id, mod_name=target.name))
 
     protocol = _cfg("protocol")
     cdn_domain = _cfg("cdn-domain")
     if protocol and cdn_domain:
-        return redirect(protocol + '://' + cdn_domain + '/' + mod_version.download_path, code=302)
+        return redirect(protocol + '://' + cdn_domain + '/' + target.download_path, code=302)
 
-    return sendfile(mod_version.download_path)
+    return sendfile(target.download_path)
 
 
 @mods.route('/mod/<int:mod_id>/version/<version_id>/delete', methods=['POST'])
@@ -683,15 +735,22 @@ def delete_version(mod_id: int, version_id: str) -> werkzeug.wrappers.Response:
     if version.mod != mod:
         abort(400)
 
-    purge_download(version[0].download_path)
+    purge_download(version.download_path)
 
     storage = _cfg('storage')
     if storage:
         full_path = os.path.join(storage, version.download_path)
-        os.remove(full_path)
+        # Versions that are still waiting for their scan have no file there yet
+        if os.path.isfile(full_path):
+            os.remove(full_path)
+        discard_pending(storage, version.pending_path)
 
+    record_version_change(version, 'deleted')
+    sha256 = version.download_sha256
     db.delete(version)
     db.commit()
+    if storage:
+        release_blobs(storage, [sha256])
     return redirect(url_for("mods.mod", _anchor='changelog', mod_id=mod.id, mod_name=mod.name))
 
 
@@ -706,6 +765,7 @@ def autoupdate(mod_id: int) -> werkzeug.wrappers.Response:
         GameVersion.game_id == mod.game_id).order_by(GameVersion.id.desc()).first().id
     mod.updated = datetime.now()
     mod.score = get_mod_score(mod)
+    record_version_change(default, 'updated')
     send_autoupdate_notification(mod)
     send_change_notifications(mod, 'version-update')
     return redirect(url_for("mods.mod", mod_id=mod.id, mod_name=mod.name))
@@ -1,8 +1,9 @@
+import os
 from datetime import datetime
 from types import FrameType
 from typing import List, Iterable, Any, Optional
 
-from celery import Celery
+from celery import Celery, Task
 import alembic.command
 import alembic.config
 
@@ -11,13 +12,22 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import format_datetime
 
-from .common import with_session
+from .common import with_session, render_markdown
 from .config import _cfg, _cfgi, _cfgb, site_logger
-from .objects import Mod, Notification
-from .search import get_mod_score
+from .database import db
+from .objects import Notification, Mod, ModVersion, User
+from .search import update_mod_scores
+from .download_counter import download_counter
+from .snapshot import write_snapshot
+from .thumbnail import generate, thumbnail_owners
+from .uploads import clean_upload_sessions
+from .rollups import roll_up_events
 from .notification import import_game_versions
 
 app = Celery("tasks", broker=_cfg("redis-connection"))
+if _cfg('antivirus-queue'):
+    # A worker of its own consumes it, so only so many scans run at once, however many uploads come in
+    app.conf.task_routes = {'KerbalStuff.celery.scan_mod_version': {'queue': _cfg('antivirus-queue')}}
 
 
 def chunks(l: List[str], n: int) -> Iterable[List[str]]:
@@ -116,13 +126,97 @@ def update_from_github(working_directory: str, branch: str, restart_command: str
 def setup_periodic_tasks(sender: Any, **kwargs: int) -> None:
     sender.add_periodic_task(86400, calculate_mod_scores.s(), name='calculate mod scores')
     sender.add_periodic_task(3600, game_version_import.s(), name='import game versions')
+    sender.add_periodic_task(download_counter.interval, flush_download_counts.s(), name='flush download counts')
+    sender.add_periodic_task(_cfgi('snapshot-interval', 3600), write_catalog_snapshot.s(), name='write catalog snapshot')
+    sender.add_periodic_task(86400, render_mod_descriptions.s(), name='render mod descriptions')
+    sender.add_periodic_task(3600, remove_abandoned_uploads.s(), name='remove abandoned uploads')
+    sender.add_periodic_task(3600, roll_up_stats.s(), name='roll up stats')
 
 
 @app.task
 @with_session
 def calculate_mod_scores() -> None:
-    for mod in Mod.query.all():
-        mod.score = get_mod_score(mod)
+    update_mod_scores()
+
+
+@app.task
+def flush_download_counts() -> None:
+    # Only does something with the Redis backend, otherwise each web process flushes its own downloads
+    download_counter.flush()
+
+
+@app.task
+@with_session
+def write_catalog_snapshot() -> None:
+    write_snapshot()
+
+
+@app.task(bind=True, max_retries=5, default_retry_delay=60)
+@with_session
+def scan_mod_version(self: Task, version_id: int, uploader_id: int,
+                     update: bool = False, notify_followers: bool = False) -> None:
+    # These import the email module, which imports this one
+    from .antivirus import scan_file, release_version, reject_version
+    from .app import app as flask_app
+    version = ModVersion.query.get(version_id)
+    storage = _cfg('storage')
+    if not version or not version.pending_path or not storage:
+        return
+    full_path = os.path.join(storage, version.pending_path)
+    try:
+        infected = scan_file(full_path)
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        # Same as when uploads were scanned right away, an unreachable ClamAV lets the file through
+        site_logger.error('Failed to scan %s with ClamAV, letting it through', full_path, exc_info=exc)
+        infected = False
+    uploader = User.query.get(uploader_id)
+    # The emails and notifications use url_for
+    with flask_app.test_request_context():
+        if infected:
+            reject_version(version, uploader)
+        else:
+            release_version(version, uploader, update, notify_followers)
+        # The end of the request context closes the session
+        db.commit()
+
+
+@app.task
+def remove_abandoned_uploads() -> None:
+    storage = _cfg('storage')
+    if storage:
+        clean_upload_sessions(storage)
+
+
+@app.task
+@with_session
+def roll_up_stats() -> None:
+    roll_up_events()
+
+
+@app.task
+@with_session
+def render_mod_descriptions(batch_size: int = 500) -> None:
+    # Fills in the HTML of descriptions saved before it was stored, a batch per transaction
+    last_id = 0
+    while True:
+        batch = Mod.query.filter(Mod.id > last_id, Mod.description_html == None, Mod.description != '') \
+            .order_by(Mod.id).limit(batch_size).all()
+        if not batch:
+            break
+        for mod in batch:
+            mod.description_html = render_markdown(mod.description)
+        db.commit()
+        last_id = batch[-1].id
+
+
+@app.task
+@with_session
+def create_thumbnail(kind: str, obj_id: int) -> None:
+    obj = thumbnail_owners()[kind].query.get(obj_id)
+    if obj and not obj.thumbnail:
+        generate(obj)
 
 
 @app.task
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import func, or_
+
+from .config import _cfgi
+from .database import db
+from .objects import ChangeEvent, Mod, ModVersion
+
+# Changes that take a mod out of the public catalog,
+# the feed has to show them even though the mod isn't published (anymore)
+REMOVAL_CHANGES = ('locked', 'deleted')
+
+
+def record_mod_change(mod: Mod, change_type: str) -> None:
+    """Adds a change of the mod to the session, so it's committed together with the change itself"""
+    db.add(ChangeEvent(object_type='mod', object_id=mod.id, mod_id=mod.id, change_type=change_type))
+
+
+def record_version_change(version: ModVersion, change_type: str) -> None:
+    db.add(ChangeEvent(object_type='version', object_id=version.id, mod_id=version.mod_id,
+                       change_type=change_type))
+
+
+def record_game_change(game_id: int, change_type: str) -> None:
+    db.add(ChangeEvent(object_type='game', object_id=game_id, change_type=change_type))
+
+
+def settled_before() -> datetime:
+    """The changes recorded before this are committed or rolled back for good.
+    Transactions take their ids when they insert, not when they commit, so a change can become visible after
+    one with a greater id, which clients would skip. Changes are only served once every transaction that
+    might still hold a smaller id is over, which takes at most change-feed-lag seconds."""
+    return datetime.now() - timedelta(seconds=_cfgi('change-feed-lag', 60))
+
+
+def latest_change_id() -> int:
+    """A cursor from which the feed has all the changes that aren't settled yet"""
+    return db.query(func.max(ChangeEvent.id)).filter(ChangeEvent.created < settled_before()).scalar() or 0
+
+
+def changes_since(since: int, limit: int) -> Tuple[List[ChangeEvent], bool]:
+    """Returns up to limit changes after the one with the id since, oldest first,
+    and whether there are more after them.
+    Changes of mods that aren't published are left out, apart from them being locked or deleted."""
+    changes = ChangeEvent.query \
+        .outerjoin(Mod, Mod.id == ChangeEvent.mod_id) \
+        .filter(ChangeEvent.id > since, ChangeEvent.created < settled_before()) \
+        .filter(or_(ChangeEvent.mod_id == None,
+                    Mod.published == True,
+                    ChangeEvent.change_type.in_(REMOVAL_CHANGES))) \
+        .order_by(ChangeEvent.id) \
+        .limit(limit + 1) \
+        .all()
+    return changes[:limit], len(changes) > limit
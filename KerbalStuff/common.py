@@ -1,31 +1,41 @@
+import base64
+import binascii
+import decimal
+import hashlib
 import json
 import math
 import mimetypes
 import urllib.parse
 import os
 import re
-from datetime import timedelta, datetime
+import threading
+from datetime import datetime
 from functools import wraps
-from typing import Union, List, Any, Optional, Callable, Tuple, Iterable
+from typing import Union, List, Any, Optional, Callable, Tuple, Iterable, NamedTuple, Sequence, Dict
 
 import bleach
 import werkzeug.wrappers
 from bleach_allowlist import bleach_allowlist
 from bleach.css_sanitizer import CSSSanitizer
-from flask import jsonify, redirect, request, Response, abort, session, send_file, make_response, current_app
+from flask import jsonify, redirect, request, Response, abort, session, send_file, make_response, current_app, url_for
 from flask_login import current_user
 from markupsafe import Markup
 from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Query
+from sqlalchemy.sql import ColumnElement
 from markdown import Markdown
 from pymdownx.emoji import gemoji, to_alt
 
+from .cache import LRUCache
 from .config import _cfg
 from .custom_json import CustomJSONEncoder
 from .database import db, Base
-from .objects import Game, Mod, ModList, Featured, ModVersion, ReferralEvent, DownloadEvent, FollowEvent
-from .search import search_mods
+from .objects import Game, Mod, ModList, Featured, ModVersion, ReferralEvent
+from .search import search_mods_query
 from .kerbdown import EmbedInlineProcessor, KerbDown
+from .thumbnail import variant_path_from_name
 
 TRUE_STR = ('true', 'yes', 'on')
 PARAGRAPH_PATTERN = re.compile('\n\n|\r\n\r\n')
@@ -36,18 +46,41 @@ def allow_iframe_attr(tagname: str, attrib: str, val: str) -> bool:
             attrib in EmbedInlineProcessor.IFRAME_ATTRIBS)
 
 
-cleaner = bleach.Cleaner(tags=list({*bleach_allowlist.markdown_tags,
-                                    *bleach_allowlist.print_tags,
-                                    'iframe'}),
-                         attributes={  # type: ignore[arg-type]
-                             **bleach_allowlist.markdown_attrs,
-                             **bleach_allowlist.print_attrs,
-                             'th': ['style'],
-                             'td': ['style'],
-                             'iframe': allow_iframe_attr
-                         },
-                         css_sanitizer=CSSSanitizer(),
-                         filters=[bleach.linkifier.LinkifyFilter])
+def _new_cleaner() -> bleach.Cleaner:
+    return bleach.Cleaner(tags=list({*bleach_allowlist.markdown_tags,
+                                     *bleach_allowlist.print_tags,
+                                     'iframe'}),
+                          attributes={  # type: ignore[arg-type]
+                              **bleach_allowlist.markdown_attrs,
+                              **bleach_allowlist.print_attrs,
+                              'th': ['style'],
+                              'td': ['style'],
+                              'iframe': allow_iframe_attr
+                          },
+                          css_sanitizer=CSSSanitizer(),
+                          filters=[bleach.linkifier.LinkifyFilter])
+
+
+def _new_markdown_renderer() -> Markdown:
+    return Markdown(
+        extensions=[KerbDown(), 'fenced_code', 'pymdownx.emoji'],
+        extension_configs={'pymdownx.emoji': {
+           # GitHub's emojis
+           'emoji_index': gemoji,
+           # Unicode output
+           'emoji_generator': to_alt,
+    }})
+
+
+# Neither the Markdown class nor bleach's Cleaner is thread-safe, so each thread gets its own
+_renderers = threading.local()
+
+
+def _thread_renderers() -> Tuple[Markdown, bleach.Cleaner]:
+    if not hasattr(_renderers, 'markdown'):
+        _renderers.markdown = _new_markdown_renderer()
+        _renderers.cleaner = _new_cleaner()
+    return _renderers.markdown, _renderers.cleaner
 
 
 def first_paragraphs(text: Optional[str]) -> str:
@@ -59,22 +92,31 @@ def many_paragraphs(text: str) -> bool:
 
 
 def sanitize_text(text: str) -> Markup:
+    _, cleaner = _thread_renderers()
     return Markup(cleaner.clean(text))
 
 
-markdown_renderer = Markdown(
-    extensions=[KerbDown(), 'fenced_code', 'pymdownx.emoji'],
-    extension_configs={'pymdownx.emoji': {
-       # GitHub's emojis
-       'emoji_index': gemoji,
-       # Unicode output
-       'emoji_generator': to_alt,
-}})
+def convert_markdown(md: str, defer_mentions: bool = False) -> Markup:
+    """Unsanitized, only for trusted text or followed by sanitize_text"""
+    renderer, _ = _thread_renderers()
+    # Forget the state the extensions kept from the previous text
+    renderer.reset()
+    for extension in renderer.registeredExtensions:
+        if isinstance(extension, KerbDown):
+            extension.defer_mentions = defer_mentions
+    return Markup(renderer.convert(md))
+
+
+# Mentions are left for resolve_mentions, so the same text always renders to the same HTML
+markdown_cache: LRUCache[Markup] = LRUCache('markdown', 1024)
 
 
 def render_markdown(md: Optional[str]) -> Optional[Markup]:
-    # The Markdown class is not thread-safe, sadly
-    return None if not md else sanitize_text(markdown_renderer.convert(md))
+    """Sanitized HTML to store in the database, show it with resolve_mentions"""
+    if not md:
+        return None
+    return markdown_cache.get_or_set(hashlib.sha256(md.encode()).digest(),
+                                     lambda: sanitize_text(convert_markdown(md, defer_mentions=True)))
 
 
 def dumb_object(model):  # type: ignore
@@ -136,6 +178,30 @@ def json_response(obj: Any, status: Optional[int] = None) -> werkzeug.wrappers.R
     return Response(data, status=status, mimetype='application/json')
 
 
+def json_stream_response(items: Iterable[Any], envelope: Optional[Dict[str, Any]] = None,
+                         key: str = 'result') -> werkzeug.wrappers.Response:
+    """Sends the same JSON as json_response(items), or json_response({**envelope, key: items}),
+    but encodes the items one at a time while the response is being sent,
+    so it never has to be held in memory in full.
+    The items are produced after the request context is gone, they can't use url_for and the like.
+    """
+    encoder = CustomJSONEncoder(separators=(',', ':'))
+
+    def generate() -> Iterable[str]:
+        try:
+            if envelope is not None:
+                yield encoder.encode(envelope)[:-1] + (',' if envelope else '') + encoder.encode(key) + ':'
+            yield '['
+            for i, item in enumerate(items):
+                yield (',' if i else '') + encoder.encode(item)
+            yield ']' if envelope is None else ']}'
+        finally:
+            # app.teardown_request already ran before the items were queried
+            db.close()
+
+    return Response(generate(), mimetype='application/json')
+
+
 def json_output(f: Callable[..., Any]) -> Callable[..., Any]:
     @wraps(f)
     def wrapper(*args: str, **kwargs: int) -> werkzeug.wrappers.Response:
@@ -150,6 +216,36 @@ def json_output(f: Callable[..., Any]) -> Callable[..., Any]:
     return wrapper
 
 
+def make_etag(*values: Any) -> str:
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def conditional(etag_func: Callable[..., Optional[str]]) -> Callable[..., Any]:
+    """Answers 304 Not Modified if the client already has the version of the response
+    identified by etag_func(*view args), before the view does the actual work.
+    etag_func should only need cheap queries, or return None to skip validation."""
+    def decorator(f: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(f)
+        def wrapper(*args: str, **kwargs: int) -> werkzeug.wrappers.Response:
+            etag = etag_func(*args, **kwargs)
+            if etag is None:
+                return make_response(f(*args, **kwargs))
+            if is_resource_modified(request.environ, etag=etag):
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            # Caches may keep it, but have to check with us before using it
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def paginate_query(query: Query, page_size: int = 30) -> Tuple[List[Mod], int, int]:
     total_pages = math.ceil(query.count() / page_size)
     page = get_page()
@@ -167,10 +263,131 @@ def get_page() -> int:
         return 1
 
 
-def get_paginated_mods(ga: Optional[Game] = None, query: str = '', page_size: int = 30) -> Tuple[Iterable[Mod], int, int]:
-    page = get_page()
-    mods, total_pages = search_mods(ga.id if ga else None, query, page, page_size)
-    return mods, page, total_pages
+# Counting means visiting every matching row, so the listings share their totals for a while
+COUNT_CACHE_TTL = 300
+count_cache: LRUCache[int] = LRUCache('counts', 1024, COUNT_CACHE_TTL)
+PAGE_ARGS = ('page', 'after', 'before')
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    page: int
+    total_pages: int
+    prev_cursor: Optional[str]
+    next_cursor: Optional[str]
+
+
+def cached_count(query: Query) -> int:
+    compiled = query.statement.compile(dialect=db.get_bind().dialect)
+    key = (str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items())))
+    return count_cache.get_or_set(key, query.count)
+
+
+def encode_cursor(page: int, values: Sequence[Any]) -> str:
+    data = json.dumps({'page': page,
+                       'keys': [{'dt': v.isoformat()} if isinstance(v, datetime) else v
+                                for v in values]},
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _fits_key(value: Any, key: ColumnElement) -> bool:
+    """Whether a value from a cursor can be compared with the sort key"""
+    if value is None:
+        # The boundary row of a nullable key
+        return True
+    try:
+        python_type = key.type.python_type
+    except NotImplementedError:
+        # Untyped expressions like search ranks
+        python_type = float
+    if python_type is bool or isinstance(value, bool):
+        return python_type is bool and isinstance(value, bool)
+    if python_type in (float, decimal.Decimal):
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor: Optional[str], keys: Sequence[ColumnElement]) -> Optional[Tuple[int, List[Any]]]:
+    """The page and key values of a cursor from encode_cursor, aborts with 400 if they don't fit the keys"""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(data['keys'], list):
+            raise TypeError('Cursor keys are not a list')
+        values = [datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v
+                  for v in data['keys']]
+        page = int(data['page'])
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        abort(400, 'Invalid cursor')
+    # Values of other types would be bound to the query as they are
+    if len(values) != len(keys) or not all(_fits_key(value, key) for value, key in zip(values, keys)):
+        abort(400, 'Invalid cursor')
+    return page, values
+
+
+def keyset_paginate(query: Query, keys: Sequence[ColumnElement],
+                    page_size: int = 30, descending: bool = True) -> Page:
+    """Returns one page of an unordered query sorted by keys, which have to end with a unique column.
+    Following the prev/next cursors seeks past the boundary rows' keys instead of counting
+    OFFSET rows, so deep pages are as cheap as the first one. ?page=N links still work, with OFFSET.
+    """
+    total_pages = math.ceil(cached_count(query) / page_size)
+    query = query.add_columns(*(key.label(f'sort_key_{i}') for i, key in enumerate(keys)))
+    forward = [key.desc() if descending else key.asc() for key in keys]
+    backward = [key.asc() if descending else key.desc() for key in keys]
+    after = decode_cursor(request.args.get('after'), keys)
+    before = decode_cursor(request.args.get('before'), keys) if not after else None
+    if after:
+        page, values = after
+        page += 1
+        rows = query.filter(tuple_(*keys) < tuple(values) if descending else tuple_(*keys) > tuple(values))\
+            .order_by(*forward).limit(page_size + 1).all()
+        has_prev, has_next = True, len(rows) > page_size
+        rows = rows[:page_size]
+    elif before:
+        page, values = before
+        page -= 1
+        rows = query.filter(tuple_(*keys) > tuple(values) if descending else tuple_(*keys) < tuple(values))\
+            .order_by(*backward).limit(page_size + 1).all()
+        has_prev, has_next = len(rows) > page_size, True
+        rows = rows[:page_size][::-1]
+        if not has_prev:
+            page = 1
+    else:
+        page = min(max(get_page(), 1), max(total_pages, 1))
+        rows = query.order_by(*forward).offset(page_size * (page - 1)).limit(page_size + 1).all()
+        has_prev, has_next = page > 1, len(rows) > page_size
+        rows = rows[:page_size]
+    page = max(page, 1)
+    # The count may be a few minutes old
+    total_pages = max(total_pages, page + 1 if has_next else page)
+    return Page([row[0] for row in rows], page, total_pages,
+                encode_cursor(page, rows[0][1:]) if has_prev and rows else None,
+                encode_cursor(page, rows[-1][1:]) if has_next and rows else None)
+
+
+def page_url(**args: Any) -> str:
+    """The URL of the current view with its arguments, except for the page being replaced by args"""
+    params = {name: value for name, value in request.args.items() if name not in PAGE_ARGS}
+    return url_for(request.endpoint or '', **(request.view_args or {}), **params, **args)
+
+
+def add_page_links(response: werkzeug.wrappers.Response, page: Page) -> werkzeug.wrappers.Response:
+    links = []
+    if page.prev_cursor:
+        links.append(f'<{page_url(before=page.prev_cursor, _external=True)}>; rel="prev"')
+    if page.next_cursor:
+        links.append(f'<{page_url(after=page.next_cursor, _external=True)}>; rel="next"')
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    return response
+
+
+def get_paginated_mods(ga: Optional[Game] = None, query: str = '', page_size: int = 30) -> Page:
+    mods, keys = search_mods_query(ga.id if ga else None, query)
+    return keyset_paginate(mods, keys, page_size)
 
 
 def get_featured_mods(game_id: Optional[int], limit: int) -> List[Mod]:
@@ -211,28 +428,6 @@ def get_referral_events(mod_id: int, limit: Optional[int] = None) -> List[Referr
     return events.all()
 
 
-# Returns all download events for this mod, optionally within a timeframe from now()-timeframe to now()
-def get_download_events(mod_id: int, timeframe: Optional[timedelta] = None) -> List[DownloadEvent]:
-    events = DownloadEvent.query\
-        .filter(DownloadEvent.mod_id == mod_id)\
-        .order_by(DownloadEvent.created.desc())
-    if timeframe:
-        thirty_days_ago = datetime.now() - timeframe
-        events = events.filter(DownloadEvent.created > thirty_days_ago)
-    return events.all()
-
-
-# Returns all follow events for this mod, optionally within a timeframe from now()-timeframe to now()
-def get_follow_events(mod_id: int, timeframe: Optional[timedelta] = None) -> List[FollowEvent]:
-    events = FollowEvent.query\
-        .filter(FollowEvent.mod_id == mod_id)\
-        .order_by(FollowEvent.created)
-    if timeframe:
-        thirty_days_ago = datetime.now() - timeframe
-        events = events.filter(FollowEvent.created > thirty_days_ago)
-    return events.all()
-
-
 def get_games() -> List[Game]:
     return Game.query.filter(Game.active).order_by(Game.name).all()
 
@@ -333,3 +528,14 @@ def sendfile(path: str, attachment: bool = True) -> werkzeug.wrappers.Response:
             abort(404)
         response = make_response(send_file(download_path, as_attachment=attachment))
     return response
+
+
+def send_thumbnail(thumbnail_path: str) -> werkzeug.wrappers.Response:
+    variant = request.args.get('variant')
+    if variant:
+        # One of the images of background_thumb_set()
+        path = variant_path_from_name(thumbnail_path, variant)
+        if not path:
+            abort(404)
+        return sendfile(path, False)
+    return sendfile(thumbnail_path, False)
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import Table, create_engine, func
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 
 from .config import _cfg
@@ -10,6 +12,26 @@ Base = declarative_base()
 Base.query = db.query_property()
 
 
+def insert_or_add(table: Table, keys: Sequence[str], counters: Sequence[str], rows: List[Dict[str, Any]]) -> None:
+    """Inserts the rows, or adds their counters to the ones of the row with the same keys if there is one.
+    It's a single statement on a unique index, so writers running at the same time can't
+    overwrite each other's counts or insert the same row twice."""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert  # type: ignore[no-redef]
+    else:
+        raise NotImplementedError(f'insert_or_add does not support {dialect}')
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={counter: func.coalesce(table.c[counter], 0) + statement.excluded[counter] for counter in counters})
+    db.execute(statement, rows)
+
+
 def create_database() -> bool:
     """Create the database of the service using the preconfigured backend."""
     from sqlalchemy_utils import database_exists, create_database as sqla_create_db
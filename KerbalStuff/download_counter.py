@@ -0,0 +1,194 @@
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import DefaultDict, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import redis
+from sqlalchemy import bindparam, update
+
+from .background import BackgroundFlusher
+from .config import _cfg, _cfgi
+from .database import db, insert_or_add
+from .objects import DownloadEvent, Mod, ModVersion
+from .rollups import add_late_downloads
+from .score_queue import mark_score_dirty
+
+# (mod id, version id, start of the hour)
+DownloadKey = Tuple[int, int, datetime]
+
+
+class DrainedCounts(NamedTuple):
+    counts: Dict[DownloadKey, int]
+    # Where the backend keeps the counts until they're written
+    keys: List[str]
+
+
+class MemoryCounterBackend:
+    """Counts downloads within this process"""
+
+    def __init__(self) -> None:
+        self._counts: DefaultDict[DownloadKey, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, key: DownloadKey, count: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += count
+
+    def drain(self) -> DrainedCounts:
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+        return DrainedCounts(counts, [])
+
+    def done(self, drained: DrainedCounts) -> None:
+        pass
+
+    def restore(self, drained: DrainedCounts) -> None:
+        for key, count in drained.counts.items():
+            self.add(key, count)
+
+
+class RedisCounterBackend:
+    """Counts downloads in a Redis hash shared by all the processes and nodes.
+    A flush renames the hash and only deletes it once the downloads are committed,
+    so the downloads of a process that dies in between are picked up by a later flush."""
+
+    HASH_KEY = 'download-counts'
+    # A flush never takes this long, older draining hashes were left behind by a process that died
+    STALE_DRAINING_SECONDS = 3600
+
+    def __init__(self, url: str) -> None:
+        self._redis = redis.Redis.from_url(url)
+
+    def add(self, key: DownloadKey, count: int = 1) -> None:
+        self._redis.hincrby(self.HASH_KEY, self._field(key), count)
+
+    @staticmethod
+    def _field(key: DownloadKey) -> str:
+        mod_id, version_id, hour = key
+        return f'{mod_id}:{version_id}:{int(hour.timestamp())}'
+
+    def _draining_key(self) -> str:
+        return f'{self.HASH_KEY}:{int(time.time())}:{uuid.uuid4().hex}'
+
+    def _claim(self, key: str) -> Optional[str]:
+        # Renaming is atomic, downloads that come in meanwhile go to a new hash,
+        # and of two processes that claim the same hash only one gets it
+        draining_key = self._draining_key()
+        try:
+            self._redis.rename(key, draining_key)
+        except redis.ResponseError:
+            return None
+        return draining_key
+
+    def _stale_keys(self) -> List[str]:
+        stale_before = time.time() - self.STALE_DRAINING_SECONDS
+        stale = []
+        for key in self._redis.scan_iter(match=f'{self.HASH_KEY}:*'):
+            key = key.decode()
+            try:
+                started = int(key.split(':')[1])
+            except (IndexError, ValueError):
+                continue
+            if started < stale_before:
+                stale.append(key)
+        return stale
+
+    def drain(self) -> DrainedCounts:
+        keys = [draining_key for draining_key in map(self._claim, [*self._stale_keys(), self.HASH_KEY])
+                if draining_key]
+        counts: DefaultDict[DownloadKey, int] = defaultdict(int)
+        pipe = self._redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        for fields in pipe.execute():
+            for field, count in fields.items():
+                mod_id, version_id, timestamp = field.decode().split(':')
+                counts[(int(mod_id), int(version_id), datetime.fromtimestamp(int(timestamp)))] += int(count)
+        return DrainedCounts(counts, keys)
+
+    def done(self, drained: DrainedCounts) -> None:
+        if drained.keys:
+            self._redis.delete(*drained.keys)
+
+    def restore(self, drained: DrainedCounts) -> None:
+        pipe = self._redis.pipeline()
+        for key, count in drained.counts.items():
+            pipe.hincrby(self.HASH_KEY, self._field(key), count)
+        if drained.keys:
+            pipe.delete(*drained.keys)
+        pipe.execute()
+
+
+def write_download_counts(counts: Dict[DownloadKey, int]) -> None:
+    """Adds the counted downloads to the mods, versions, and hourly download events,
+    and to the daily rollups of hours that were rolled up before they were flushed"""
+    mod_counts: Counter[int] = Counter()
+    version_counts: Counter[int] = Counter()
+    for (mod_id, version_id, _), count in counts.items():
+        mod_counts[mod_id] += count
+        version_counts[version_id] += count
+    for table, row_counts in ((Mod.__table__, mod_counts), (ModVersion.__table__, version_counts)):
+        db.execute(update(table)
+                   .where(table.c.id == bindparam('row_id'))
+                   .values(download_count=table.c.download_count + bindparam('increment')),
+                   [{'row_id': row_id, 'increment': count} for row_id, count in row_counts.items()])
+    # Versions deleted since they were downloaded can't have events anymore
+    existing_versions = {version_id for version_id, in db.query(ModVersion.id)
+                                                            .filter(ModVersion.id.in_(version_counts))}
+    stored = {key: count for key, count in counts.items() if key[1] in existing_versions}
+    insert_or_add(DownloadEvent.__table__, ('version_id', 'created'), ('downloads',),
+                  [{'mod_id': mod_id, 'version_id': version_id, 'downloads': count, 'created': hour}
+                   for (mod_id, version_id, hour), count in stored.items()])
+    add_late_downloads(stored)
+
+
+class DownloadCounter(BackgroundFlusher):
+    """Accumulates downloads so the download route doesn't have to write to the database,
+    and no two requests have to wait for each other's locks on a popular mod's rows."""
+
+    name = 'download-counter'
+
+    def __init__(self, backend: Union[MemoryCounterBackend, RedisCounterBackend], interval: int,
+                 flush_in_background: bool) -> None:
+        super().__init__(interval)
+        self.backend = backend
+        self.flush_in_background = flush_in_background
+
+    def count(self, mod_id: int, version_id: int) -> None:
+        hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        self.backend.add((mod_id, version_id, hour))
+        if self.flush_in_background:
+            self.ensure_started()
+
+    def flush(self) -> int:
+        """Writes the downloads counted so far to the database, returns how many there were"""
+        drained = self.backend.drain()
+        counts = drained.counts
+        if not counts:
+            return 0
+        try:
+            write_download_counts(counts)
+            db.commit()
+        except:
+            db.rollback()
+            # Count them again next time
+            self.backend.restore(drained)
+            raise
+        self.backend.done(drained)
+        for mod_id in {mod_id for mod_id, _, _ in counts}:
+            mark_score_dirty(mod_id)
+        return sum(counts.values())
+
+
+def _create_download_counter() -> DownloadCounter:
+    interval = _cfgi('download-flush-interval', 60)
+    redis_connection = _cfg('redis-connection')
+    if _cfg('download-counter') == 'redis' and redis_connection:
+        # Flushed by celery
+        return DownloadCounter(RedisCounterBackend(redis_connection), interval, False)
+    return DownloadCounter(MemoryCounterBackend(), interval, True)
+
+
+download_counter = _create_download_counter()
@@ -1,16 +1,23 @@
+import re
 import urllib.parse
+from datetime import datetime
 from urllib.parse import parse_qs, urlparse
-from typing import List, Dict, Any, Match, Tuple, Optional
+from typing import List, Dict, Any, Match, Tuple, Optional, NamedTuple, Iterable, Union
 
 from flask import url_for
+from markupsafe import Markup
 from markdown import Markdown
 from markdown.extensions import Extension
 from markdown.extensions.tables import TableProcessor
 from markdown.inlinepatterns import InlineProcessor
+from markdown.preprocessors import Preprocessor
 from xml.etree import ElementTree
 from markdown.util import AtomicString
+from sqlalchemy import func, union_all
 
-from .objects import User
+from .cache import LRUCache
+from .database import db
+from .objects import User, Mod, SharedAuthor
 
 
 class EmbedInlineProcessor(InlineProcessor):
@@ -68,44 +75,114 @@ class EmbedInlineProcessor(InlineProcessor):
         return el
 
 
+class Mention(NamedTuple):
+    """What a link to a mentioned user's profile shows"""
+    username: str
+    mod_count: int
+    joined: datetime
+
+
+# Public users by lower case username, briefly, so the tooltips' mod counts stay about right.
+# False for names without a public user, so texts mentioning them don't look them up every time.
+MENTION_CACHE_TTL = 300
+mention_cache: LRUCache[Union[Mention, bool]] = LRUCache('mentions', 4096, MENTION_CACHE_TTL)
+
+
+def find_mentions(usernames: Iterable[str]) -> Dict[str, Mention]:
+    """Looks up the public users with these names case insensitively,
+    with one query for the ones that aren't cached and one for their published mods"""
+    mentions = {}
+    missing = set()
+    for name in {name.lower() for name in usernames}:
+        mention = mention_cache.get(name)
+        if mention is None:
+            missing.add(name)
+        elif isinstance(mention, Mention):
+            mentions[name] = mention
+    if not missing:
+        return mentions
+    users = db.query(User.id, User.username, User.created)\
+        .filter(func.lower(User.username).in_(missing), User.public == True).all()
+    for name in missing - {user.username.lower() for user in users}:
+        mention_cache.set(name, False)
+    if not users:
+        return mentions
+    user_ids = [u.id for u in users]
+    # Mods they own plus mods they're an accepted shared author of
+    published_mods = union_all(
+        db.query(Mod.user_id.label('user_id'))
+          .filter(Mod.user_id.in_(user_ids), Mod.published == True),
+        db.query(SharedAuthor.user_id.label('user_id'))
+          .join(Mod, Mod.id == SharedAuthor.mod_id)
+          .filter(SharedAuthor.user_id.in_(user_ids), SharedAuthor.accepted == True, Mod.published == True)
+    ).subquery()
+    mod_counts = dict(db.query(published_mods.c.user_id, func.count())
+                        .group_by(published_mods.c.user_id).all())
+    for user in users:
+        mention = Mention(user.username, mod_counts.get(user.id, 0), user.created)
+        mention_cache.set(user.username.lower(), mention)
+        mentions[user.username.lower()] = mention
+    return mentions
+
+
+class MentionPreprocessor(Preprocessor):
+    """Looks up all the users mentioned in the text at once, for AtUsernameProcessor"""
+
+    def __init__(self, md: Markdown, extension: 'KerbDown') -> None:
+        super().__init__(md)
+        self.extension = extension
+
+    def run(self, lines: List[str]) -> List[str]:
+        if self.extension.defer_mentions:
+            return lines
+        self.extension.mentions = find_mentions(
+            match.group('username')
+            for line in lines
+            for match in re.finditer(AtUsernameProcessor.USER_RE, line))
+        return lines
+
+
 class AtUsernameProcessor(InlineProcessor):
     # Don't worry about re.compiling this, markdown.inlinepatterns.Pattern.__init__ does that for us
     # Same as blueprints.accounts._username_re
     USER_RE = r'@(?P<username>[A-Za-z0-9_]+)'
 
-    def __init__(self, md: Markdown, configs: Dict[str, Any]) -> None:
+    def __init__(self, md: Markdown, extension: 'KerbDown') -> None:
         super().__init__(self.USER_RE, md)
-        self.configs = configs
+        self.extension = extension
 
     def handleMatch(self, match: Match[str], data: str) -> Tuple[Optional[ElementTree.Element], Optional[int], Optional[int]]:  # type: ignore[override]
-        username = match.groupdict().get('username')
-        # Case insensitive lookup
-        user = User.query.filter(User.username.ilike(username)).first()
-        return ((self._profileLink(user), match.start(0), match.end(0))
+        username = match.group('username')
+        if self.extension.defer_mentions:
+            return self._placeholder(username), match.start(0), match.end(0)
+        # Case insensitive, found by MentionPreprocessor
+        mention = self.extension.mentions.get(username.lower())
+        return ((self._profileLink(mention), match.start(0), match.end(0))
                 # Keep original text if user not found
-                if user and user.public else (None, None, None))
+                if mention else (None, None, None))
+
+    @staticmethod
+    def _placeholder(username: str) -> ElementTree.Element:
+        # Replaced by resolve_mentions, sanitizing keeps the class
+        elt = ElementTree.Element('span', {'class': 'mention'})
+        elt.text = AtomicString(f'@{username}')
+        return elt
 
-    @classmethod
-    def _profileLink(cls, user: User) -> ElementTree.Element:
+    @staticmethod
+    def _profileLink(mention: Mention) -> ElementTree.Element:
         # Make a link to the user's profile
         elt = ElementTree.Element('a', href=url_for('profile.view_profile',
-                                                    username=user.username),
+                                                    username=mention.username),
                                        # Summarize user's profile in tooltip
-                                       title='\n'.join((f'{user.username}\'s profile',
-                                                        f'{cls._profileModCount(user)} mods',
-                                                        f'Joined {user.created.strftime("%Y-%m-%d")}')))
+                                       title='\n'.join((f'{mention.username}\'s profile',
+                                                        f'{mention.mod_count} mods',
+                                                        f'Joined {mention.joined.strftime("%Y-%m-%d")}')))
         # Make it bold
         strong = ElementTree.SubElement(elt, 'strong')
         # AtomicString prevents Markdown from entering an infinite loop by processing the subelement's text again
-        strong.text = AtomicString(f'@{user.username}')
+        strong.text = AtomicString(f'@{mention.username}')
         return elt
 
-    @staticmethod
-    def _profileModCount(user: User) -> int:
-        return len([m for m in user.mods + [sa.mod for sa in user.shared_authors
-                                            if sa.accepted]
-                    if m is not None and m.published])
-
 
 class StyledTableProcessor(TableProcessor):
     def run(self, parent: ElementTree.Element, blocks: List[str]) -> None:
@@ -118,13 +195,42 @@ class KerbDown(Extension):
     def __init__(self, **kwargs: str) -> None:
         super().__init__(**kwargs) # type: ignore[arg-type]
         self.config: Dict[str, Any] = {}
+        # Users mentioned in the text being converted
+        self.mentions: Dict[str, Mention] = {}
+        # Leave mentions as placeholders for resolve_mentions instead of looking them up
+        self.defer_mentions = False
 
     # noinspection PyMethodOverriding
     def extendMarkdown(self, md: Markdown) -> None:
         # BUG: the base method signature is INVALID, it's a bug in flask-markdown
         md.inlinePatterns.register(EmbedInlineProcessor(md, self.config), 'embed', 200)
-        md.inlinePatterns.register(AtUsernameProcessor(md, self.config), 'atuser', 200)
+        md.preprocessors.register(MentionPreprocessor(md, self), 'mentions', 40)
+        md.inlinePatterns.register(AtUsernameProcessor(md, self), 'atuser', 200)
         md.parser.blockprocessors.register(StyledTableProcessor(md.parser,
                                                                 {'use_align_attribute': False}),
                                            'styled_table', 75)
         md.registerExtension(self)
+
+    def reset(self) -> None:
+        self.mentions = {}
+
+
+# What AtUsernameProcessor leaves in deferred mode, after sanitizing
+MENTION_PLACEHOLDER_RE = re.compile(r'<span class="mention">@(?P<username>[A-Za-z0-9_]+)</span>')
+
+
+def resolve_mentions(html: Optional[str]) -> Markup:
+    """Turns the mention placeholders of sanitized HTML into links to the users' profiles,
+    so HTML stored in the database stays right when users change"""
+    if not html:
+        return Markup('')
+    mentions = find_mentions(match.group('username')
+                             for match in MENTION_PLACEHOLDER_RE.finditer(html))
+
+    def link(match: Match[str]) -> str:
+        mention = mentions.get(match.group('username').lower())
+        # Keep original text if user not found
+        return (ElementTree.tostring(AtUsernameProcessor._profileLink(mention), encoding='unicode')
+                if mention else f'@{match.group("username")}')
+
+    return Markup(MENTION_PLACEHOLDER_RE.sub(link, html))
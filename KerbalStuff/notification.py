@@ -7,6 +7,8 @@ import requests
 from .config import _cfg
 from .objects import Mod, GameVersion, User, Notification, EnabledNotification
 from .database import db
+from .search import invalidate_game_versions
+from .changes import record_game_change
 
 MAJOR_MINOR_PATCH_PATTERN = re.compile(r'^([^.]+\.[^.]+\.[^.]+)')
 
@@ -77,7 +79,9 @@ def import_game_versions(notif: Notification) -> None:
             if version not in current_versions:
                 current_versions.add(version)
                 db.add(GameVersion(friendly_version=version, game_id=notif.game_id))
+                record_game_change(notif.game_id, 'updated')
                 db.commit()
+                invalidate_game_versions(notif.game_id)
 
 
 def game_versions_from_notif(url: str, fmt: str, argument: str) -> Iterable[str]:
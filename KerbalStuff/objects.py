@@ -7,7 +7,7 @@ from typing import Optional, List
 import bcrypt
 from flask import url_for
 from sqlalchemy import Column, Integer, String, Unicode, Boolean, DateTime, \
-    ForeignKey, Float, Index, BigInteger, PrimaryKeyConstraint, Enum
+    ForeignKey, Float, Index, BigInteger, PrimaryKeyConstraint, Enum, DDL, event
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship, backref, reconstructor
 from werkzeug.utils import secure_filename
@@ -223,6 +223,9 @@ class Game(Base):  # type: ignore
     def background_thumb(self) -> Optional[str]:
         return thumbnail.get_or_create_game(self)
 
+    def background_thumb_set(self) -> Optional[str]:
+        return thumbnail.image_set_game(self)
+
     def __repr__(self) -> str:
         return '<Game %r %r>' % (self.id, self.name)
 
@@ -239,6 +242,8 @@ class Mod(Base):  # type: ignore
     game = relationship('Game', backref=backref('mods', passive_deletes=True))
     name = Column(String(100), index=True)
     description = Column(Unicode(100000))
+    # Rendered and sanitized whenever the description is saved
+    description_html = Column(Unicode(200000))
     short_description = Column(Unicode(1000))
     published = Column(Boolean, default=False)
     locked = Column(Boolean, default=False)
@@ -269,10 +274,17 @@ class Mod(Base):  # type: ignore
     followers = association_proxy('followings', 'user')
 
     Index('ix_mod_locked_updated', locked, updated.desc())
+    # Keyset pagination seeks on these, see common.keyset_paginate
+    Index('ix_mod_score_id', score, id)
+    Index('ix_mod_created_id', created, id)
+    Index('ix_mod_updated_id', updated, id)
 
     def background_thumb(self) -> Optional[str]:
         return thumbnail.get_or_create(self)
 
+    def background_thumb_set(self) -> Optional[str]:
+        return thumbnail.image_set(self)
+
     def base_path(self) -> str:
         return os.path.join(self.user.base_path(), secure_filename(self.name))
 
@@ -292,6 +304,32 @@ class Mod(Base):  # type: ignore
         return '<Mod %r %r>' % (self.id, self.name)
 
 
+# Full text search document of a mod, weighted by where the words are found.
+# PostgreSQL maintains it with a trigger, and it's not mapped because other backends
+# (like the SQLite we use for tests) don't know tsvector. See search.py for how it's queried.
+MOD_SEARCH_VECTOR_DDL = [
+    "ALTER TABLE mod ADD COLUMN search_vector tsvector",
+    """CREATE FUNCTION mod_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.short_description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER mod_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, short_description, description ON mod
+    FOR EACH ROW EXECUTE PROCEDURE mod_search_vector_update()""",
+    "CREATE INDEX ix_mod_search_vector ON mod USING GIN (search_vector)",
+]
+for statement in MOD_SEARCH_VECTOR_DDL:
+    event.listen(Mod.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+# Database objects that exist without being mapped, so alembic's autogenerate leaves them alone
+UNMAPPED_DB_OBJECTS = {'search_vector', 'ix_mod_search_vector'}
+
+
 class Notification(Base):  # type: ignore
     __tablename__ = 'notification'
     id = Column(Integer, primary_key=True)
@@ -353,6 +391,9 @@ class ModList(Base):  # type: ignore
     def background_thumb(self) -> Optional[str]:
         return thumbnail.get_or_create_pack(self)
 
+    def background_thumb_set(self) -> Optional[str]:
+        return thumbnail.image_set_pack(self)
+
     def base_path(self) -> str:
         return os.path.join(self.user.base_path(), secure_filename(self.name))
 
@@ -400,7 +441,8 @@ class DownloadEvent(Base):  # type: ignore
     created = Column(DateTime, default=datetime.now, index=True)
 
     Index('ix_downloadevent_mod_id_created', mod_id, created.desc())
-    Index('ix_downloadevent_version_id_created', version_id, created.desc())
+    # One event per version and hour, the download counter's flushes add to it
+    Index('ix_downloadevent_version_id_created', version_id, created.desc(), unique=True)
 
     def __repr__(self) -> str:
         return '<Download Event %r>' % self.id
@@ -421,6 +463,45 @@ class FollowEvent(Base):  # type: ignore
         return '<Download Event %r>' % self.id
 
 
+class DownloadRollup(Base):  # type: ignore
+    """Downloads of a version per day or month, compacted from DownloadEvents by the rollups module"""
+    __tablename__ = 'downloadrollup'
+    id = Column(Integer, primary_key=True)
+    mod_id = Column(Integer, ForeignKey('mod.id', ondelete='CASCADE'), nullable=False)
+    version_id = Column(Integer, ForeignKey('modversion.id', ondelete='CASCADE'), nullable=False)
+    # 'day' or 'month'
+    period = Column(String(8), nullable=False)
+    # Start of the day or month
+    created = Column(DateTime, nullable=False)
+    downloads = Column(Integer, nullable=False, default=0)
+
+    Index('ix_downloadrollup_mod_id_period_created', mod_id, period, created)
+    Index('ix_downloadrollup_period_created', period, created)
+    # Downloads flushed after their day was rolled up are added to its rows
+    Index('ix_downloadrollup_version_id_period_created', version_id, period, created, unique=True)
+
+    def __repr__(self) -> str:
+        return '<Download Rollup %r>' % self.id
+
+
+class FollowRollup(Base):  # type: ignore
+    """Follows of a mod per day or month, compacted from FollowEvents by the rollups module"""
+    __tablename__ = 'followrollup'
+    id = Column(Integer, primary_key=True)
+    mod_id = Column(Integer, ForeignKey('mod.id', ondelete='CASCADE'), nullable=False)
+    period = Column(String(8), nullable=False)
+    created = Column(DateTime, nullable=False)
+    delta = Column(Integer, nullable=False, default=0)
+    # Follows and unfollows in the period
+    events = Column(Integer)
+
+    Index('ix_followrollup_mod_id_period_created', mod_id, period, created)
+    Index('ix_followrollup_period_created', period, created)
+
+    def __repr__(self) -> str:
+        return '<Follow Rollup %r>' % self.id
+
+
 class ReferralEvent(Base):  # type: ignore
     __tablename__ = 'referralevent'
     id = Column(Integer, primary_key=True)
@@ -432,6 +513,11 @@ class ReferralEvent(Base):  # type: ignore
     events = Column(Integer, default=0)
     created = Column(DateTime, default=datetime.now, index=True)
 
+    # Only the referral-top-hosts hosts of each mod are kept, see referral_counter
+    Index('ix_referralevent_mod_id_events', mod_id, events.desc())
+    # Counts are added with INSERT ... ON CONFLICT
+    Index('ix_referralevent_mod_id_host', mod_id, host, unique=True)
+
     def __repr__(self) -> str:
         return '<Download Event %r>' % self.id
 
@@ -456,6 +542,18 @@ class ModVersion(Base):  # type: ignore
     sort_index = Column(Integer, default=0)
     download_count = Column(Integer, default=0)
     download_size = Column(BigInteger)
+    # Names the blob the download_path links to, see blobs.py
+    download_sha256 = Column(String(64), index=True)
+    # Until the antivirus task has scanned the file, it can't be downloaded or become the default
+    pending_scan = Column(Boolean(), nullable=False, default=False)
+    # An upload that waits for its scan outside of download_path, see uploads.hold_upload.
+    # Replacing the file of a version keeps the old one downloadable until the new one is released.
+    pending_path = Column(String(512))
+    pending_size = Column(BigInteger)
+    pending_sha256 = Column(String(64))
+
+    # Downloads look versions up by their mod and friendly_version
+    Index('ix_modversion_mod_id_friendly_version', mod_id, friendly_version)
 
     def format_size(self, storage: str) -> Optional[str]:
         try:
@@ -501,3 +599,20 @@ class GameVersion(Base):  # type: ignore
 
     def __repr__(self) -> str:
         return '<Game Version %r>' % self.friendly_version
+
+
+class ChangeEvent(Base):  # type: ignore
+    __tablename__ = 'changeevent'
+    # The ids are the change feed's cursors
+    id = Column(Integer, primary_key=True)
+    # 'mod', 'version' or 'game'
+    object_type = Column(String(16), nullable=False)
+    object_id = Column(Integer, nullable=False)
+    # 'created', 'updated', 'published', 'locked' or 'deleted'
+    change_type = Column(String(16), nullable=False)
+    # Not a foreign key, the changes of deleted mods have to stay in the feed
+    mod_id = Column(Integer, index=True)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self) -> str:
+        return '<Change Event %r>' % self.id
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import delete, func, select
+
+from .background import BackgroundFlusher
+from .config import _cfgi
+from .database import db, insert_or_add
+from .objects import Mod, ReferralEvent
+
+
+class SpaceSaving:
+    """Approximate counts of the most frequent hosts in a bounded number of counters (Metwally et al.'s Space-Saving).
+    A new host takes over the smallest counter once they're all in use, along with its count,
+    which is remembered as the new host's error. Hosts that refer often always end up in it."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1) -> None:
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            smallest = min(self.counts, key=self.counts.__getitem__)
+            self.errors.pop(smallest)
+            self.errors[key] = self.counts.pop(smallest)
+            self.counts[key] = self.errors[key] + count
+
+    def guaranteed_counts(self) -> Dict[str, int]:
+        """The referrals each host certainly made, without what it inherited from the hosts it replaced,
+        so hosts that take turns in the smallest counter don't add up to a lot"""
+        return {key: count - self.errors[key] for key, count in self.counts.items() if count > self.errors[key]}
+
+
+def write_referral_counts(counts: Dict[int, Dict[str, int]], top_hosts: int) -> None:
+    """Adds the counted referrals to the mods' referral events, and keeps only the top_hosts hosts of each"""
+    existing_mods = {mod_id for mod_id, in db.query(Mod.id).filter(Mod.id.in_(counts))}
+    if not existing_mods:
+        return
+    table = ReferralEvent.__table__
+    insert_or_add(table, ('mod_id', 'host'), ('events',),
+                  [{'mod_id': mod_id, 'host': host, 'events': count, 'created': datetime.now()}
+                   for mod_id in existing_mods for host, count in counts[mod_id].items()])
+    ranked = select(table.c.id,
+                    func.row_number().over(partition_by=table.c.mod_id,
+                                           order_by=(table.c.events.desc(), table.c.id)).label('rank'))\
+        .where(table.c.mod_id.in_(existing_mods))\
+        .subquery()
+    db.execute(delete(table).where(table.c.id.in_(select(ranked.c.id).where(ranked.c.rank > top_hosts))))
+
+
+class ReferralCounter(BackgroundFlusher):
+    """Counts referring hosts per mod in memory, so mod pages don't write to the database,
+    and spam referrers can't make a mod's referral events grow without bound."""
+
+    name = 'referral-counter'
+
+    def __init__(self, top_hosts: int, interval: int, flush_in_background: bool) -> None:
+        super().__init__(interval)
+        self.top_hosts = top_hosts
+        self._sketches: Dict[int, SpaceSaving] = {}
+        self._lock = threading.Lock()
+        self.flush_in_background = flush_in_background
+
+    def count(self, mod_id: int, host: str) -> None:
+        with self._lock:
+            sketch = self._sketches.get(mod_id)
+            if sketch is None:
+                # Room for the hosts that are about to make it into the top ones
+                sketch = self._sketches[mod_id] = SpaceSaving(2 * self.top_hosts)
+            sketch.add(host)
+        if self.flush_in_background:
+            self.ensure_started()
+
+    def _drain(self) -> Dict[int, Dict[str, int]]:
+        with self._lock:
+            sketches, self._sketches = self._sketches, {}
+        return {mod_id: sketch.guaranteed_counts() for mod_id, sketch in sketches.items()}
+
+    def flush(self) -> int:
+        """Writes the referrals counted so far to the database, returns how many there were"""
+        counts = self._drain()
+        if not counts:
+            return 0
+        try:
+            write_referral_counts(counts, self.top_hosts)
+            db.commit()
+        except:
+            db.rollback()
+            # Count them again next time
+            with self._lock:
+                for mod_id, hosts in counts.items():
+                    for host, count in hosts.items():
+                        self._sketches.setdefault(mod_id, SpaceSaving(2 * self.top_hosts)).add(host, count)
+            raise
+        return sum(sum(hosts.values()) for hosts in counts.values())
+
+
+referral_counter = ReferralCounter(_cfgi('referral-top-hosts', 50), _cfgi('referral-flush-interval', 60), True)
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Type, TypeVar
+
+from sqlalchemy import DateTime, delete, func, insert, literal
+
+from .config import _cfgi, site_logger
+from .database import db, insert_or_add
+from .objects import DownloadEvent, DownloadRollup, FollowEvent, FollowRollup
+
+# The stats of a mod are kept in hourly events for stats-retention-days, and compacted into
+# daily and monthly rollups for good. A day is rolled up once its events usually don't change anymore:
+# the download counter flushes an hour's downloads late, and a follow keeps counting into its event for an hour.
+# Downloads that are flushed even later, after a failed flush or by a worker that died, are added to the
+# rollups of their day as they're written.
+ROLLUP_DELAY = timedelta(hours=2)
+
+GRANULARITIES = ('hour', 'day', 'month')
+
+# Rows fetched at once when streaming stats
+STREAM_BATCH = 1000
+
+
+class DownloadStat(NamedTuple):
+    created: datetime
+    version_id: int
+    downloads: int
+
+
+class FollowStat(NamedTuple):
+    created: datetime
+    delta: int
+    events: int
+
+
+StatT = TypeVar('StatT', DownloadStat, FollowStat)
+
+
+class _RollupSpec(NamedTuple):
+    event: Any
+    rollup: Any
+    # The columns the rows are grouped by besides the period, and the ones that are summed up
+    keys: Tuple[str, ...]
+    sums: Tuple[str, ...]
+
+
+DOWNLOADS = _RollupSpec(DownloadEvent, DownloadRollup, ('mod_id', 'version_id'), ('downloads',))
+FOLLOWS = _RollupSpec(FollowEvent, FollowRollup, ('mod_id',), ('delta', 'events'))
+
+
+def period_start(when: datetime, granularity: str) -> datetime:
+    if granularity == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day.replace(day=1) if granularity == 'month' else day
+
+
+def hourly_stats_since(now: Optional[datetime] = None) -> datetime:
+    """The start of the oldest day whose hourly events are kept, the ones before it are removed once rolled up"""
+    return period_start((now or datetime.now()) - timedelta(days=_cfgi('stats-retention-days', 90)), 'day')
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def rolled_up_until(spec: _RollupSpec) -> Optional[datetime]:
+    """The end of the last day that has been rolled up, the events after it are only in the hourly table"""
+    last_day = db.query(func.max(spec.rollup.created)).filter(spec.rollup.period == 'day').scalar()
+    return last_day + timedelta(days=1) if last_day else None
+
+
+def _replace_period(spec: _RollupSpec, source: Any, period: str, start: datetime, end: datetime) -> None:
+    """(Re)computes the rollup rows of the period that starts at start from the source rows in it"""
+    table = spec.rollup.__table__
+    db.execute(delete(table).where(table.c.period == period, table.c.created == start))
+    keys = [getattr(source, key) for key in spec.keys]
+    rows = db.query(*keys, literal(period), literal(start, DateTime),
+                    *(func.coalesce(func.sum(getattr(source, column)), 0) for column in spec.sums))\
+        .filter(source.created >= start, source.created < end, *(key.isnot(None) for key in keys))\
+        .group_by(*keys)
+    if source is spec.rollup:
+        rows = rows.filter(source.period == 'day')
+    db.execute(insert(table).from_select([*spec.keys, 'period', 'created', *spec.sums], rows.statement))
+
+
+def _roll_up(spec: _RollupSpec, now: datetime) -> None:
+    until = period_start(now - ROLLUP_DELAY, 'day')
+    day = rolled_up_until(spec)
+    if not day:
+        first_event = db.query(func.min(spec.event.created)).scalar()
+        if not first_event:
+            return
+        day = period_start(first_event, 'day')
+    months = set()
+    while day < until:
+        _replace_period(spec, spec.event, 'day', day, day + timedelta(days=1))
+        months.add(period_start(day, 'month'))
+        day += timedelta(days=1)
+        db.commit()
+    for month in sorted(months):
+        _replace_period(spec, spec.rollup, 'month', month, _next_month(month))
+        db.commit()
+
+    # Events are only removed once they're in the rollups
+    cutoff = min(hourly_stats_since(now), day)
+    removed = db.query(spec.event).filter(spec.event.created < cutoff).delete(synchronize_session=False)
+    db.commit()
+    if months or removed:
+        site_logger.info('Rolled up %s until %s, removed %d hourly events',
+                         spec.rollup.__tablename__, day, removed)
+
+
+def add_late_downloads(downloads: Dict[Tuple[int, int, datetime], int]) -> None:
+    """Adds the downloads of the hours that have been rolled up already to the daily and monthly rollups,
+    which are never computed from those events again. Takes (mod id, version id, hour) keys."""
+    until = rolled_up_until(DOWNLOADS)
+    if not until:
+        return
+    rows: Dict[Tuple[int, int, str, datetime], int] = defaultdict(int)
+    for (mod_id, version_id, hour), count in downloads.items():
+        if hour < until:
+            for period in ('day', 'month'):
+                rows[(mod_id, version_id, period, period_start(hour, period))] += count
+    insert_or_add(DownloadRollup.__table__, ('version_id', 'period', 'created'), ('downloads',),
+                  [{'mod_id': mod_id, 'version_id': version_id, 'period': period, 'created': created,
+                    'downloads': count}
+                   for (mod_id, version_id, period, created), count in rows.items()])
+
+
+def roll_up_events(now: Optional[datetime] = None) -> None:
+    """Compacts the hourly download and follow events of the complete days into daily and monthly rollups,
+    and removes the events older than stats-retention-days"""
+    now = now or datetime.now()
+    for spec in (DOWNLOADS, FOLLOWS):
+        _roll_up(spec, now)
+
+
+def _iter_stats(spec: _RollupSpec, stat: Type[StatT], mod_id: int,
+                since: Optional[datetime], until: Optional[datetime], granularity: str) -> Iterator[StatT]:
+    """The stats of a mod per hour, day or month in order, from the coarsest table that has them.
+    Whatever hasn't been rolled up yet is added up from the hourly events.
+    The rows are fetched in batches from a server-side cursor, so a mod's whole history is never in memory."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown granularity {granularity}')
+    if since:
+        since = period_start(since, granularity)
+    keys: List[str] = [key for key in spec.keys if key != 'mod_id']
+
+    def query(model: Any, since: Optional[datetime]) -> Any:
+        rows = model.query\
+            .with_entities(model.created, *(getattr(model, column) for column in keys + list(spec.sums)))\
+            .filter(model.mod_id == mod_id)\
+            .order_by(model.created, *(getattr(model, key) for key in keys))
+        if since:
+            rows = rows.filter(model.created >= since)
+        if until:
+            rows = rows.filter(model.created < until)
+        return rows
+
+    def split(row: Tuple[Any, ...]) -> Tuple[Tuple[Any, ...], List[int]]:
+        created, *values = row
+        return (period_start(created, granularity), *values[:len(keys)]), \
+               [value or 0 for value in values[len(keys):]]
+
+    if granularity == 'hour':
+        # Each hour has one event per version, so rows of the same hour and version come in a row
+        last_group, last_sums = None, []
+        for row in query(spec.event, since).yield_per(STREAM_BATCH):
+            group, sums = split(row)
+            if group == last_group:
+                last_sums = [a + b for a, b in zip(last_sums, sums)]
+                continue
+            if last_group is not None:
+                yield stat(*last_group, *last_sums)
+            last_group, last_sums = group, sums
+        if last_group is not None:
+            yield stat(*last_group, *last_sums)
+        return
+
+    # The events that aren't rolled up yet are a day or two at most
+    rolled_up = rolled_up_until(spec)
+    events_since = max(since, rolled_up) if since and rolled_up else since or rolled_up
+    pending: Dict[Tuple[Any, ...], List[int]] = defaultdict(lambda: [0] * len(spec.sums))
+    for row in query(spec.event, events_since):
+        group, sums = split(row)
+        pending[group] = [a + b for a, b in zip(pending[group], sums)]
+    rollups = query(spec.rollup, since).filter(spec.rollup.period == granularity)
+    for row in rollups.yield_per(STREAM_BATCH):
+        group, sums = split(row)
+        # The month that is being rolled up continues in the events
+        pending_sums = pending.pop(group, None)
+        if pending_sums:
+            sums = [a + b for a, b in zip(sums, pending_sums)]
+        yield stat(*group, *sums)
+    for group, sums in sorted(pending.items(), key=lambda item: item[0]):
+        yield stat(*group, *sums)
+
+
+def iter_download_stats(mod_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        granularity: str = 'day') -> Iterator[DownloadStat]:
+    return _iter_stats(DOWNLOADS, DownloadStat, mod_id, since, until, granularity)
+
+
+def iter_follow_stats(mod_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      granularity: str = 'day') -> Iterator[FollowStat]:
+    return _iter_stats(FOLLOWS, FollowStat, mod_id, since, until, granularity)
+
+
+def get_download_stats(mod_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       granularity: str = 'day') -> List[DownloadStat]:
+    return list(iter_download_stats(mod_id, since, until, granularity))
+
+
+def get_follow_stats(mod_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     granularity: str = 'day') -> List[FollowStat]:
+    return list(iter_follow_stats(mod_id, since, until, granularity))
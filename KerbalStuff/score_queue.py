@@ -0,0 +1,49 @@
+import threading
+from typing import Set
+
+from .background import BackgroundFlusher
+from .config import _cfgi
+from .database import db
+from .search import update_mod_scores
+
+
+class ScoreQueue(BackgroundFlusher):
+    """Collects the ids of mods whose scores need to be recalculated,
+    so a background thread can update all of them together every few seconds
+    instead of each request doing it for its own mod."""
+
+    name = 'score-queue'
+
+    def __init__(self, interval: int) -> None:
+        super().__init__(interval)
+        self._dirty: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def mark(self, mod_id: int) -> None:
+        with self._lock:
+            self._dirty.add(mod_id)
+        self.ensure_started()
+
+    def flush(self) -> int:
+        """Recalculates the scores of all the marked mods, returns how many changed"""
+        with self._lock:
+            mod_ids, self._dirty = self._dirty, set()
+        if not mod_ids:
+            return 0
+        try:
+            changed = update_mod_scores(mod_ids)
+            db.commit()
+            return changed
+        except:
+            db.rollback()
+            # Try again next time
+            with self._lock:
+                self._dirty |= mod_ids
+            raise
+
+
+score_queue = ScoreQueue(_cfgi('score-update-interval', 60))
+
+
+def mark_score_dirty(mod_id: int) -> None:
+    score_queue.mark(mod_id)
@@ -1,14 +1,19 @@
-import math
 import re
+from bisect import bisect_right
 from datetime import datetime
-from typing import List, Iterable, Tuple, Optional
+from typing import List, Iterable, Tuple, Optional, Dict, Any
 
 from packaging import version
-from sqlalchemy import and_, or_, not_
+from sqlalchemy import and_, or_, not_, func, cast, literal_column, Float, Text, update, bindparam
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Query
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.types import UserDefinedType
 
+from .cache import LRUCache
 from .database import db
-from .objects import Mod, ModVersion, User, Game, GameVersion, SharedAuthor, EnabledNotification, Notification
+from .objects import Mod, ModVersion, User, Game, GameVersion, SharedAuthor, EnabledNotification, Notification, \
+    ModList, ModListItem, Media
 
 
 def get_mod_score(mod: Mod) -> int:
@@ -51,35 +56,177 @@ def get_mod_score(mod: Mod) -> int:
 
 def versions_behind(mod: Mod) -> int:
     try:
-        all = game_versions(mod.game)
         compat = version.Version(mod.default_version.gameversion.friendly_version)
-        return sum(1 for v in all if v > compat)
     except version.InvalidVersion:
         return 0
+    return count_newer_versions(mod.game_id, compat)
 
 
-def game_versions(game: Game) -> Iterable[version.Version]:
-    for gv in game.versions:
+def count_newer_versions(game_id: int, compat: version.Version) -> int:
+    versions = sorted_game_versions(game_id)
+    return len(versions) - bisect_right(versions, compat)
+
+
+def parse_versions(friendly_versions: Iterable[str]) -> Iterable[version.Version]:
+    for friendly_version in friendly_versions:
         try:
-            ver = version.Version(gv.friendly_version)
-            yield ver
+            yield version.Version(friendly_version)
         except version.InvalidVersion:
             pass
 
 
+# Parsing all of a game's versions for every mod adds up when scoring the whole site.
+# Invalidated when versions are added here, the TTL takes care of other processes.
+game_versions_cache: LRUCache[List[version.Version]] = LRUCache('game-versions', 256, 600)
+
+
+def sorted_game_versions(game_id: int) -> List[version.Version]:
+    return game_versions_cache.get_or_set(
+        game_id,
+        lambda: sorted(parse_versions(friendly_version for friendly_version, in
+                                      db.query(GameVersion.friendly_version)
+                                        .filter(GameVersion.game_id == game_id))))
+
+
+def invalidate_game_versions(game_id: int) -> None:
+    game_versions_cache.invalidate(game_id)
+
+
+def update_mod_scores(mod_ids: Optional[Iterable[int]] = None) -> int:
+    """Recalculates the scores of the given mods, or all of them, the same way as get_mod_score.
+    Instead of loading every mod's relationships, the inputs are gathered with one
+    aggregate query each, and the changed scores are written back with one bulk UPDATE.
+    Returns how many scores changed.
+    """
+    ids = list(mod_ids) if mod_ids is not None else None
+    if ids is not None and not ids:
+        return 0
+
+    def for_mods(query: Query, mod_id_col: ColumnElement) -> Query:
+        return query.filter(mod_id_col.in_(ids)) if ids is not None else query
+
+    mods = for_mods(db.query(Mod.id, Mod.score, Mod.game_id, Mod.default_version_id,
+                             Mod.download_count, Mod.follower_count,
+                             func.length(Mod.description).label('description_length'),
+                             Mod.updated, Mod.created, Mod.source_link,
+                             GameVersion.friendly_version.label('compat_version'))
+                    .outerjoin(ModVersion, ModVersion.id == Mod.default_version_id)
+                    .outerjoin(GameVersion, GameVersion.id == ModVersion.gameversion_id),
+                    Mod.id).all()
+    # Packs by other users that include the mod
+    pack_counts = dict(for_mods(db.query(ModListItem.mod_id, func.count(ModListItem.mod_list_id.distinct()))
+                                .join(ModList, ModList.id == ModListItem.mod_list_id)
+                                .join(Mod, Mod.id == ModListItem.mod_id)
+                                .filter(ModList.user_id.is_distinct_from(Mod.user_id))
+                                .group_by(ModListItem.mod_id),
+                                ModListItem.mod_id).all())
+    version_counts = dict(for_mods(db.query(ModVersion.mod_id, func.count(ModVersion.id))
+                                   .group_by(ModVersion.mod_id),
+                                   ModVersion.mod_id).all())
+    media_counts = dict(for_mods(db.query(Media.mod_id, func.count(Media.id))
+                                 .group_by(Media.mod_id),
+                                 Media.mod_id).all())
+
+    now = datetime.now()
+    changes: List[Dict[str, Any]] = []
+    for mod in mods:
+        score: float = 0
+        if mod.default_version_id is not None:
+            score += mod.download_count
+            score += 10 * mod.follower_count
+            score += 15 * pack_counts.get(mod.id, 0)
+            score += version_counts.get(mod.id, 0) // 5
+            score += media_counts.get(mod.id, 0)
+            if (mod.description_length or 0) < 100:
+                score -= 10
+            if mod.updated:
+                score -= min((now - mod.updated).days, 100) / 5
+            if mod.source_link:
+                score += 10
+            if (mod.created - now).days < 30:
+                score += 100
+            try:
+                num_incompat = count_newer_versions(mod.game_id, version.Version(mod.compat_version))
+            except (version.InvalidVersion, TypeError):
+                num_incompat = 0
+            if num_incompat > 0:
+                score = int(score * (1.0 - min(0.05 * num_incompat, 0.9)))
+        if score != mod.score:
+            changes.append({'mod_id': mod.id, 'new_score': score})
+    if changes:
+        db.execute(update(Mod.__table__)
+                   .where(Mod.__table__.c.id == bindparam('mod_id'))
+                   .values(score=bindparam('new_score')),
+                   changes)
+    return len(changes)
+
 # Optional '-' at start, followed by:
 #   1. "term with spaces", OR
 #   2. termwithoutquotesorspaces
 SEARCH_TOKEN_PATTERN = re.compile(r'-?(?:"[^"]*"|[^" ]+)')
+# Terms starting with these are handled by term_to_filter as filters rather than text to look for
+FILTER_TERM_PREFIXES = ('ver:', 'user:', 'game:', 'notif:', 'downloads:', 'followers:')
+
+
+class TSQUERY(UserDefinedType):
+    # Missing from SQLAlchemy's PostgreSQL types
+    cache_ok = True
+
+    def get_col_spec(self, **kw: Any) -> str:
+        return 'TSQUERY'
+
+
+# Maintained by PostgreSQL, see objects.MOD_SEARCH_VECTOR_DDL
+MOD_SEARCH_VECTOR = literal_column('mod.search_vector', TSVECTOR)
+SEARCH_CONFIG = 'english'
+# How much a perfect text match is worth compared to the natural logarithm of a mod's score
+SEARCH_RANK_WEIGHT = 10
+
+
+def full_text_search_supported() -> bool:
+    return db.get_bind().dialect.name == 'postgresql'
+
+
+def search_terms(text: str) -> List[str]:
+    return [term.replace('"', '') for term in SEARCH_TOKEN_PATTERN.findall(text)]
+
+
+def term_to_tsquery(term: str) -> ColumnElement:
+    # PostgreSQL's parser splits the term into lexemes the same way it splits the mods' text,
+    # so version numbers like 1.12 stay one lexeme, stopwords are dropped, and user input can't break the syntax.
+    # Multiple words have to appear next to each other, and the last one may be the start of a longer word.
+    phrase = func.phraseto_tsquery(SEARCH_CONFIG, term)
+    return cast(func.regexp_replace(cast(phrase, Text), "'$", "':*"), TSQUERY)
+
+
+def text_filter(term: str, negate: bool = False) -> ColumnElement:
+    # A term of stopwords or punctuation only has no lexemes, and doesn't filter anything
+    tsquery = term_to_tsquery(term)
+    match = MOD_SEARCH_VECTOR.op('@@')(tsquery)
+    return or_(func.numnode(tsquery) == 0, not_(match) if negate else match)
+
+
+def search_rank(text: str) -> Optional[ColumnElement]:
+    # Blend how well the text matches with how popular the mod is
+    tsqueries = [term_to_tsquery(term) for term in search_terms(text)
+                 if not term.startswith(('-', *FILTER_TERM_PREFIXES))]
+    if not tsqueries:
+        return None
+    # Terms without lexemes drop out of the conjunction
+    tsquery = tsqueries[0]
+    for tsq in tsqueries[1:]:
+        tsquery = tsquery.op('&&')(tsq)
+    return (cast(func.ts_rank(MOD_SEARCH_VECTOR, tsquery), Float) * SEARCH_RANK_WEIGHT
+            + func.ln(func.greatest(Mod.score, 0) + 1))
 
 
 def apply_search_to_query(query: Query, text: str) -> Query:
     # All of the terms must match
-    terms = [term.replace('"', '') for term in SEARCH_TOKEN_PATTERN.findall(text)]
-    return query.filter(*(term_to_filter(term) for term in terms))
+    return query.filter(*(term_to_filter(term) for term in search_terms(text)))
 
 
-def search_mods(game_id: Optional[int], text: str, page: int, limit: int) -> Tuple[List[Mod], int]:
+def search_mods_query(game_id: Optional[int], text: str) -> Tuple[Query, List[ColumnElement]]:
+    """Returns the unordered published mods matching text, and the keys to sort them by, best first"""
     query = db.query(Mod).join(Mod.user).join(Mod.game)
     if game_id:
         query = query.filter(Mod.game_id == game_id)
@@ -87,20 +234,14 @@ def search_mods(game_id: Optional[int], text: str, page: int, limit: int) -> Tup
 
     query = apply_search_to_query(query, text)
 
-    query = query.order_by(Mod.score.desc())
-
-    total_pages = math.ceil(query.count() / limit)
-    if page > total_pages:
-        page = total_pages
-    if page < 1:
-        page = 1
-    mods = query.offset(limit * (page - 1)).limit(limit).all()
-
-    return mods, total_pages
+    rank = search_rank(text) if full_text_search_supported() else None
+    return query, [rank if rank is not None else Mod.score, Mod.id]
 
 
 def term_to_filter(term: str) -> Query:
     if term.startswith('-'):
+        if full_text_search_supported() and not term[1:].startswith(FILTER_TERM_PREFIXES):
+            return text_filter(term[1:], negate=True)
         return not_(term_to_filter(term[1:]))
     if term.startswith("ver:"):
         return Mod.versions.any(ModVersion.gameversion.has(or_(
@@ -132,6 +273,8 @@ def term_to_filter(term: str) -> Query:
         return Mod.follower_count < int(term[11:])
     # Now the leftover is probably what the user thinks the mod name is.
     # ALL of them have to match again, however we don't care if it's in the name or description.
+    if full_text_search_supported():
+        return text_filter(term)
     return or_(Mod.name.ilike('%' + term + '%'),
                Mod.short_description.ilike('%' + term + '%'),
                Mod.description.ilike('%' + term + '%'))
@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .changes import latest_change_id
+from .config import _cfg, site_logger
+from .custom_json import CustomJSONEncoder
+from .database import db
+from .objects import Game, GameVersion, Mod
+
+# Relative to storage, so common.sendfile can serve them
+SNAPSHOT_PATH = 'snapshots/catalog.json.gz'
+MANIFEST_PATH = 'snapshots/catalog-manifest.json'
+
+
+def _file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_snapshot() -> Optional[Dict[str, Any]]:
+    """Writes all the published mods with their versions, and the games with theirs,
+    to a gzipped JSON file in storage, and a manifest next to it. Returns the manifest.
+    The mods are read from a server-side cursor and encoded a batch at a time,
+    so the catalog is never held in memory in full."""
+    storage = _cfg('storage')
+    if not storage:
+        return None
+    # Imported here because the app imports the celery tasks that call this
+    from .app import app
+    from .blueprints.api import game_info, game_version_info, iter_mod_list
+
+    # Whatever changes while the snapshot is being written is in the change feed after this cursor
+    cursor = latest_change_id()
+    generated = datetime.now()
+    full_path = os.path.join(storage, SNAPSHOT_PATH)
+    tmp_path = f'{full_path}.{os.getpid()}.tmp'
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    encoder = CustomJSONEncoder(separators=(',', ':'))
+    mod_count = 0
+    try:
+        # url_for needs a request context, the URLs are relative just like the API's
+        with app.test_request_context(), gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            versions: Dict[int, List[Dict[str, str]]] = {}
+            for gv in GameVersion.query.order_by(GameVersion.id.desc()):
+                versions.setdefault(gv.game_id, []).append(game_version_info(gv))
+            games = [{**game_info(game), 'versions': versions.get(game.id, [])}
+                     for game in Game.query.filter(Game.active == True).order_by(Game.id)]
+            f.write(encoder.encode({'generated': generated, 'cursor': cursor, 'games': games})[:-1])
+            f.write(',"mods":[')
+            for mod in iter_mod_list(Mod.query.filter(Mod.published).order_by(Mod.id).yield_per(500)):
+                f.write((',' if mod_count else '') + encoder.encode(mod))
+                mod_count += 1
+            f.write(']}')
+        manifest = {
+            'generated': generated,
+            'cursor': cursor,
+            'mods': mod_count,
+            'size': os.path.getsize(tmp_path),
+            'sha256': _file_sha256(tmp_path),
+        }
+        # Downloads that are already running keep reading the old file
+        os.replace(tmp_path, full_path)
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    manifest_path = os.path.join(storage, MANIFEST_PATH)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, cls=CustomJSONEncoder)
+    os.replace(tmp_path, manifest_path)
+    site_logger.info('Wrote a snapshot of %s mods at change %s', mod_count, cursor)
+    return manifest
@@ -1,45 +1,33 @@
 import logging
 import os.path
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Type, Union
 
 from PIL import Image
 from flask import url_for
 
+from KerbalStuff.cache import LRUCache
 from KerbalStuff.config import _cfg, _cfgi, site_logger
-from KerbalStuff.database import db
 
 if TYPE_CHECKING:
     from KerbalStuff.objects import Mod, ModList, Game
 
 
-def create(background_path: str, thumbnail_path: str) -> None:
-    if not os.path.isfile(background_path):
-        raise FileNotFoundError('Background image does not exist')
-
-    size_str = _cfg('thumbnail_size')
-    if not size_str:
-        size_str = "320x195"
-    size_str_tuple = size_str.split('x')
-    size = (int(size_str_tuple[0]), int(size_str_tuple[1]))
-
-    quality = _cfgi('thumbnail_quality')
-    # Docs say the quality shouldn't be above 95:
-    # https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#jpeg
-    if not quality or not (0 <= quality <= 95):
-        quality = 80
-
-    im = Image.open(background_path)
-
+def scale_and_crop(im: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Cuts the largest area with the aspect ratio of size out of the center of the image,
+    scaled down to size"""
     # We want to resize the image to the desired size in the least costly way,
     # while not distorting it. This means we first check which side needs _less_ rescaling to reach
     # the target size. After that we scale it down while keeping the original aspect ratio.
-    x_ratio = abs(im.width/size[0])
-    y_ratio = abs(im.height/size[1])
+    ratio = min(im.width / size[0], im.height / size[1])
+    scaled_size = (round(im.width / ratio), round(im.height / ratio))
 
-    if x_ratio < y_ratio:
-        im = im.resize((size[0], round(im.height/x_ratio)), Image.LANCZOS)
-    else:
-        im = im.resize((round(im.width/y_ratio), size[1]), Image.LANCZOS)
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 of their size for much less than the full image,
+    # keep at least twice the pixels we need so the LANCZOS resize still has enough to work with.
+    # Other formats ignore this.
+    im.draft(None, (scaled_size[0] * 2, scaled_size[1] * 2))
+    # reducing_gap first shrinks the image by an integer factor with a box filter
+    # (Image.reduce), then only the last step down to size is done with LANCZOS
+    im = im.resize(scaled_size, Image.LANCZOS, reducing_gap=3.0)
 
     # Now there's one pair of edges that already has the target length (height or width).
     # Next step is cropping the thumbnail out of the center of the down-scaled base image,
@@ -51,137 +39,216 @@ def create(background_path: str, thumbnail_path: str) -> None:
     box_upper = round(0.5 * (im.height - size[1]))
     box_right = round(0.5 * (im.width + size[0]))
     box_lower = round(0.5 * (im.height + size[1]))
-    im = im.crop((box_left, box_upper, box_right, box_lower))
+    return im.crop((box_left, box_upper, box_right, box_lower))
 
-    if im.mode != "RGB":
-        im = im.convert("RGB")
-    im.save(thumbnail_path, 'jpeg', quality=quality, optimize=True)
 
+# File extensions and Content-Types of the formats Pillow can write thumbnails in
+THUMBNAIL_FORMATS = {'jpeg': ('.jpg', 'image/jpeg'), 'webp': ('.webp', 'image/webp')}
 
-# Returns the URL for the thumbnail
-def get_or_create(mod: 'Mod') -> Optional[str]:
+
+def thumbnail_size() -> Tuple[int, int]:
+    size_str = _cfg('thumbnail_size')
+    if not size_str:
+        size_str = "320x195"
+    size_str_tuple = size_str.split('x')
+    return int(size_str_tuple[0]), int(size_str_tuple[1])
+
+
+def thumbnail_variants() -> List[Tuple[int, str]]:
+    """The (scale, format) pairs of the configured thumbnail variants,
+    (1, 'jpeg') is always among them, it's the thumbnail itself"""
+    scales = {int(scale) for scale in (_cfg('thumbnail_scales') or '1').split(',') if scale.strip()}
+    formats = {fmt.strip().lower() for fmt in (_cfg('thumbnail_formats') or 'jpeg').split(',')
+               if fmt.strip().lower() in THUMBNAIL_FORMATS}
+    return sorted({(1, 'jpeg'), *((scale, fmt) for scale in scales for fmt in formats)})
+
+
+def variant_name(scale: int, fmt: str) -> str:
+    return f'{scale}x{THUMBNAIL_FORMATS[fmt][0]}'
+
+
+def variant_path(thumbnail_path: str, scale: int, fmt: str) -> str:
+    """Where a variant of the thumbnail at thumbnail_path is stored, next to it"""
+    base = os.path.splitext(thumbnail_path)[0]
+    return base + ('' if scale == 1 else f'@{scale}x') + THUMBNAIL_FORMATS[fmt][0]
+
+
+def variant_path_from_name(thumbnail_path: str, name: str) -> Optional[str]:
+    """The path of the variant with the name from variant_name, if it's configured"""
+    for scale, fmt in thumbnail_variants():
+        if variant_name(scale, fmt) == name:
+            return variant_path(thumbnail_path, scale, fmt)
+    return None
+
+
+def create(background_path: str, thumbnail_path: str) -> None:
+    """Creates all the variants of the thumbnail from one decode of the background,
+    skipping the scales the background is too small for"""
+    if not os.path.isfile(background_path):
+        raise FileNotFoundError('Background image does not exist')
+
+    size = thumbnail_size()
+
+    quality = _cfgi('thumbnail_quality')
+    # Docs say the quality shouldn't be above 95:
+    # https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#jpeg
+    if not quality or not (0 <= quality <= 95):
+        quality = 80
+
+    # Only reads the header, so this is checked before decoding anything
+    im = Image.open(background_path)
+    max_pixels = _cfgi('thumbnail_max_pixels', 100000000)
+    if im.width * im.height > max_pixels:
+        raise ValueError(f'Background image is too large ({im.width}x{im.height})')
+
+    background_size = im.size
+
+    variants = thumbnail_variants()
+    # Largest first, so the draft decode in scale_and_crop is large enough for all of them
+    for scale in sorted({scale for scale, _ in variants}, reverse=True):
+        if scale > 1 and (background_size[0] < size[0] * scale or background_size[1] < size[1] * scale):
+            # It would only be blown up
+            continue
+        scaled = scale_and_crop(im, (size[0] * scale, size[1] * scale))
+        if scaled.mode != "RGB":
+            scaled = scaled.convert("RGB")
+        for fmt in (fmt for variant_scale, fmt in variants if variant_scale == scale):
+            scaled.save(variant_path(thumbnail_path, scale, fmt), fmt, quality=quality, optimize=True)
+
+
+# Backgrounds whose thumbnails this process has asked celery for recently, by (kind, id, background)
+queued_thumbnails: LRUCache[bool] = LRUCache('queued-thumbnails', 4096, 600)
+
+
+def queue_thumbnail(kind: str, obj: 'Union[Mod, ModList, Game]') -> None:
+    """Lets celery create the thumbnail of the object's background, if it isn't already on it"""
+    key = (kind, obj.id, obj.background)
+    if queued_thumbnails.get(key):
+        return
+    # Imported here because the celery tasks import the objects, which import this module
+    from KerbalStuff.celery import create_thumbnail
+    try:
+        create_thumbnail.delay(kind, obj.id)
+    except Exception:
+        # The page still works with the background, the next view tries again
+        site_logger.exception('Unable to queue the thumbnail of %s %d', kind, obj.id)
+        return
+    queued_thumbnails.set(key, True)
+
+
+def thumbnail_owners() -> 'Dict[str, Type[Union[Mod, ModList, Game]]]':
+    """The classes with backgrounds by the kind queue_thumbnail is passed"""
+    from KerbalStuff.objects import Mod, ModList, Game
+    return {'mod': Mod, 'pack': ModList, 'game': Game}
+
+
+def thumbnail_paths(obj: 'Union[Mod, ModList, Game]', storage: str) -> Tuple[str, str, str]:
+    """The background's absolute path, and the thumbnail's path relative to storage and absolute"""
+    thumb_path = thumb_path_from_background_path(obj.background)
+    return os.path.join(storage, obj.background), thumb_path, os.path.join(storage, thumb_path)
+
+
+def generate(obj: 'Union[Mod, ModList, Game]') -> None:
+    """Creates the thumbnail of the object's background if there isn't one yet, the caller commits"""
+    storage = _cfg('storage')
+    if not storage or not obj.background:
+        return
+    background_disk_path, thumb_path, thumb_disk_path = thumbnail_paths(obj, storage)
+    logging.debug("Checking file system for thumbnail")
+    if not os.path.isfile(thumb_disk_path):
+        if not os.path.isfile(background_disk_path):
+            site_logger.warning('Background image does not exist, clearing path from db')
+            obj.background = None
+            return
+        logging.debug("Creating thumbnail")
+        create(background_disk_path, thumb_disk_path)
+    obj.thumbnail = thumb_path
+
+
+# The variants that exist for a thumbnail path and modification time, so the boxes only check one file.
+# Any process can replace a background, the new thumbnail's time keeps the others from using the old variants.
+available_variants_cache: LRUCache[List[Tuple[int, str]]] = LRUCache('thumbnail-variants', 4096, 3600)
+
+
+def available_variants(thumbnail_path: str) -> List[Tuple[int, str]]:
+    storage = _cfg('storage')
+    if not storage:
+        return []
+    try:
+        mtime = os.stat(os.path.join(storage, thumbnail_path)).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    return available_variants_cache.get_or_set((thumbnail_path, mtime), lambda: [
+        (scale, fmt) for scale, fmt in thumbnail_variants()
+        if os.path.isfile(os.path.join(storage, variant_path(thumbnail_path, scale, fmt)))])
+
+
+def _image_set(obj: 'Union[Mod, ModList, Game]', variant_url: Callable[[str], str]) -> Optional[str]:
+    """CSS image-set() of the thumbnail's variants, so browsers pick the format and resolution they want"""
+    if not obj.thumbnail:
+        return None
+    protocol = _cfg('protocol')
+    cdn_domain = _cfg('cdn-domain')
+    variants = available_variants(obj.thumbnail)
+    if len(variants) < 2:
+        return None
+    # Preferred formats first, browsers take the first one they support
+    preference = sorted(THUMBNAIL_FORMATS, key=lambda fmt: fmt == 'jpeg')
+    candidates = []
+    for scale, fmt in sorted(variants, key=lambda v: (preference.index(v[1]), v[0])):
+        url = (f'{protocol}://{cdn_domain}/{variant_path(obj.thumbnail, scale, fmt)}'
+               if protocol and cdn_domain else variant_url(variant_name(scale, fmt)))
+        candidates.append(f'url("{url}") type("{THUMBNAIL_FORMATS[fmt][1]}") {scale}x')
+    return f'image-set({", ".join(candidates)})'
+
+
+def _get_or_queue(kind: str, obj: 'Union[Mod, ModList, Game]', thumbnail_url: Callable[[], str]) -> Optional[str]:
     protocol = _cfg('protocol')
     cdn_domain = _cfg('cdn-domain')
 
-    if not mod.thumbnail:
-        storage = _cfg('storage')
-        if not mod.background:
+    if not obj.thumbnail:
+        if not obj.background:
             return None
-        if not storage:
-            return mod.background_url(protocol, cdn_domain)
-
-        thumb_path = thumb_path_from_background_path(mod.background)
-
-        thumb_disk_path = os.path.join(storage, thumb_path)
-        background_disk_path = os.path.join(storage, mod.background)
-
-        logging.debug("Checking file system for thumbnail")
-        if not os.path.isfile(thumb_disk_path):
-            if not os.path.isfile(background_disk_path):
-                site_logger.warning('Background image does not exist, clearing path from db')
-                mod.background = None
-                db.add(mod)
-                db.commit()
-                return None
-            try:
-                logging.debug("Creating thumbnail")
-                create(background_disk_path, thumb_disk_path)
-            except Exception as e:
-                site_logger.exception(e)
-                return mod.background_url(protocol, cdn_domain)
-        mod.thumbnail = thumb_path
-        db.add(mod)
-        db.commit()
+        if _cfg('storage'):
+            queue_thumbnail(kind, obj)
+        # Until the thumbnail is ready
+        return obj.background_url(protocol, cdn_domain)
 
     # Directly return the CDN path if we have any, so we don't have a redirect that breaks caching.
     if protocol and cdn_domain:
-        return f'{protocol}://{cdn_domain}/{mod.thumbnail}'
+        return f'{protocol}://{cdn_domain}/{obj.thumbnail}'
     else:
-        return url_for('mods.mod_thumbnail', mod_id=mod.id, mod_name=mod.name)
+        return thumbnail_url()
 
 
 # Returns the URL for the thumbnail
-def get_or_create_pack(pack: 'ModList') -> Optional[str]:
-    protocol = _cfg('protocol')
-    cdn_domain = _cfg('cdn-domain')
+def get_or_create(mod: 'Mod') -> Optional[str]:
+    return _get_or_queue('mod', mod, lambda: url_for('mods.mod_thumbnail', mod_id=mod.id, mod_name=mod.name))
 
-    if not pack.thumbnail:
-        storage = _cfg('storage')
-        if not pack.background:
-            return None
-        if not storage:
-            return pack.background_url(protocol, cdn_domain)
-
-        thumb_path = thumb_path_from_background_path(pack.background)
-
-        thumb_disk_path = os.path.join(storage, thumb_path)
-        background_disk_path = os.path.join(storage, pack.background)
-
-        logging.debug("Checking file system for thumbnail")
-        if not os.path.isfile(thumb_disk_path):
-            if not os.path.isfile(background_disk_path):
-                site_logger.warning('Background image does not exist, clearing path from db')
-                pack.background = None
-                db.add(pack)
-                db.commit()
-                return None
-            try:
-                logging.debug("Creating thumbnail")
-                create(background_disk_path, thumb_disk_path)
-            except Exception as e:
-                site_logger.exception(e)
-                return pack.background_url(protocol, cdn_domain)
-        pack.thumbnail = thumb_path
-        db.add(pack)
-        db.commit()
 
-    # Directly return the CDN path if we have any, so we don't have a redirect that breaks caching.
-    if protocol and cdn_domain:
-        return f'{protocol}://{cdn_domain}/{pack.thumbnail}'
-    else:
-        return url_for('lists.list_thumbnail', pack_id=pack.id, pack_name=pack.name)
+# Returns the URL for the thumbnail
+def get_or_create_pack(pack: 'ModList') -> Optional[str]:
+    return _get_or_queue('pack', pack, lambda: url_for('lists.list_thumbnail', pack_id=pack.id, pack_name=pack.name))
 
 
 # Returns the URL for the thumbnail
 def get_or_create_game(game: 'Game') -> Optional[str]:
-    protocol = _cfg('protocol')
-    cdn_domain = _cfg('cdn-domain')
+    return _get_or_queue('game', game, lambda: url_for('anonymous.game_thumbnail', gameshort=game.short))
 
-    if not game.thumbnail:
-        storage = _cfg('storage')
-        if not game.background:
-            return None
-        if not storage:
-            return game.background_url(protocol, cdn_domain)
-
-        thumb_path = thumb_path_from_background_path(game.background)
-
-        thumb_disk_path = os.path.join(storage, thumb_path)
-        background_disk_path = os.path.join(storage, game.background)
-
-        logging.debug("Checking file system for thumbnail")
-        if not os.path.isfile(thumb_disk_path):
-            if not os.path.isfile(background_disk_path):
-                site_logger.warning('Background image does not exist, clearing path from db')
-                game.background = None
-                db.add(game)
-                db.commit()
-                return None
-            try:
-                logging.debug("Creating thumbnail")
-                create(background_disk_path, thumb_disk_path)
-            except Exception as e:
-                site_logger.exception(e)
-                return game.background_url(protocol, cdn_domain)
-        game.thumbnail = thumb_path
-        db.add(game)
-        db.commit()
 
-    # Directly return the CDN path if we have any, so we don't have a redirect that breaks caching.
-    if protocol and cdn_domain:
-        return f'{protocol}://{cdn_domain}/{game.thumbnail}'
-    else:
-        return url_for('anonymous.game_thumbnail', gameshort=game.short)
+def image_set(mod: 'Mod') -> Optional[str]:
+    return _image_set(mod, lambda variant: url_for('mods.mod_thumbnail', mod_id=mod.id, mod_name=mod.name,
+                                                   variant=variant))
+
+
+def image_set_pack(pack: 'ModList') -> Optional[str]:
+    return _image_set(pack, lambda variant: url_for('lists.list_thumbnail', pack_id=pack.id, pack_name=pack.name,
+                                                    variant=variant))
+
+
+def image_set_game(game: 'Game') -> Optional[str]:
+    return _image_set(game, lambda variant: url_for('anonymous.game_thumbnail', gameshort=game.short,
+                                                    variant=variant))
 
 
 def thumb_path_from_background_path(background_path: str) -> str:
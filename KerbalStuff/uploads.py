@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from shutil import rmtree
+from typing import Any, Dict, IO, List, Mapping, NamedTuple, Optional
+
+from .cache import LRUCache
+from .config import _cfgi, site_logger
+
+# Relative to storage, one directory per user and upload session
+UPLOADS_PATH = 'uploads'
+# Relative to storage, complete uploads wait in here for their virus scan under random names.
+# Neither directory may be served by the web server or the CDN.
+PENDING_PATH = 'pending'
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Uploads are read in these steps for hashing
+READ_SIZE = 1024 * 1024
+
+# Every chunk of a session is looked up on every request, Dropzone sends 10 GB in 5000 chunks of 2 MB
+MAX_CHUNKS = 20000
+
+# Finishing an upload takes a moment, a request that claimed it longer ago than this died
+CLAIM_TIMEOUT = 600
+
+
+class UploadError(Exception):
+    def __init__(self, reason: str, status: int = 400) -> None:
+        super().__init__(reason)
+        self.status = status
+
+
+class CompletedUpload(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+class ChunkRecord(NamedTuple):
+    offset: int
+    size: int
+    sha256: str
+
+
+class _RunningHash:
+    """SHA-256 of an upload's first bytes, advanced as the chunks after them arrive"""
+
+    def __init__(self) -> None:
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+        self.lock = threading.Lock()
+
+
+# The hashes of the uploads this process has seen every chunk of so far.
+# Chunks that went to other processes leave a gap, which is hashed from disk once the upload is complete.
+running_hashes: LRUCache[_RunningHash] = LRUCache('upload-hashes', 256, 86400)
+
+
+def _form_int(form: Mapping[str, str], name: str) -> Optional[int]:
+    value = form.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise UploadError(f'{name} must be a number.')
+
+
+class UploadSession:
+    """A file uploaded in chunks, which can arrive in any order and be sent again after a disconnect.
+    The chunks are written to their offsets in one file, with a record of each of them next to it."""
+
+    def __init__(self, storage: str, user_id: int, session_id: str) -> None:
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise UploadError('Invalid upload session id.')
+        self.session_id = session_id
+        self.path = os.path.join(storage, UPLOADS_PATH, str(user_id), session_id)
+        self.data_path = os.path.join(self.path, 'upload.part')
+        self._hash_key = (user_id, session_id)
+
+    def _chunk_record_path(self, index: int) -> str:
+        return os.path.join(self.path, f'{index}.chunk')
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._meta_path())
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, 'session.json')
+
+    def meta(self) -> Dict[str, Any]:
+        with open(self._meta_path()) as f:
+            meta: Dict[str, Any] = json.load(f)
+        return meta
+
+    def start(self, total_chunks: int, total_size: Optional[int]) -> Dict[str, Any]:
+        """Creates the session if it doesn't exist, and returns its metadata"""
+        os.makedirs(self.path, exist_ok=True)
+        meta = {'total_chunks': total_chunks, 'total_size': total_size, 'created': time.time()}
+        try:
+            # Only the first chunk to arrive writes it
+            with open(self._meta_path(), 'x') as f:
+                json.dump(meta, f)
+        except FileExistsError:
+            meta = self.meta()
+            if meta['total_chunks'] != total_chunks or meta['total_size'] != total_size:
+                raise UploadError('Chunk does not belong to this upload.')
+        return meta
+
+    def chunks(self) -> Dict[int, ChunkRecord]:
+        """The chunks that arrived, by their index"""
+        chunks = {}
+        for name in os.listdir(self.path):
+            index, ext = os.path.splitext(name)
+            if ext == '.chunk' and index.isdigit():
+                try:
+                    with open(os.path.join(self.path, name)) as f:
+                        chunks[int(index)] = ChunkRecord(*json.load(f))
+                except (OSError, ValueError, TypeError):
+                    # Being written, or broken by a crash, either way it has to be sent (again)
+                    continue
+        return chunks
+
+    def write_chunk(self, index: int, offset: int, data: bytes, checksum: Optional[str]) -> None:
+        sha256 = hashlib.sha256(data).hexdigest()
+        if checksum and checksum.lower() != sha256:
+            raise UploadError(f'Checksum of chunk {index} does not match, please send it again.')
+        fd = os.open(self.data_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+            # The record claims the chunk is on disk, so it has to be
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        record_path = self._chunk_record_path(index)
+        tmp_path = f'{record_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(ChunkRecord(offset, len(data), sha256), f)
+        os.replace(tmp_path, record_path)
+        self._advance_hash(offset, data)
+
+    def _advance_hash(self, offset: int, data: bytes) -> None:
+        running = running_hashes.get(self._hash_key)
+        if running is None:
+            if offset != 0:
+                return
+            running = _RunningHash()
+            running_hashes.set(self._hash_key, running)
+        with running.lock:
+            if running.offset == offset:
+                running.sha256.update(data)
+                running.offset += len(data)
+            elif offset < running.offset:
+                # Sent again, maybe with other bytes than the ones that are hashed already
+                running_hashes.invalidate(self._hash_key)
+
+    def missing_chunks(self, meta: Dict[str, Any], chunks: Dict[int, ChunkRecord]) -> List[int]:
+        return [index for index in range(meta['total_chunks']) if index not in chunks]
+
+    def finish(self, meta: Dict[str, Any], chunks: Dict[int, ChunkRecord]) -> CompletedUpload:
+        """Checks that the chunks make up the whole file without gaps, and computes its SHA-256"""
+        size = 0
+        for index in range(meta['total_chunks']):
+            if chunks[index].offset != size:
+                self.discard()
+                raise UploadError(f'Chunk {index} does not start where chunk {index - 1} ends.')
+            size += chunks[index].size
+        if meta['total_size'] is not None and size != meta['total_size']:
+            self.discard()
+            raise UploadError(f'Received {size} bytes, but the file has {meta["total_size"]}.')
+        running = running_hashes.get(self._hash_key)
+        running_hashes.invalidate(self._hash_key)
+        if running is None:
+            running = _RunningHash()
+        with running.lock, open(self.data_path, 'rb') as f:
+            # Whatever arrived out of order or in other processes
+            f.seek(running.offset)
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                running.sha256.update(block)
+        return CompletedUpload(self.data_path, size, running.sha256.hexdigest())
+
+    def _claim_path(self) -> str:
+        return os.path.join(self.path, 'finishing')
+
+    def finishing(self) -> bool:
+        """Whether a request is finishing the upload, rather than died while it was"""
+        try:
+            return os.path.getmtime(self._claim_path()) >= time.time() - CLAIM_TIMEOUT
+        except FileNotFoundError:
+            return False
+
+    def claim(self) -> bool:
+        """Only one of the requests that see the upload complete gets to finish it"""
+        for _ in range(2):
+            try:
+                os.close(os.open(self._claim_path(), os.O_CREAT | os.O_EXCL))
+                return True
+            except FileExistsError:
+                if self.finishing():
+                    return False
+            # The request that claimed it died before it was done, the next chunk that arrives finishes it
+            self.release()
+        return False
+
+    def release(self) -> None:
+        """Lets another request finish the upload"""
+        try:
+            os.remove(self._claim_path())
+        except FileNotFoundError:
+            pass
+
+    def discard(self) -> None:
+        running_hashes.invalidate(self._hash_key)
+        rmtree(self.path, ignore_errors=True)
+
+
+def receive_chunk(storage: str, user_id: int, form: Mapping[str, str], stream: IO[bytes]) -> Optional[CompletedUpload]:
+    """Stores a chunk of an upload from Dropzone's form fields, and returns the upload once every chunk arrived.
+    The file stays in the session's directory, the caller moves it away and calls discard_upload.
+    Requests without dzuuid upload the whole file at once."""
+    total_chunks = _form_int(form, 'dztotalchunkcount') or 1
+    index = _form_int(form, 'dzchunkindex') or 0
+    session_id = form.get('dzuuid')
+    if not session_id:
+        if total_chunks > 1:
+            raise UploadError('dzuuid is required for uploads in more than one chunk.')
+        session_id = uuid.uuid4().hex
+    total_size = _form_int(form, 'dztotalfilesize')
+    if total_size is not None and total_size < 0:
+        raise UploadError('dztotalfilesize must not be negative.')
+    # Every chunk has at least a byte
+    max_chunks = MAX_CHUNKS if total_size is None else min(MAX_CHUNKS, max(total_size, 1))
+    if not 0 < total_chunks <= max_chunks:
+        raise UploadError(f'An upload can not have {total_chunks} chunks.')
+    if not 0 <= index < total_chunks:
+        raise UploadError(f'Chunk {index} of {total_chunks} does not exist.')
+    session = UploadSession(storage, user_id, session_id)
+    meta = session.start(total_chunks, total_size)
+
+    offset = _form_int(form, 'dzchunkbyteoffset')
+    if offset is None:
+        if index == 0:
+            offset = 0
+        else:
+            previous = session.chunks().get(index - 1)
+            if not previous:
+                raise UploadError('dzchunkbyteoffset is required for chunks sent out of order.')
+            offset = previous.offset + previous.size
+    data = stream.read()
+    if offset < 0 or (total_size is not None and offset + len(data) > total_size):
+        raise UploadError(f'Chunk {index} does not fit into the file.')
+    session.write_chunk(index, offset, data, form.get('dzchunksha256'))
+
+    chunks = session.chunks()
+    if session.missing_chunks(meta, chunks) or not session.claim():
+        return None
+    try:
+        upload = session.finish(meta, chunks)
+    except BaseException:
+        session.release()
+        raise
+    checksum = form.get('sha256')
+    if checksum and checksum.lower() != upload.sha256:
+        session.discard()
+        raise UploadError('Checksum of the upload does not match, please upload it again.')
+    return upload
+
+
+def upload_status(storage: str, user_id: int, session_id: str) -> Optional[Dict[str, Any]]:
+    """What the server has of an upload, so an interrupted one can send only the chunks that are missing"""
+    session = UploadSession(storage, user_id, session_id)
+    if not session.exists():
+        return None
+    meta = session.meta()
+    chunks = session.chunks()
+    missing_chunks = session.missing_chunks(meta, chunks)
+    if not missing_chunks and not session.finishing():
+        # Every chunk arrived, but the request that got to finish the upload died.
+        # Sending the last chunk again finishes it.
+        missing_chunks = [meta['total_chunks'] - 1]
+        chunks.pop(meta['total_chunks'] - 1, None)
+    return {
+        'id': session_id,
+        'total_chunks': meta['total_chunks'],
+        'total_size': meta['total_size'],
+        'received_chunks': sorted(chunks),
+        'missing_chunks': missing_chunks,
+        'received_size': sum(chunk.size for chunk in chunks.values()),
+    }
+
+
+def hold_upload(storage: str, upload: CompletedUpload) -> str:
+    """Moves a complete upload out of its session to wait for its scan, returns where to, relative to storage.
+    Only releasing it after the scan links it to a version's download_path."""
+    pending_path = os.path.join(PENDING_PATH, f'{uuid.uuid4().hex}.zip')
+    os.makedirs(os.path.join(storage, PENDING_PATH), exist_ok=True)
+    os.replace(upload.path, os.path.join(storage, pending_path))
+    discard_upload(upload)
+    return pending_path
+
+
+def discard_pending(storage: str, pending_path: Optional[str]) -> None:
+    """Removes an upload that waited for a scan that's no longer needed"""
+    if pending_path:
+        try:
+            os.remove(os.path.join(storage, pending_path))
+        except FileNotFoundError:
+            pass
+
+
+def discard_upload(upload: CompletedUpload) -> None:
+    """Removes what's left of the upload's session"""
+    rmtree(os.path.dirname(upload.path), ignore_errors=True)
+
+
+def clean_upload_sessions(storage: str) -> None:
+    """Removes the sessions that haven't been completed in upload-session-ttl seconds"""
+    uploads_path = os.path.join(storage, UPLOADS_PATH)
+    if not os.path.isdir(uploads_path):
+        return
+    expired = time.time() - _cfgi('upload-session-ttl', 86400)
+    for user_dir in os.scandir(uploads_path):
+        if not user_dir.is_dir():
+            continue
+        for session_dir in os.scandir(user_dir.path):
+            # Every chunk touches the session's directory
+            if session_dir.is_dir() and session_dir.stat().st_mtime < expired:
+                site_logger.info('Removing abandoned upload %s', session_dir.path)
+                rmtree(session_dir.path, ignore_errors=True)
@@ -0,0 +1,25 @@
+from typing import NamedTuple
+
+import user_agents
+
+from .cache import LRUCache
+
+
+class UserAgentClass(NamedTuple):
+    is_bot: bool
+    # Discord fetches links to show a preview, it needs the mod page's OpenGraph tags instead of the zip
+    is_discord: bool
+
+
+# Parsing a user agent takes hundreds of regular expressions,
+# but most requests come from a few hundred distinct ones
+user_agent_classes: LRUCache[UserAgentClass] = LRUCache('user-agents', 4096)
+
+
+def _classify(user_agent: str) -> UserAgentClass:
+    ua = user_agents.parse(user_agent)
+    return UserAgentClass(ua.is_bot, ua.is_bot and 'discord'.casefold() in ua.browser.family.casefold())
+
+
+def classify_user_agent(user_agent: str) -> UserAgentClass:
+    return user_agent_classes.get_or_set(user_agent, lambda: _classify(user_agent))
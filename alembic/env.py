@@ -1,5 +1,6 @@
 import os
 import sys
+from typing import Any
 
 sys.path.append(os.getcwd())
 from alembic import context
@@ -22,6 +23,11 @@ from KerbalStuff import objects
 target_metadata = Base.metadata
 
 
+def include_object(obj: Any, name: str, type_: str, reflected: bool, compare_to: Any) -> bool:
+    # Don't try to drop objects that we deliberately don't map, see objects.UNMAPPED_DB_OBJECTS
+    return not (reflected and compare_to is None and name in objects.UNMAPPED_DB_OBJECTS)
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -39,7 +45,8 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    context.configure(url=engine.url, target_metadata=target_metadata)
+    context.configure(url=engine.url, target_metadata=target_metadata,
+                      include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -55,7 +62,8 @@ def run_migrations_online() -> None:
     connection = engine.connect()
     context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            include_object=include_object
     )
 
     try:
@@ -0,0 +1,43 @@
+"""Add full text search document to mod
+
+Revision ID: 3c1f5e9a7b20
+Revises: f5a5d29ec765
+Create Date: 2026-10-18 10:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c1f5e9a7b20'
+down_revision = 'f5a5d29ec765'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE mod ADD COLUMN search_vector tsvector")
+    op.execute("""CREATE FUNCTION mod_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.short_description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""")
+    op.execute("""CREATE TRIGGER mod_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, short_description, description ON mod
+    FOR EACH ROW EXECUTE PROCEDURE mod_search_vector_update()""")
+    # Fill it for the existing mods
+    op.execute("""UPDATE mod SET search_vector =
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(short_description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')""")
+    op.execute("CREATE INDEX ix_mod_search_vector ON mod USING GIN (search_vector)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX ix_mod_search_vector")
+    op.execute("DROP TRIGGER mod_search_vector_update ON mod")
+    op.execute("DROP FUNCTION mod_search_vector_update()")
+    op.drop_column('mod', 'search_vector')
@@ -0,0 +1,26 @@
+"""Add indexes for keyset pagination of mods
+
+Revision ID: 8d2e4b6f1a93
+Revises: 3c1f5e9a7b20
+Create Date: 2026-10-18 11:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b6f1a93'
+down_revision = '3c1f5e9a7b20'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    op.create_index('ix_mod_score_id', 'mod', ['score', 'id'], unique=False)
+    op.create_index('ix_mod_created_id', 'mod', ['created', 'id'], unique=False)
+    op.create_index('ix_mod_updated_id', 'mod', ['updated', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_mod_updated_id', table_name='mod')
+    op.drop_index('ix_mod_created_id', table_name='mod')
+    op.drop_index('ix_mod_score_id', table_name='mod')
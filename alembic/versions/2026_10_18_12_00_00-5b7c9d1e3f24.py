@@ -0,0 +1,31 @@
+"""Add changeevent table for the change feed
+
+Revision ID: 5b7c9d1e3f24
+Revises: 8d2e4b6f1a93
+Create Date: 2026-10-18 12:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b7c9d1e3f24'
+down_revision = '8d2e4b6f1a93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    op.create_table('changeevent',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('object_type', sa.String(length=16), nullable=False),
+                    sa.Column('object_id', sa.Integer(), nullable=False),
+                    sa.Column('change_type', sa.String(length=16), nullable=False),
+                    sa.Column('mod_id', sa.Integer(), nullable=True),
+                    sa.Column('created', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_changeevent_mod_id'), 'changeevent', ['mod_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_changeevent_mod_id'), table_name='changeevent')
+    op.drop_table('changeevent')
@@ -0,0 +1,23 @@
+"""Add description_html to mod
+
+Revision ID: 9e1a3c5b7d62
+Revises: 5b7c9d1e3f24
+Create Date: 2026-10-18 13:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e1a3c5b7d62'
+down_revision = '5b7c9d1e3f24'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    # Filled in by the render_mod_descriptions celery task
+    op.add_column('mod', sa.Column('description_html', sa.Unicode(length=200000), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('mod', 'description_html')
@@ -0,0 +1,23 @@
+"""Add pending_scan to modversion
+
+Revision ID: 3c8f1a7e5d49
+Revises: 9e1a3c5b7d62
+Create Date: 2026-10-18 14:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c8f1a7e5d49'
+down_revision = '9e1a3c5b7d62'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    # Everything that's already stored was scanned while it was uploaded
+    op.add_column('modversion', sa.Column('pending_scan', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    op.drop_column('modversion', 'pending_scan')
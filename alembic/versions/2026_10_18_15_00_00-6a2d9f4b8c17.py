@@ -0,0 +1,25 @@
+"""Add download_sha256 to modversion
+
+Revision ID: 6a2d9f4b8c17
+Revises: 3c8f1a7e5d49
+Create Date: 2026-10-18 15:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a2d9f4b8c17'
+down_revision = '3c8f1a7e5d49'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    # Filled in for existing versions by `spacedock admin store_blobs`
+    op.add_column('modversion', sa.Column('download_sha256', sa.String(length=64), nullable=True))
+    op.create_index('ix_modversion_download_sha256', 'modversion', ['download_sha256'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_modversion_download_sha256', 'modversion')
+    op.drop_column('modversion', 'download_sha256')
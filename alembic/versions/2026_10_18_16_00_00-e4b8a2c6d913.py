@@ -0,0 +1,51 @@
+"""Add daily and monthly rollups of download and follow events
+
+Revision ID: e4b8a2c6d913
+Revises: 6a2d9f4b8c17
+Create Date: 2026-10-18 16:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8a2c6d913'
+down_revision = '6a2d9f4b8c17'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    op.create_table('downloadrollup',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('mod_id', sa.Integer(), nullable=False),
+                    sa.Column('version_id', sa.Integer(), nullable=False),
+                    sa.Column('period', sa.String(length=8), nullable=False),
+                    sa.Column('created', sa.DateTime(), nullable=False),
+                    sa.Column('downloads', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['mod_id'], ['mod.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['version_id'], ['modversion.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_downloadrollup_mod_id_period_created', 'downloadrollup',
+                    ['mod_id', 'period', 'created'], unique=False)
+    op.create_index('ix_downloadrollup_period_created', 'downloadrollup', ['period', 'created'], unique=False)
+    op.create_table('followrollup',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('mod_id', sa.Integer(), nullable=False),
+                    sa.Column('period', sa.String(length=8), nullable=False),
+                    sa.Column('created', sa.DateTime(), nullable=False),
+                    sa.Column('delta', sa.Integer(), nullable=False),
+                    sa.Column('events', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['mod_id'], ['mod.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_followrollup_mod_id_period_created', 'followrollup',
+                    ['mod_id', 'period', 'created'], unique=False)
+    op.create_index('ix_followrollup_period_created', 'followrollup', ['period', 'created'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_followrollup_period_created', table_name='followrollup')
+    op.drop_index('ix_followrollup_mod_id_period_created', table_name='followrollup')
+    op.drop_table('followrollup')
+    op.drop_index('ix_downloadrollup_period_created', table_name='downloadrollup')
+    op.drop_index('ix_downloadrollup_mod_id_period_created', table_name='downloadrollup')
+    op.drop_table('downloadrollup')
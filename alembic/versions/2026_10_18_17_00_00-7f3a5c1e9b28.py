@@ -0,0 +1,29 @@
+"""Keep only the top referring hosts of each mod
+
+Revision ID: 7f3a5c1e9b28
+Revises: e4b8a2c6d913
+Create Date: 2026-10-18 17:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7f3a5c1e9b28'
+down_revision = 'e4b8a2c6d913'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    # The default of referral-top-hosts, the referral counter applies the configured one from then on
+    op.execute("""
+        DELETE FROM referralevent
+        WHERE id IN (SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY mod_id ORDER BY events DESC, id) AS rank
+                                     FROM referralevent) AS ranked
+                     WHERE rank > 50)
+    """)
+    op.create_index('ix_referralevent_mod_id_events', 'referralevent', ['mod_id', sa.text('events DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_referralevent_mod_id_events', table_name='referralevent')
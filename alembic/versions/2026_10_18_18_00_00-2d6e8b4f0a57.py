@@ -0,0 +1,21 @@
+"""Index mod versions by mod and friendly_version for downloads
+
+Revision ID: 2d6e8b4f0a57
+Revises: 7f3a5c1e9b28
+Create Date: 2026-10-18 18:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d6e8b4f0a57'
+down_revision = '7f3a5c1e9b28'
+
+from alembic import op
+
+
+def upgrade() -> None:
+    op.create_index('ix_modversion_mod_id_friendly_version', 'modversion', ['mod_id', 'friendly_version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_modversion_mod_id_friendly_version', table_name='modversion')
@@ -0,0 +1,32 @@
+"""Make referral events unique per mod and host
+
+Revision ID: 5c1d7e3a9f60
+Revises: 2d6e8b4f0a57
+Create Date: 2026-10-19 10:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c1d7e3a9f60'
+down_revision = '2d6e8b4f0a57'
+
+from alembic import op
+
+
+def upgrade() -> None:
+    # Merge the rows that concurrent flushes inserted twice into the oldest one
+    op.execute("""
+        UPDATE referralevent SET events = duplicates.events
+        FROM (SELECT min(id) AS id, sum(events) AS events FROM referralevent
+              GROUP BY mod_id, host HAVING count(*) > 1) AS duplicates
+        WHERE referralevent.id = duplicates.id
+    """)
+    op.execute("""
+        DELETE FROM referralevent
+        WHERE id NOT IN (SELECT min(id) FROM referralevent GROUP BY mod_id, host)
+    """)
+    op.create_index('ix_referralevent_mod_id_host', 'referralevent', ['mod_id', 'host'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_referralevent_mod_id_host', table_name='referralevent')
@@ -0,0 +1,37 @@
+"""Make download events unique per version and hour
+
+Revision ID: 9b4e2f7c1a35
+Revises: 5c1d7e3a9f60
+Create Date: 2026-10-19 11:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b4e2f7c1a35'
+down_revision = '5c1d7e3a9f60'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    # Merge the events that concurrent flushes inserted twice into the oldest one
+    op.execute("""
+        UPDATE downloadevent SET downloads = duplicates.downloads
+        FROM (SELECT min(id) AS id, sum(coalesce(downloads, 0)) AS downloads FROM downloadevent
+              GROUP BY version_id, created HAVING count(*) > 1) AS duplicates
+        WHERE downloadevent.id = duplicates.id
+    """)
+    op.execute("""
+        DELETE FROM downloadevent
+        WHERE id NOT IN (SELECT min(id) FROM downloadevent GROUP BY version_id, created)
+    """)
+    op.drop_index('ix_downloadevent_version_id_created', table_name='downloadevent')
+    op.create_index('ix_downloadevent_version_id_created', 'downloadevent',
+                    ['version_id', sa.text('created desc')], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_downloadevent_version_id_created', table_name='downloadevent')
+    op.create_index('ix_downloadevent_version_id_created', 'downloadevent',
+                    ['version_id', sa.text('created desc')], unique=False)
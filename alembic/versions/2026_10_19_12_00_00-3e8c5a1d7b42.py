@@ -0,0 +1,22 @@
+"""Make download rollups unique per version, period and start
+
+Revision ID: 3e8c5a1d7b42
+Revises: 9b4e2f7c1a35
+Create Date: 2026-10-19 12:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e8c5a1d7b42'
+down_revision = '9b4e2f7c1a35'
+
+from alembic import op
+
+
+def upgrade() -> None:
+    op.create_index('ix_downloadrollup_version_id_period_created', 'downloadrollup',
+                    ['version_id', 'period', 'created'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_downloadrollup_version_id_period_created', table_name='downloadrollup')
@@ -0,0 +1,26 @@
+"""Keep uploads that wait for their scan apart from download_path
+
+Revision ID: 8d2f6b0e4c71
+Revises: 3e8c5a1d7b42
+Create Date: 2026-10-19 13:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6b0e4c71'
+down_revision = '3e8c5a1d7b42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade() -> None:
+    op.add_column('modversion', sa.Column('pending_path', sa.String(length=512), nullable=True))
+    op.add_column('modversion', sa.Column('pending_size', sa.BigInteger(), nullable=True))
+    op.add_column('modversion', sa.Column('pending_sha256', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('modversion', 'pending_sha256')
+    op.drop_column('modversion', 'pending_size')
+    op.drop_column('modversion', 'pending_path')
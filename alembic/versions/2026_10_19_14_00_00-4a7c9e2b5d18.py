@@ -0,0 +1,22 @@
+"""Render mod descriptions again with their mentions left for the page
+
+Revision ID: 4a7c9e2b5d18
+Revises: 8d2f6b0e4c71
+Create Date: 2026-10-19 14:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a7c9e2b5d18'
+down_revision = '8d2f6b0e4c71'
+
+from alembic import op
+
+
+def upgrade() -> None:
+    # Stored with the mention links of the time, render_mod_descriptions fills them in again
+    op.execute('UPDATE mod SET description_html = NULL')
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Compares thumbnail.scale_and_crop with plain full-resolution LANCZOS resizing
+on synthetic backgrounds, in time and in how close the results are (PSNR).
+
+    python3 -m benchmarks.thumbnail [--repeat N]
+"""
+import argparse
+import io
+import math
+import random
+import time
+from typing import Callable, Iterable, List, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat
+
+from KerbalStuff.thumbnail import scale_and_crop
+
+SIZE = (320, 195)
+SOURCE_SIZES = [(1280, 720), (1920, 1080), (3840, 2160), (7680, 4320)]
+
+
+def synthetic_image(size: Tuple[int, int], seed: int) -> Image.Image:
+    """Gradients, shapes and noise, something like a screenshot with fine detail"""
+    rnd = random.Random(seed)
+    im = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(im)
+    for _ in range(60):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        r = rnd.randrange(10, max(size) // 8)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    for _ in range(200):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        draw.line((x, y, x + rnd.randrange(-300, 300), y + rnd.randrange(-300, 300)),
+                  fill=(255, 255, 255), width=rnd.randrange(1, 4))
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    return ImageChops.add(im, noise, scale=1.2).filter(ImageFilter.SMOOTH)
+
+
+def encoded(im: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    im.save(buf, fmt, quality=92)
+    return buf.getvalue()
+
+
+def reference(im: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """What thumbnail.create did before: decode everything, one LANCZOS resize, crop"""
+    ratio = min(im.width / size[0], im.height / size[1])
+    im = im.resize((round(im.width / ratio), round(im.height / ratio)), Image.LANCZOS)
+    left, upper = round(0.5 * (im.width - size[0])), round(0.5 * (im.height - size[1]))
+    return im.crop((left, upper, left + size[0], upper + size[1]))
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    rms = ImageStat.Stat(ImageChops.difference(a.convert('RGB'), b.convert('RGB'))).rms
+    mse = sum(r * r for r in rms) / len(rms)
+    return math.inf if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+def timed(func: Callable[[], Image.Image], repeat: int) -> Tuple[float, Image.Image]:
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    assert result is not None
+    return best, result
+
+
+def corpus() -> Iterable[Tuple[str, bytes]]:
+    for i, size in enumerate(SOURCE_SIZES):
+        im = synthetic_image(size, i)
+        for fmt in ('JPEG', 'PNG'):
+            yield f'{size[0]}x{size[1]} {fmt}', encoded(im, fmt)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per image, the fastest counts')
+    args = parser.parse_args()
+
+    rows: List[Tuple[str, float, float, float]] = []
+    for name, data in corpus():
+        ref_time, ref = timed(lambda: reference(Image.open(io.BytesIO(data)), SIZE), args.repeat)
+        new_time, new = timed(lambda: scale_and_crop(Image.open(io.BytesIO(data)), SIZE), args.repeat)
+        rows.append((name, ref_time, new_time, psnr(ref, new)))
+
+    print(f'{"image":<16} {"full decode":>12} {"fast path":>12} {"speedup":>8} {"PSNR":>8}')
+    for name, ref_time, new_time, quality in rows:
+        print(f'{name:<16} {ref_time * 1000:>10.1f}ms {new_time * 1000:>10.1f}ms '
+              f'{ref_time / new_time:>7.1f}x {quality:>6.1f}dB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Compares parsing every download's user agent with user_agent.classify_user_agent,
+over a stream of user agents that repeat the way real traffic does.
+
+    python3 -m benchmarks.user_agents [--corpus FILE] [--requests N]
+
+The corpus has one user agent per line, for example cut out of an access log:
+
+    awk -F'"' '/\\/download/ {print $6}' access.log > user-agents.txt
+
+Without one, a built-in list of common download clients is used, picked with a Zipf distribution.
+"""
+import argparse
+import random
+import time
+from typing import Callable, List
+
+import user_agents
+
+from KerbalStuff.user_agent import UserAgentClass, classify_user_agent, user_agent_classes
+
+BUILTIN_CORPUS = [
+    'CKAN/1.34.4 (+https://github.com/KSP-CKAN/CKAN)',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:131.0) Gecko/20100101 Firefox/131.0',
+    'CKAN/1.34.2 (+https://github.com/KSP-CKAN/CKAN)',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.6 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.10; rv:38.0) Gecko/20100101 Firefox/38.0 (Discordbot/2.0)',
+    'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.6 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'curl/8.9.1',
+    'Wget/1.24.5',
+    'python-requests/2.32.3',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/127.0.0.0 Safari/537.36 OPR/113.0.0.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/126.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:115.0) Gecko/20100101 Firefox/115.0',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:130.0) Gecko/20100101 Firefox/130.0',
+    'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0',
+    'Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)',
+    'Mozilla/5.0 (X11; CrOS x86_64 14541.0.0) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/128.0.0.0 Safari/537.36',
+    'CKAN/1.33.2 (+https://github.com/KSP-CKAN/CKAN)',
+    'Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; rv:11.0) like Gecko',
+]
+
+
+def parse_every_time(user_agent: str) -> UserAgentClass:
+    """What the download route did before"""
+    ua = user_agents.parse(user_agent)
+    return UserAgentClass(ua.is_bot, ua.is_bot and 'discord'.casefold() in ua.browser.family.casefold())
+
+
+def timed(func: Callable[[str], UserAgentClass], stream: List[str]) -> float:
+    start = time.perf_counter()
+    for user_agent in stream:
+        func(user_agent)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='File with one user agent per request')
+    parser.add_argument('--requests', type=int, default=20000, help='Requests to draw from the built-in corpus')
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            stream = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        rnd = random.Random(0)
+        weights = [1 / rank for rank in range(1, len(BUILTIN_CORPUS) + 1)]
+        stream = rnd.choices(BUILTIN_CORPUS, weights, k=args.requests)
+
+    mismatches = sum(parse_every_time(ua) != classify_user_agent(ua) for ua in set(stream))
+    user_agent_classes.invalidate()
+    user_agent_classes.hits = user_agent_classes.misses = 0
+
+    parse_time = timed(parse_every_time, stream)
+    cached_time = timed(classify_user_agent, stream)
+
+    print(f'{len(stream)} requests, {len(set(stream))} distinct user agents, {mismatches} classified differently')
+    print(f'{"parse every time":<18} {parse_time / len(stream) * 1e6:>8.1f}µs per request')
+    print(f'{"LRU classifier":<18} {cached_time / len(stream) * 1e6:>8.1f}µs per request, '
+          f'{(user_agent_classes.hit_rate or 0) * 100:.1f}% hits, {parse_time / cached_time:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,21 @@ from .test_api_errors import *
 from .test_errors import *
 from .test_objects_user import *
 from .test_version import *
+from .test_search import *
+from .test_score_queue import *
+from .test_download_counter import *
+from .test_api_serialize import *
+from .test_api_conditional import *
+from .test_api_changes import *
+from .test_snapshot import *
+from .test_mod_description import *
+from .test_markdown import *
+from .test_kerbdown import *
+from .test_thumbnail import *
+from .test_uploads import *
+from .test_antivirus import *
+from .test_blobs import *
+from .test_rollups import *
+from .test_referral_counter import *
+from .test_user_agent import *
+from .test_download import *
@@ -6,6 +6,8 @@ from flask import Response
 from .fake_config import dummy
 from KerbalStuff.database import create_database, create_tables, drop_database, drop_tables
 from KerbalStuff.app import app
+from KerbalStuff.background import flush_all
+from KerbalStuff.cache import all_caches
 
 # FlaskClient requires a type parameter in mypy, but errors out with one at runtime
 @pytest.fixture
@@ -15,4 +17,9 @@ def client() -> Generator['FlaskClient[Response]', None, None]:
     create_tables()
     with app.test_client() as client:
         yield client
+    # Write what the background flushers queued up while the tables still exist, not when pytest exits
+    flush_all()
     drop_tables()
+    # Don't leak cached rows or counts into the next test's database
+    for cache in all_caches():
+        cache.invalidate()
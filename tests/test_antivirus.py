@@ -0,0 +1,112 @@
+import socketserver
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Generator, List
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff import antivirus, celery
+from KerbalStuff.app import app
+from KerbalStuff.blobs import blob_path
+from KerbalStuff.config import config, env
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion, ChangeEvent
+from KerbalStuff.database import db
+
+
+class FakeClamdHandler(socketserver.StreamRequestHandler):
+    """Answers SCAN commands like clamd, finding malware in files that contain EICAR"""
+
+    def handle(self) -> None:
+        command = self.rfile.readline().decode().strip()
+        if not command:
+            # pyclamd connects once without a command to check that clamd is there
+            return
+        path = command[len('nSCAN '):]
+        found = b'EICAR' in Path(path).read_bytes()
+        self.wfile.write(f'{path}: {"Eicar-Test-Signature FOUND" if found else "OK"}\n'.encode())
+
+
+@pytest.fixture
+def fake_clamd(monkeypatch: pytest.MonkeyPatch) -> Generator[None, None, None]:
+    server = socketserver.TCPServer(('127.0.0.1', 0), FakeClamdHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(config[env], 'clamav-host', '127.0.0.1')
+    monkeypatch.setitem(config[env], 'clamav-port', str(server.server_address[1]))
+    monkeypatch.setattr(antivirus, 'clam_daemon', None)
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.usefixtures("client", "fake_clamd")
+def test_scan_mod_version(client: 'FlaskClient[Response]', tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    # The mod routes keep the game in the session
+    monkeypatch.setattr(app, 'secret_key', 'test')
+    mails: List[str] = []
+    monkeypatch.setattr(celery.send_mail, 'delay', lambda sender, recipients, subject, *args, **kwargs: mails.append(subject))
+    (tmp_path / 'pending').mkdir()
+    for name, content in (('first.zip', b'PK first'), ('pending/clean.zip', b'PK clean'),
+                          ('pending/infected.zip', b'PK EICAR'), ('pending/replacement.zip', b'PK replacement')):
+        (tmp_path / name).write_bytes(content)
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info')
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    mod = Mod(name='Test Mod', short_description='A mod for testing', description='A mod for testing',
+              user=user, license='MIT',
+              game=game, published=True,
+              default_version=ModVersion(friendly_version='1.0', gameversion=game_version,
+                                         download_path='first.zip', created=datetime.now()))
+    mod.default_version.mod = mod
+    for friendly_version in ('clean', 'infected'):
+        db.add(ModVersion(friendly_version=friendly_version, gameversion=game_version, mod=mod,
+                          download_path=f'{friendly_version}.zip', pending_scan=True,
+                          pending_path=f'pending/{friendly_version}.zip', pending_sha256=friendly_version * 8))
+    # A new file for the first version
+    mod.default_version.pending_path = 'pending/replacement.zip'
+    mod.default_version.pending_sha256 = 'replacement' * 4
+    db.add(mod)
+    db.commit()
+    first_id = mod.default_version.id
+    clean_id, infected_id = (ModVersion.query.filter(ModVersion.friendly_version == friendly_version).one().id
+                             for friendly_version in ('clean', 'infected'))
+    pending_download_resp = client.get('/mod/1/Test%20Mod/download/clean')
+    pending_api_resp = client.get('/api/mod/1')
+    pending_etag = pending_api_resp.headers['ETag']
+    pending_on_disk = (tmp_path / 'clean.zip').exists()
+    # The same file, stored for a version that's gone since
+    infected_blob = tmp_path / blob_path('infected' * 8)
+    infected_blob.parent.mkdir(parents=True)
+    infected_blob.write_bytes(b'PK EICAR')
+
+    # Act
+    celery.scan_mod_version(clean_id, 1)
+    released_api_resp = client.get('/api/mod/1', headers={'If-None-Match': pending_etag})
+    celery.scan_mod_version(infected_id, 1, update=True)
+    celery.scan_mod_version(first_id, 1)
+
+    # Assert
+    mod = Mod.query.get(1)
+    assert pending_download_resp.status_code == 404, 'Versions should not be downloadable before their scan'
+    assert [v['friendly_version'] for v in pending_api_resp.json['versions']] == ['1.0'], \
+        'Versions should not be listed before their scan'
+    assert not pending_on_disk, 'Uploads should not be at their download path before their scan'
+    assert released_api_resp.status_code == 200, 'Releasing a version should change the ETag of the mod'
+    assert not ModVersion.query.get(clean_id).pending_scan, 'Clean version should be downloadable'
+    assert (tmp_path / 'clean.zip').read_bytes() == b'PK clean', 'Clean upload should be linked to its download path'
+    assert ModVersion.query.get(infected_id) is None, 'Infected version should be removed'
+    assert not (tmp_path / 'pending' / 'infected.zip').exists() and not (tmp_path / 'infected.zip').exists(), \
+        'Infected file should be removed'
+    assert not infected_blob.exists(), 'Unreferenced blob of the infected file should be removed right away'
+    assert (tmp_path / 'first.zip').read_bytes() == b'PK replacement', \
+        'Replaced file should be downloadable once it scanned clean'
+    assert [(c.object_id, c.change_type) for c in ChangeEvent.query.filter(ChangeEvent.object_type == 'version')] \
+        == [(clean_id, 'created'), (first_id, 'updated')], 'Released versions should be in the change feed'
+    assert mod.locked and not mod.published, 'Mods of the uploader of malware should be locked'
+    assert mails, 'Uploader of malware should be notified'
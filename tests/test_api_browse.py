@@ -1,11 +1,14 @@
 from datetime import datetime
+from typing import Dict
 
 import pytest
 from flask.testing import FlaskClient
 from flask import Response
 from http import HTTPStatus
+from requests.utils import parse_header_links
 
 from .fixtures.client import client
+from KerbalStuff.common import encode_cursor
 from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
 from KerbalStuff.database import db
 
@@ -32,3 +35,63 @@ def test_api_browse(client: 'FlaskClient[Response]') -> None:
 
     assert featured_resp.status_code == HTTPStatus.OK, 'Request should succeed'
     assert featured_resp.data == b'[]', 'Should return empty list'
+
+
+@pytest.mark.usefixtures("client")
+def test_api_browse_cursors(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info', public=True)
+    db.add(game)
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    for i in range(5):
+        mod = Mod(name=f'Mod {i}', user=user, game=game, license='MIT', published=True,
+                  created=datetime(2024, 1, 1 + i), updated=datetime(2024, 1, 1 + i),
+                  default_version=ModVersion(friendly_version='1.0', gameversion=game_version,
+                                             download_path='/tmp/blah.zip', created=datetime(2024, 1, 1 + i)))
+        mod.default_version.mod = mod
+        db.add(mod)
+    db.commit()
+
+    # Act
+    first_resp = client.get('/api/browse?count=2&orderby=created&order=desc')
+    second_resp = client.get(links(first_resp)['next'])
+    third_resp = client.get(links(second_resp)['next'])
+    back_resp = client.get(links(second_resp)['prev'])
+    page_resp = client.get('/api/browse?count=2&orderby=created&order=desc&page=2')
+
+    # Assert
+    assert [m['name'] for m in first_resp.json['result']] == ['Mod 4', 'Mod 3'], 'First page should be the newest mods'
+    assert 'prev' not in links(first_resp), 'First page should not link backwards'
+    assert [m['name'] for m in second_resp.json['result']] == ['Mod 2', 'Mod 1'], 'Next cursor should continue the list'
+    assert second_resp.json['page'] == 2, 'Cursor should remember the page number'
+    assert [m['name'] for m in third_resp.json['result']] == ['Mod 0'], 'Last page should have the rest'
+    assert 'next' not in links(third_resp), 'Last page should not link forwards'
+    assert back_resp.json == first_resp.json, 'Prev cursor should return the first page again'
+    assert page_resp.json == second_resp.json, 'Page numbers should still work'
+    assert first_resp.json['total'] == 5 and first_resp.json['pages'] == 3, 'Total should count all mods'
+
+
+@pytest.mark.usefixtures("client")
+def test_api_browse_bad_cursors(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    cursors = {
+        'mangled': 'not a cursor',
+        'too few keys': encode_cursor(1, [datetime(2024, 1, 3)]),
+        'wrong key type': encode_cursor(1, ['2024-01-03', 3]),
+        'wrong id type': encode_cursor(1, [datetime(2024, 1, 3), [3]]),
+    }
+
+    # Act
+    good_resp = client.get('/api/browse/new?after=' + encode_cursor(1, [datetime(2024, 1, 3), 3]))
+    bad_resps = {name: client.get('/api/browse/new?after=' + cursor) for name, cursor in cursors.items()}
+
+    # Assert
+    assert good_resp.status_code == HTTPStatus.OK, 'Cursors that fit the sort keys should be accepted'
+    for name, resp in bad_resps.items():
+        assert resp.status_code == HTTPStatus.BAD_REQUEST, f'Cursor with {name} should be refused'
+
+
+def links(resp: Response) -> Dict[str, str]:
+    return {link['rel']: link['url'] for link in parse_header_links(resp.headers.get('Link', ''))}
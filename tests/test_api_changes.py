@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from http import HTTPStatus
+
+from .fixtures.client import client
+from KerbalStuff.changes import record_game_change, record_mod_change, record_version_change
+from KerbalStuff.config import config, env
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion, ChangeEvent
+from KerbalStuff.database import db
+
+
+@pytest.mark.usefixtures("client")
+def test_api_changes(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    # Changes are only in the feed once they're settled
+    monkeypatch.setitem(config[env], 'change-feed-lag', '0')
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info')
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    published, unpublished = [Mod(name=name, short_description='A mod for testing', description='A mod',
+                                  user=user, license='MIT', game=game, published=is_published,
+                                  default_version=ModVersion(friendly_version='1.0.0.0', gameversion=game_version,
+                                                             download_path='/tmp/blah.zip', created=datetime.now()))
+                              for name, is_published in (('Published Mod', True), ('Hidden Mod', False))]
+    for mod in (published, unpublished):
+        mod.default_version.mod = mod
+        db.add(mod)
+    db.commit()
+    record_game_change(game.id, 'created')
+    record_mod_change(published, 'published')
+    record_version_change(published.default_version, 'created')
+    record_mod_change(unpublished, 'created')
+    record_mod_change(unpublished, 'locked')
+    db.commit()
+    published_id = published.id
+
+    # Act
+    all_resp = client.get('/api/changes')
+    first_resp = client.get('/api/changes?count=2')
+    rest_resp = client.get(f'/api/changes?since={first_resp.json["next"]}')
+    caught_up_resp = client.get(f'/api/changes?since={rest_resp.json["next"]}')
+    bad_resp = client.get('/api/changes?since=yesterday')
+
+    # Assert
+    assert all_resp.status_code == HTTPStatus.OK, 'Request should succeed'
+    assert [(c['type'], c['change']) for c in all_resp.json['changes']] == [
+        ('game', 'created'), ('mod', 'published'), ('version', 'created'), ('mod', 'locked')
+    ], 'Changes of unpublished mods should be hidden unless they take the mod away'
+    assert all_resp.json['changes'][2]['mod_id'] == published_id, 'Version changes should have the mod id'
+    assert len(first_resp.json['changes']) == 2, 'Count should limit the changes'
+    assert first_resp.json['more'], 'Limited response should say there are more changes'
+    assert [c['change'] for c in rest_resp.json['changes']] == ['created', 'locked'], 'Cursor should continue after the first page'
+    assert not rest_resp.json['more'], 'Last page should say there are no more changes'
+    assert caught_up_resp.json['changes'] == [], 'No changes should be left after the last one'
+    assert caught_up_resp.json['next'] == rest_resp.json['next'], 'Cursor should stay put without new changes'
+    assert bad_resp.status_code == HTTPStatus.BAD_REQUEST, 'Mangled cursors should be rejected'
+
+
+@pytest.mark.usefixtures("client")
+def test_api_changes_committed_out_of_order(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'change-feed-lag', '60')
+    now = datetime.now()
+    db.add(ChangeEvent(id=1, object_type='game', object_id=1, change_type='created', created=now - timedelta(minutes=5)))
+    # The transaction that took id 2 is still running while the one with id 3 commits
+    db.add(ChangeEvent(id=3, object_type='game', object_id=3, change_type='created', created=now - timedelta(seconds=2)))
+    db.commit()
+    early_resp = client.get('/api/changes')
+    db.add(ChangeEvent(id=2, object_type='game', object_id=2, change_type='created', created=now - timedelta(seconds=5)))
+    db.commit()
+
+    # Act
+    monkeypatch.setitem(config[env], 'change-feed-lag', '0')
+    later_resp = client.get(f'/api/changes?since={early_resp.json["next"]}')
+
+    # Assert
+    assert [c['cursor'] for c in early_resp.json['changes']] == [1], 'Changes should not be served before they settle'
+    assert [c['cursor'] for c in later_resp.json['changes']] == [2, 3], \
+        'Change committed after a greater id should not be skipped'
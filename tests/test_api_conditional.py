@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from http import HTTPStatus
+
+from .fixtures.client import client
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+from KerbalStuff.database import db
+
+
+@pytest.mark.usefixtures("client")
+def test_api_conditional(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', short_description='A mod for testing', description='Original description',
+              user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, published=True,
+              default_version=ModVersion(friendly_version='1.0.0.0',
+                                         gameversion=GameVersion(friendly_version='1.2.3', game=game),
+                                         download_path='/tmp/blah.zip', created=datetime.now()))
+    mod.default_version.mod = mod
+    db.add(mod)
+    db.commit()
+
+    # Act
+    first_resp = client.get('/api/mod/1')
+    etag = first_resp.headers['ETag']
+    cached_resp = client.get('/api/mod/1', headers={'If-None-Match': etag})
+    Mod.query.get(1).description = 'Edited description'
+    db.commit()
+    edited_resp = client.get('/api/mod/1', headers={'If-None-Match': etag})
+    versions_resp = client.get('/api/1/versions')
+    cached_versions_resp = client.get('/api/1/versions', headers={'If-None-Match': versions_resp.headers['ETag']})
+    db.add(GameVersion(friendly_version='1.2.4', game=game))
+    db.commit()
+    new_versions_resp = client.get('/api/1/versions', headers={'If-None-Match': versions_resp.headers['ETag']})
+    missing_resp = client.get('/api/mod/2', headers={'If-None-Match': etag})
+
+    # Assert
+    assert first_resp.status_code == HTTPStatus.OK, 'Request should succeed'
+    assert first_resp.headers['Cache-Control'] == 'no-cache', 'Clients should revalidate'
+    assert cached_resp.status_code == HTTPStatus.NOT_MODIFIED, 'Unchanged mod should not be sent again'
+    assert cached_resp.data == b'', 'Not modified response should be empty'
+    assert edited_resp.status_code == HTTPStatus.OK, 'Edited mod should be sent again'
+    assert edited_resp.json['description'] == 'Edited description', 'Edited mod should be up to date'
+    assert cached_versions_resp.status_code == HTTPStatus.NOT_MODIFIED, 'Unchanged versions should not be sent again'
+    assert new_versions_resp.status_code == HTTPStatus.OK, 'New game version should be sent'
+    assert len(new_versions_resp.json) == 2, 'New game version should be included'
+    assert missing_resp.status_code == HTTPStatus.NOT_FOUND, 'Missing mods should not be cached'
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from sqlalchemy import event
+
+from .fixtures.client import client
+from KerbalStuff.app import app
+from KerbalStuff.blueprints.api import serialize_mod_list, mod_info, version_info
+from KerbalStuff.common import json_response, json_stream_response
+from KerbalStuff.database import db, engine
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+
+
+@pytest.mark.usefixtures("client")
+def test_serialize_mod_list(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    game_versions = [GameVersion(friendly_version=v, game=game) for v in ['1.11.2', '1.12.5']]
+    names = ['Test Mod', 'Ünïcødé / Slash', 'Odd #?% {name}', "Quote's & Friends"]
+    for i, name in enumerate(names):
+        author = User(username=f'Author{i}', email=f'author{i}@spacedock.info')
+        mod = Mod(name=name, user=author, game=game, license='MIT', published=True,
+                  short_description=f'Mod number {i}', background=f'background{i}.png' if i % 2 else '',
+                  bgOffsetY=i, source_link='https://github.com/' if i % 2 else None)
+        for j in range(i + 1):
+            mod.versions.append(ModVersion(friendly_version=f'{j}.0 beta#{j}', gameversion=game_versions[j % 2],
+                                           download_path='/tmp/blah.zip', created=datetime(2024, 1, 1 + j),
+                                           changelog=f'Changes {j}', sort_index=j, download_count=j))
+        mod.default_version = mod.versions[-1]
+        db.add(mod)
+    db.commit()
+    mods = Mod.query.order_by(Mod.id).all()
+    statements = []
+
+    def count_statement(*args: object) -> None:
+        statements.append(args)
+
+    # Act
+    with app.test_request_context('/api/browse'):
+        expected = json_response([{**mod_info(m), 'versions': [version_info(m, v) for v in m.versions]}
+                                  for m in mods]).data
+        db.expire_all()
+        mods = Mod.query.order_by(Mod.id).all()
+        event.listen(engine, 'before_cursor_execute', count_statement)
+        try:
+            actual = json_response(serialize_mod_list(mods)).data
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_statement)
+
+    # Assert
+    assert actual == expected, 'Bulk serialization should match mod_info and version_info'
+    assert len(statements) == 3, 'Games, users and versions should be loaded with one query each'
+
+
+def test_json_stream_response() -> None:
+    # Arrange
+    items = [{'name': 'Test Mod', 'created': datetime(2024, 1, 1)}, {'name': 'Ünïcødé', 'versions': []}]
+    envelope = {'total': 2, 'page': 1}
+
+    # Act
+    with app.test_request_context('/api/browse'):
+        streamed_list = json_stream_response(iter(items)).get_data()
+        streamed_envelope = json_stream_response(iter(items), envelope, 'result').get_data()
+        streamed_empty = json_stream_response(iter([]), {}, 'result').get_data()
+        expected_list = json_response(items).get_data()
+        expected_envelope = json_response({**envelope, 'result': items}).get_data()
+        expected_empty = json_response({'result': []}).get_data()
+
+    # Assert
+    assert streamed_list == expected_list, 'Streamed list should match json_response'
+    assert streamed_envelope == expected_envelope, 'Streamed envelope should match json_response'
+    assert streamed_empty == expected_empty, 'Empty envelope should still be valid JSON'
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff import blobs
+from KerbalStuff.blobs import blob_path, link_existing, release_blobs, store_blob
+from KerbalStuff.objects import ModVersion
+from KerbalStuff.database import db
+
+
+@pytest.mark.usefixtures("client")
+def test_blobs(client: 'FlaskClient[Response]', tmp_path: Path) -> None:
+    # Arrange
+    content = b'PK identical zip'
+    sha256 = hashlib.sha256(content).hexdigest()
+    for name in ('upload1', 'upload2', 'old.zip'):
+        (tmp_path / name).write_bytes(content)
+    blob = tmp_path / blob_path(sha256)
+    db.add(ModVersion(friendly_version='1.0', download_path='first.zip', download_sha256=sha256))
+    db.commit()
+
+    # Act
+    store_blob(str(tmp_path), str(tmp_path / 'upload1'), sha256, str(tmp_path / 'first.zip'))
+    store_blob(str(tmp_path), str(tmp_path / 'upload2'), sha256, str(tmp_path / 'second.zip'))
+    old_was_duplicate = link_existing(str(tmp_path), str(tmp_path / 'old.zip'), sha256)
+    release_blobs(str(tmp_path), [sha256])
+    kept = blob.exists()
+    ModVersion.query.delete()
+    db.commit()
+    release_blobs(str(tmp_path), [sha256])
+    kept_while_recent = blob.exists()
+    two_hours_ago = time.time() - 7200
+    os.utime(blob, (two_hours_ago, two_hours_ago))
+    release_blobs(str(tmp_path), [sha256])
+
+    # Assert
+    assert (tmp_path / 'first.zip').read_bytes() == content, 'Link should have the uploaded content'
+    assert os.path.samefile(tmp_path / 'first.zip', tmp_path / 'second.zip'), 'Identical uploads should be stored once'
+    assert old_was_duplicate and os.path.samefile(tmp_path / 'old.zip', tmp_path / 'first.zip'), \
+        'Existing duplicates should be linked to the blob'
+    assert not (tmp_path / 'upload1').exists() and not (tmp_path / 'upload2').exists(), 'Uploads should be moved away'
+    assert kept, 'Referenced blob should be kept'
+    assert kept_while_recent, 'Unreferenced blob should be kept while an upload may be about to reference it'
+    assert not blob.exists(), 'Unreferenced blob should be removed'
+
+
+def test_store_blob_released_meanwhile(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    content = b'PK identical zip'
+    sha256 = hashlib.sha256(content).hexdigest()
+    blob = tmp_path / blob_path(sha256)
+    blob.parent.mkdir(parents=True)
+    blob.write_bytes(content)
+    (tmp_path / 'upload').write_bytes(content)
+    link = blobs._link
+
+    def release_then_link(source: str, target: str) -> None:
+        # Another process releases the blob right after store_blob found it
+        os.remove(source)
+        monkeypatch.setattr(blobs, '_link', link)
+        link(source, target)
+
+    monkeypatch.setattr(blobs, '_link', release_then_link)
+
+    # Act
+    store_blob(str(tmp_path), str(tmp_path / 'upload'), sha256, str(tmp_path / 'mod.zip'))
+
+    # Assert
+    assert blob.read_bytes() == content, 'Upload should become the blob if the stored one was released'
+    assert os.path.samefile(tmp_path / 'mod.zip', blob), 'Link should point to the new blob'
+    assert not (tmp_path / 'upload').exists(), 'Upload should be moved away'
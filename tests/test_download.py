@@ -0,0 +1,58 @@
+from typing import List, Tuple
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff.blueprints import mods
+from KerbalStuff.config import config, env
+from KerbalStuff.database import db
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+
+
+@pytest.mark.usefixtures("client")
+def test_download(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'protocol', 'https')
+    monkeypatch.setitem(config[env], 'cdn-domain', 'cdn.spacedock.info')
+    counted: List[Tuple[int, int]] = []
+    monkeypatch.setattr(mods.download_counter, 'count', lambda mod_id, version_id: counted.append((mod_id, version_id)))
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info')
+    mod = Mod(name='Test Mod', user=user, game=game, license='MIT', published=True)
+    old_version = ModVersion(friendly_version='1.0', gameversion=game_version, mod=mod,
+                             download_path='TestModAuthor/Test_Mod/Test_Mod-1.0.zip', sort_index=0)
+    mod.default_version = ModVersion(friendly_version='1.1', gameversion=game_version, mod=mod,
+                                     download_path='TestModAuthor/Test_Mod/Test_Mod-1.1.zip', sort_index=1)
+    unpublished = Mod(name='Secret Mod', user=user, game=game, license='MIT', published=False)
+    unpublished.default_version = ModVersion(friendly_version='1.0', gameversion=game_version, mod=unpublished,
+                                             download_path='TestModAuthor/Secret_Mod/Secret_Mod-1.0.zip')
+    db.add_all([mod, unpublished])
+    db.commit()
+    # Requests close the session
+    mod_id, unpublished_id = mod.id, unpublished.id
+    default_version_id, old_version_id = mod.default_version_id, old_version.id
+
+    # Act
+    default_resp = client.get(f'/mod/{mod_id}/Test%20Mod/download')
+    version_resp = client.get(f'/mod/{mod_id}/download/1.0')
+    discord_resp = client.get(f'/mod/{mod_id}/download/1.0',
+                              headers={'User-Agent': 'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)'})
+    missing_resp = client.get(f'/mod/{mod_id}/download/2.0')
+    unpublished_resp = client.get(f'/mod/{unpublished_id}/download')
+
+    # Assert
+    assert default_resp.status_code == 302, 'Download should redirect'
+    assert default_resp.location == 'https://cdn.spacedock.info/TestModAuthor/Test_Mod/Test_Mod-1.1.zip', \
+        'Download without version should redirect to the default version on the CDN'
+    assert 'Set-Cookie' not in default_resp.headers, 'Download should not write to the session'
+    assert version_resp.location == 'https://cdn.spacedock.info/TestModAuthor/Test_Mod/Test_Mod-1.0.zip', \
+        'Download with version should redirect to that version'
+    assert discord_resp.location.endswith(f'/mod/{mod_id}/Test%20Mod'), 'Discord should get the mod page'
+    assert counted == [(mod_id, default_version_id), (mod_id, old_version_id)], \
+        'Downloads should be counted, but not bots'
+    assert missing_resp.status_code == 404, 'Unknown version should not be found'
+    assert unpublished_resp.status_code == 403, 'Unpublished mod should not be downloadable'
@@ -0,0 +1,87 @@
+from datetime import datetime
+from typing import Dict
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff.database import db
+from KerbalStuff import download_counter
+from KerbalStuff.download_counter import DownloadCounter, DownloadKey, MemoryCounterBackend
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion, DownloadEvent
+
+
+@pytest.mark.usefixtures("client")
+def test_download_counter(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              game=game, license='MIT', published=True, download_count=10)
+    old_version = ModVersion(friendly_version='1.0', gameversion=game_version, mod=mod,
+                             download_path='/tmp/blah.zip', download_count=10)
+    new_version = ModVersion(friendly_version='1.1', gameversion=game_version, mod=mod,
+                             download_path='/tmp/blah.zip')
+    mod.default_version = new_version
+    db.add(mod)
+    db.commit()
+    counter = DownloadCounter(MemoryCounterBackend(), 60, False)
+
+    # Act
+    for _ in range(3):
+        counter.count(mod.id, new_version.id)
+    counter.count(mod.id, old_version.id)
+    first_flush = counter.flush()
+    counter.count(mod.id, new_version.id)
+    second_flush = counter.flush()
+    empty_flush = counter.flush()
+    db.expire_all()
+
+    # Assert
+    assert (first_flush, second_flush, empty_flush) == (4, 1, 0), 'Flush should return the number of downloads'
+    assert mod.download_count == 15, 'Mod download count should be increased'
+    assert old_version.download_count == 11, 'Old version download count should be increased'
+    assert new_version.download_count == 4, 'New version download count should be increased'
+    events = {e.version_id: e for e in DownloadEvent.query.all()}
+    assert len(events) == 2, 'There should be one event per version and hour'
+    assert events[new_version.id].downloads == 4, 'Flushes in the same hour should add to the same event'
+    assert events[new_version.id].created == datetime.now().replace(minute=0, second=0, microsecond=0), \
+        'Events should start at the hour'
+
+
+@pytest.mark.usefixtures("client")
+def test_download_counter_failed_flush(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              game=game, license='MIT', published=True)
+    version = ModVersion(friendly_version='1.0', gameversion=GameVersion(friendly_version='1.2.3', game=game),
+                         mod=mod, download_path='/tmp/blah.zip')
+    mod.default_version = version
+    db.add(mod)
+    db.flush()
+    hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+    # Written by another process's flush
+    db.add(DownloadEvent(mod_id=mod.id, version_id=version.id, downloads=5, created=hour))
+    db.commit()
+    counter = DownloadCounter(MemoryCounterBackend(), 60, False)
+    counter.count(mod.id, version.id)
+    counter.count(mod.id, version.id)
+
+    def fail(counts: Dict[DownloadKey, int]) -> None:
+        raise RuntimeError('Database is gone')
+
+    # Act
+    with monkeypatch.context() as m:
+        m.setattr(download_counter, 'write_download_counts', fail)
+        with pytest.raises(RuntimeError):
+            counter.flush()
+    retried_flush = counter.flush()
+
+    # Assert
+    assert retried_flush == 2, 'Downloads of a failed flush should be written by the next one'
+    events = DownloadEvent.query.all()
+    assert [e.downloads for e in events] == [7], 'Flushes should add to the event of the hour written by others'
@@ -0,0 +1,51 @@
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from sqlalchemy import event
+
+from .fixtures.client import client
+from KerbalStuff.app import app
+from KerbalStuff.common import convert_markdown
+from KerbalStuff.database import db, engine
+from KerbalStuff.objects import Publisher, Game, User, Mod, SharedAuthor
+
+
+@pytest.mark.usefixtures("client")
+def test_kerbdown_mentions(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    author = User(username='Modder', email='modder@spacedock.info', public=True)
+    helper = User(username='Helper_1', email='helper@spacedock.info', public=True)
+    private = User(username='Private', email='private@spacedock.info', public=False)
+    mods = [Mod(name=f'Mod {i}', user=author, license='MIT', game=game, published=i < 2)
+            for i in range(3)]
+    db.add_all(mods)
+    db.add(SharedAuthor(user=helper, mod=mods[0], accepted=True))
+    db.add(SharedAuthor(user=author, mod=mods[1], accepted=True))
+    db.add(private)
+    db.commit()
+    statements = []
+
+    def count_statement(*args: object) -> None:
+        statements.append(args)
+
+    # Act
+    with app.test_request_context():
+        event.listen(engine, 'before_cursor_execute', count_statement)
+        try:
+            html = convert_markdown('Thanks @modder, @Helper_1, @Private, @nobody and @MODDER')
+            first_statements = len(statements)
+            cached_html = convert_markdown('Thanks again @Modder, @helper_1 and @Nobody')
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_statement)
+
+    # Assert
+    assert first_statements == 2, 'Mentioned users and their mod counts should be loaded with one query each'
+    assert len(statements) == first_statements, 'Mentioned and unknown users should be cached'
+    assert html.count('href="/profile/Modder"') == 2, 'Mentions should be case insensitive'
+    assert 'title="Modder\'s profile\n3 mods' in html, 'Owned and shared published mods should be counted'
+    assert 'title="Helper_1\'s profile\n1 mods' in html, 'Shared mods should be counted for shared authors'
+    assert '@Private' in html and '/profile/Private' not in html, 'Private users should not be linked'
+    assert '@nobody' in html, 'Unknown users should stay text'
+    assert 'href="/profile/Helper_1"' in cached_html, 'Cached users should be linked'
@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .fixtures.fake_config import dummy
+from KerbalStuff.common import render_markdown, markdown_cache
+
+
+def test_render_markdown_threads() -> None:
+    # Arrange
+    markdown_cache.invalidate()
+    texts = [f'# Mod {i}\n\nSome *text* [^{i}]\n\n```\ncode {i}\n```' for i in range(50)]
+    expected = [render_markdown(text) for text in texts]
+    markdown_cache.invalidate()
+
+    # Act
+    with ThreadPoolExecutor(8) as executor:
+        rendered = list(executor.map(render_markdown, texts * 4))
+    hits_before = markdown_cache.hits
+    cached = render_markdown(texts[0])
+
+    # Assert
+    assert rendered == expected * 4, 'Rendering in several threads should give the same HTML as one thread'
+    assert cached == expected[0], 'Cached HTML should be the same'
+    assert markdown_cache.hits == hits_before + 1, 'Rendering the same text again should hit the cache'
+    assert render_markdown('') is None, 'Empty text should not be rendered'
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from http import HTTPStatus
+
+from .fixtures.client import client
+from KerbalStuff.celery import render_mod_descriptions
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+from KerbalStuff.database import db
+from KerbalStuff.kerbdown import mention_cache
+
+
+@pytest.mark.usefixtures("client")
+def test_mod_description_html(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info')
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    for name in ('First Mod', 'Second Mod'):
+        mod = Mod(name=name, short_description='A mod for testing',
+                  description='**Bold** <script>alert("hi")</script>',
+                  user=user, license='MIT', game=game, published=True,
+                  default_version=ModVersion(friendly_version='1.0.0.0', gameversion=game_version,
+                                             download_path='/tmp/blah.zip', created=datetime.now()))
+        mod.default_version.mod = mod
+        db.add(mod)
+    db.commit()
+
+    # Act
+    api_resp = client.get('/api/mod/1')
+    stored_by_api = Mod.query.get(1).description_html
+    render_mod_descriptions()
+    stored_by_task = Mod.query.get(2).description_html
+
+    # Assert
+    assert api_resp.status_code == HTTPStatus.OK, 'Request should succeed'
+    assert '<strong>Bold</strong>' in api_resp.json['description_html'], 'Description should be rendered'
+    assert '<script>' not in api_resp.json['description_html'], 'Description should be sanitized'
+    assert stored_by_api == api_resp.json['description_html'], 'Rendered description should be stored'
+    assert stored_by_task == stored_by_api, 'Task should render the descriptions that are missing'
+
+
+@pytest.mark.usefixtures("client")
+def test_mod_description_mentions(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info', public=True)
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    mod = Mod(name='Mentioning Mod', short_description='A mod for testing',
+              description='Thanks @Helper', user=user, license='MIT', game=game, published=True,
+              default_version=ModVersion(friendly_version='1.0.0.0', gameversion=game_version,
+                                         download_path='/tmp/blah.zip', created=datetime.now()))
+    mod.default_version.mod = mod
+    db.add(mod)
+    db.commit()
+    mod_id = mod.id
+
+    # Act
+    before_resp = client.get(f'/api/mod/{mod_id}')
+    stored = Mod.query.get(mod_id).description_html
+    db.add(User(username='Helper', email='helper@spacedock.info', public=True))
+    db.commit()
+    # As if the cached lookup had expired
+    mention_cache.invalidate('helper')
+    after_resp = client.get(f'/api/mod/{mod_id}')
+
+    # Assert
+    assert '/profile/Helper' not in before_resp.json['description_html'], 'Unknown users should not be linked'
+    assert '/profile/' not in stored, 'Stored HTML should not depend on the mentioned users'
+    assert 'href="/profile/Helper"' in after_resp.json['description_html'], \
+        'Users created after the description was stored should be linked'
@@ -0,0 +1,54 @@
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff.common import get_referral_events
+from KerbalStuff.database import db
+from KerbalStuff.objects import Publisher, Game, User, Mod, ReferralEvent
+from KerbalStuff.referral_counter import ReferralCounter, SpaceSaving
+
+
+def test_space_saving() -> None:
+    # Arrange
+    sketch = SpaceSaving(2)
+
+    # Act
+    for host in ('forum.kerbalspaceprogram.com', 'forum.kerbalspaceprogram.com', 'forum.kerbalspaceprogram.com',
+                 'reddit.com', 'spam1.example', 'spam2.example', 'forum.kerbalspaceprogram.com'):
+        sketch.add(host)
+
+    # Assert
+    assert len(sketch.counts) == 2, 'Sketch should not grow beyond its capacity'
+    assert sketch.counts['spam2.example'] == 3, 'New host should take over the smallest count'
+    assert sketch.guaranteed_counts() == {'forum.kerbalspaceprogram.com': 4, 'spam2.example': 1}, \
+        'Counts taken over from other hosts should not be reported'
+
+
+@pytest.mark.usefixtures("client")
+def test_referral_counter(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              game=game, license='MIT', published=True)
+    db.add(mod)
+    db.flush()
+    db.add(ReferralEvent(mod_id=mod.id, host='reddit.com', events=5))
+    db.add(ReferralEvent(mod_id=mod.id, host='old.example', events=1))
+    db.commit()
+    counter = ReferralCounter(2, 60, False)
+
+    # Act
+    for host in ('forum.kerbalspaceprogram.com', 'forum.kerbalspaceprogram.com', 'reddit.com'):
+        counter.count(mod.id, host)
+    counter.count(mod.id + 1, 'reddit.com')
+    flushed = counter.flush()
+    empty_flush = counter.flush()
+
+    # Assert
+    assert (flushed, empty_flush) == (4, 0), 'Flush should return the number of referrals'
+    assert [(e.host, e.events) for e in get_referral_events(mod.id)] == \
+           [('reddit.com', 6), ('forum.kerbalspaceprogram.com', 2)], \
+        'Counts should be added to the stored ones, keeping only the top hosts'
+    assert ReferralEvent.query.count() == 2, 'Referrals to mods that do not exist should be dropped'
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff.app import app
+from KerbalStuff.config import config, env
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion, \
+    DownloadEvent, DownloadRollup, FollowEvent
+from KerbalStuff.rollups import DownloadStat, FollowStat, get_download_stats, get_follow_stats, roll_up_events
+from KerbalStuff.database import db
+from KerbalStuff.download_counter import write_download_counts
+
+
+@pytest.mark.usefixtures("client")
+def test_roll_up_events(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'stats-retention-days', '30')
+    now = datetime(2026, 3, 10, 12)
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    version = ModVersion(friendly_version='1.0', gameversion=GameVersion(friendly_version='1.2.3', game=game))
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, default_version=version)
+    version.mod = mod
+    db.add(mod)
+    db.flush()
+    for created, downloads in ((datetime(2026, 1, 20, 5), 1), (datetime(2026, 1, 20, 6), 2),
+                               (datetime(2026, 2, 28, 23), 4), (datetime(2026, 3, 9, 8), 8),
+                               (datetime(2026, 3, 10, 9), 16)):
+        db.add(DownloadEvent(mod_id=mod.id, version_id=version.id, downloads=downloads, created=created))
+    for created, delta in ((datetime(2026, 3, 1, 10), 2), (datetime(2026, 3, 1, 20), -1), (datetime(2026, 3, 10, 1), 1)):
+        db.add(FollowEvent(mod_id=mod.id, delta=delta, events=abs(delta), created=created))
+    db.commit()
+
+    # Act
+    roll_up_events(now)
+    roll_up_events(now)
+    daily = get_download_stats(mod.id)
+    monthly = get_download_stats(mod.id, granularity='month')
+    recent = get_download_stats(mod.id, since=datetime(2026, 3, 1, 12))
+    follows = get_follow_stats(mod.id)
+
+    # Assert
+    assert daily == [DownloadStat(datetime(2026, 1, 20), version.id, 3),
+                     DownloadStat(datetime(2026, 2, 28), version.id, 4),
+                     DownloadStat(datetime(2026, 3, 9), version.id, 8),
+                     DownloadStat(datetime(2026, 3, 10), version.id, 16)], \
+        'Hourly downloads should be added up per day, from the events that are not rolled up yet too'
+    assert monthly == [DownloadStat(datetime(2026, 1, 1), version.id, 3),
+                       DownloadStat(datetime(2026, 2, 1), version.id, 4),
+                       DownloadStat(datetime(2026, 3, 1), version.id, 24)], \
+        'Downloads should be added up per month'
+    assert recent == daily[2:], 'Stats should be limited to the range'
+    assert follows == [FollowStat(datetime(2026, 3, 1), 1, 3), FollowStat(datetime(2026, 3, 10), 1, 1)], \
+        'Follows should be added up per day'
+    assert DownloadRollup.query.filter(DownloadRollup.period == 'day').count() == 3, \
+        'Rolling up again should not count twice, and the current day should not be rolled up'
+    assert [e.created for e in DownloadEvent.query.order_by(DownloadEvent.created)] == \
+           [datetime(2026, 2, 28, 23), datetime(2026, 3, 9, 8), datetime(2026, 3, 10, 9)], \
+        'Events older than the retention should be removed'
+
+
+@pytest.mark.usefixtures("client")
+def test_export_downloads(client: 'FlaskClient[Response]', monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    # The mod routes keep the game in the session
+    monkeypatch.setattr(app, 'secret_key', 'test')
+    # So the hours of the test are still kept
+    monkeypatch.setitem(config[env], 'stats-retention-days', str((datetime.now() - datetime(2026, 1, 1)).days))
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    version = ModVersion(friendly_version='1.0', gameversion=GameVersion(friendly_version='1.2.3', game=game))
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, default_version=version)
+    version.mod = mod
+    db.add(mod)
+    db.flush()
+    for created, downloads in ((datetime(2026, 1, 20, 5), 1), (datetime(2026, 2, 3, 6), 2),
+                               (datetime(2026, 2, 3, 7), 4), (datetime(2026, 3, 9, 8), 8)):
+        db.add(DownloadEvent(mod_id=mod.id, version_id=version.id, downloads=downloads, created=created))
+    db.commit()
+    roll_up_events(datetime(2026, 3, 1))
+
+    # Act
+    monthly_resp = client.get(f'/mod/{mod.id}/stats/downloads?granularity=month&from=2026-02-01')
+    # Streamed responses have to be read before the next request
+    monthly_csv = monthly_resp.get_data(as_text=True)
+    hourly_csv = client.get(f'/mod/{mod.id}/stats/downloads?granularity=hour&to=2026-03-01').get_data(as_text=True)
+    invalid_resp = client.get(f'/mod/{mod.id}/stats/downloads?granularity=week')
+    expired_resp = client.get(f'/mod/{mod.id}/stats/downloads?granularity=hour&from=2025-12-31')
+
+    # Assert
+    assert monthly_resp.status_code == 200, 'Export should succeed'
+    assert monthly_resp.mimetype == 'text/csv', 'Export should be a CSV file'
+    assert monthly_csv.splitlines() == [
+        '"Date","Downloads","Mod Version"',
+        '"2026-02-01 00:00:00","6","1.0"',
+        '"2026-03-01 00:00:00","8","1.0"',
+    ], 'Rolled up and pending downloads should be exported per month from the start of the range'
+    assert hourly_csv.splitlines()[1:] == [
+        '"2026-01-20 05:00:00","1","1.0"',
+        '"2026-02-03 06:00:00","2","1.0"',
+        '"2026-02-03 07:00:00","4","1.0"',
+    ], 'Hourly events should be exported until the end of the range'
+    assert invalid_resp.status_code == 400, 'Unknown granularity should be refused'
+    assert expired_resp.status_code == 400, 'Hours that are no longer kept should be refused'
+
+
+@pytest.mark.usefixtures("client")
+def test_late_downloads(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    version = ModVersion(friendly_version='1.0', gameversion=GameVersion(friendly_version='1.2.3', game=game))
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, default_version=version, download_count=0)
+    version.mod = mod
+    version.download_count = 0
+    db.add(mod)
+    db.flush()
+    db.add(DownloadEvent(mod_id=mod.id, version_id=version.id, downloads=1, created=datetime(2026, 3, 8, 5)))
+    db.commit()
+    roll_up_events(datetime(2026, 3, 10, 12))
+
+    # Act
+    # Flushed after both days were rolled up, one of them had no downloads before
+    write_download_counts({(mod.id, version.id, datetime(2026, 3, 8, 5)): 2,
+                           (mod.id, version.id, datetime(2026, 3, 9, 23)): 4,
+                           (mod.id, version.id, datetime(2026, 3, 10, 9)): 8})
+    db.commit()
+    roll_up_events(datetime(2026, 3, 10, 13))
+    daily = get_download_stats(mod.id)
+    monthly = get_download_stats(mod.id, granularity='month')
+
+    # Assert
+    assert daily == [DownloadStat(datetime(2026, 3, 8), version.id, 3),
+                     DownloadStat(datetime(2026, 3, 9), version.id, 4),
+                     DownloadStat(datetime(2026, 3, 10), version.id, 8)], \
+        'Downloads flushed after their day was rolled up should be added to it'
+    assert monthly == [DownloadStat(datetime(2026, 3, 1), version.id, 15)], \
+        'Downloads flushed after their day was rolled up should be added to the month'
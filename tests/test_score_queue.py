@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff.database import db
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+from KerbalStuff.score_queue import ScoreQueue
+
+
+@pytest.mark.usefixtures("client")
+def test_score_queue(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              game=game, license='MIT', published=True, description='', download_count=1000,
+              created=datetime.now(), updated=datetime.now(),
+              default_version=ModVersion(friendly_version='1.0',
+                                         gameversion=GameVersion(friendly_version='1.2.3', game=game),
+                                         download_path='/tmp/blah.zip', created=datetime.now()))
+    mod.default_version.mod = mod
+    db.add(mod)
+    db.commit()
+    # Long enough for the background thread not to get in the way
+    queue = ScoreQueue(3600)
+
+    # Act
+    queue.mark(mod.id)
+    queue.mark(mod.id)
+    changed = queue.flush()
+    flushed_again = queue.flush()
+    db.refresh(mod)
+
+    # Assert
+    assert changed == 1, 'Marked mod should be updated once'
+    assert flushed_again == 0, 'Queue should be empty after flushing'
+    assert mod.score == 1090, 'Score should include the downloads'
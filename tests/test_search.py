@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import pytest
+from packaging.version import Version
+from flask.testing import FlaskClient
+from flask import Response
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import ColumnElement
+
+from .fixtures.client import client
+from KerbalStuff.database import db
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion, ModList, ModListItem, Media
+from KerbalStuff.search import term_to_tsquery, text_filter, get_mod_score, update_mod_scores, count_newer_versions, \
+    invalidate_game_versions
+
+
+def compile_postgresql(expression: ColumnElement) -> str:
+    return str(expression.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def test_term_to_tsquery() -> None:
+    # Arrange
+    term = "kerbal engineer 1.12"
+
+    # Act
+    tsquery = compile_postgresql(term_to_tsquery(term))
+
+    # Assert
+    assert "phraseto_tsquery('english', 'kerbal engineer 1.12')" in tsquery, \
+        'The whole term should go to the parser, so version numbers stay one lexeme'
+    assert "'''$', ''':*')" in tsquery, 'The last lexeme should be a prefix'
+    assert tsquery.endswith('AS TSQUERY)'), 'The prefixed phrase should be a tsquery again'
+
+
+def test_term_to_tsquery_syntax() -> None:
+    # Arrange
+    term = "mech&jeb|!:*'"
+
+    # Act
+    tsquery = compile_postgresql(term_to_tsquery(term))
+
+    # Assert
+    assert "phraseto_tsquery('english', 'mech&jeb|!:*''')" in tsquery, \
+        'tsquery operators from user input should be left to the parser, which ignores them'
+
+
+def test_text_filter_without_lexemes() -> None:
+    # Arrange
+    term = "the"
+
+    # Act
+    match = compile_postgresql(text_filter(term))
+    exclude = compile_postgresql(text_filter(term, negate=True))
+
+    # Assert
+    assert match.startswith('numnode(') and ') = 0 OR (mod.search_vector @@ ' in match, \
+        'A term of stopwords only should not filter anything'
+    assert exclude.startswith('numnode(') and ') = 0 OR NOT (mod.search_vector @@ ' in exclude, \
+        'A negated term of stopwords only should not filter anything either'
+
+
+@pytest.mark.usefixtures("client")
+def test_update_mod_scores(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    now = datetime.now()
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    game_versions = [GameVersion(friendly_version=v, game=game)
+                     for v in ['1.8.1', '1.9.1', '1.10.1', '1.11.2', '1.12.5', 'not a version']]
+    author = User(username='TestModAuthor', email='author@spacedock.info', public=True)
+    packer = User(username='TestPackAuthor', email='packer@spacedock.info', public=True)
+    mods = []
+    for i in range(6):
+        mod = Mod(name=f'Mod {i}', user=author, game=game, license='MIT', published=True,
+                  description='x' * (60 * i), download_count=37 * i, follower_count=i,
+                  source_link='https://github.com/' if i % 2 else None,
+                  created=now - timedelta(days=40 * i, hours=3), updated=now - timedelta(days=25 * i, hours=3))
+        for j in range(3 * i):
+            mod.versions.append(ModVersion(friendly_version=f'1.{j}', gameversion=game_versions[j % 5],
+                                           download_path='/tmp/blah.zip', created=now))
+        if mod.versions:
+            mod.default_version = mod.versions[-1]
+        for j in range(i):
+            mod.media.append(Media(hash=f'{i}{j}', type='image', data=''))
+        mods.append(mod)
+        db.add(mod)
+    own_pack = ModList(name='Own pack', user=author, game=game)
+    other_pack = ModList(name='Other pack', user=packer, game=game)
+    for pack, members in ((own_pack, mods[1:4]), (other_pack, mods[2:6])):
+        for sort_index, mod in enumerate(members):
+            db.add(ModListItem(mod=mod, mod_list=pack, sort_index=sort_index))
+    db.commit()
+    expected = {mod.id: get_mod_score(mod) for mod in mods}
+
+    # Act
+    changed = update_mod_scores()
+    db.expire_all()
+    unchanged = update_mod_scores([mod.id for mod in mods])
+
+    # Assert
+    assert {mod.id: mod.score for mod in mods} == expected, 'Bulk scores should match get_mod_score'
+    assert changed == len([s for s in expected.values() if s != 0]), 'Only changed scores should be written'
+    assert unchanged == 0, 'Nothing should change the second time'
+
+
+@pytest.mark.usefixtures("client")
+def test_count_newer_versions(client: 'FlaskClient[Response]') -> None:
+    # Arrange
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    for friendly_version in ['1.10.1', '1.9.1', '1.12.5', '1.11.2', 'not a version']:
+        db.add(GameVersion(friendly_version=friendly_version, game=game))
+    db.commit()
+
+    # Act
+    behind = count_newer_versions(game.id, Version('1.10.1'))
+    db.add(GameVersion(friendly_version='1.12.6', game=game))
+    db.commit()
+    cached = count_newer_versions(game.id, Version('1.10.1'))
+    invalidate_game_versions(game.id)
+    refreshed = count_newer_versions(game.id, Version('1.10.1'))
+
+    # Assert
+    assert behind == 2, 'Versions should be compared numerically'
+    assert cached == 2, 'Versions should be cached'
+    assert refreshed == 3, 'New versions should count after invalidating'
@@ -0,0 +1,57 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from flask.testing import FlaskClient
+from flask import Response
+from http import HTTPStatus
+
+from .fixtures.client import client
+from KerbalStuff.changes import record_mod_change
+from KerbalStuff.config import config, env
+from KerbalStuff.objects import Publisher, Game, GameVersion, User, Mod, ModVersion
+from KerbalStuff.database import db
+from KerbalStuff.snapshot import write_snapshot
+
+
+@pytest.mark.usefixtures("client")
+def test_snapshot(client: 'FlaskClient[Response]', tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    # Changes are only in the feed once they're settled
+    monkeypatch.setitem(config[env], 'change-feed-lag', '0')
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    user = User(username='TestModAuthor', email='webmaster@spacedock.info')
+    game_version = GameVersion(friendly_version='1.2.3', game=game)
+    for name, published in (('Published Mod', True), ('Hidden Mod', False)):
+        mod = Mod(name=name, short_description='A mod for testing', description='A mod',
+                  user=user, license='MIT', game=game, published=published,
+                  default_version=ModVersion(friendly_version='1.0.0.0', gameversion=game_version,
+                                             download_path='/tmp/blah.zip', created=datetime.now()))
+        mod.default_version.mod = mod
+        db.add(mod)
+    db.commit()
+    record_mod_change(Mod.query.get(1), 'published')
+    db.commit()
+
+    # Act
+    manifest = write_snapshot()
+    api_mod = client.get('/api/browse').json['result'][0]
+    snapshot_resp = client.get('/api/snapshot')
+    manifest_resp = client.get('/api/snapshot/manifest')
+
+    # Assert
+    assert manifest is not None, 'Snapshot should be written if storage is configured'
+    assert snapshot_resp.status_code == HTTPStatus.OK, 'Snapshot should be served'
+    assert manifest_resp.json['sha256'] == hashlib.sha256(snapshot_resp.data).hexdigest(), 'Checksum should match the snapshot'
+    assert manifest_resp.json['cursor'] == 1, 'Manifest should have the last change'
+    assert manifest_resp.json['mods'] == 1, 'Manifest should count the mods'
+    snapshot = json.loads(gzip.decompress(snapshot_resp.data))
+    assert snapshot['cursor'] == 1, 'Snapshot should have the last change'
+    assert [m['name'] for m in snapshot['mods']] == ['Published Mod'], 'Only published mods should be in the snapshot'
+    assert snapshot['mods'][0] == api_mod, 'Snapshot mods should look like the API'
+    assert snapshot['games'][0]['versions'] == [{'id': 1, 'friendly_version': '1.2.3'}], 'Games should have their versions'
@@ -0,0 +1,151 @@
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+from PIL import Image
+from flask.testing import FlaskClient
+from flask import Response
+
+from .fixtures.client import client
+from KerbalStuff import celery, thumbnail
+from KerbalStuff.app import app
+from KerbalStuff.config import config, env
+from KerbalStuff.objects import Publisher, Game, User, Mod
+from KerbalStuff.database import db
+
+
+@pytest.mark.usefixtures("client")
+def test_thumbnail_queue(client: 'FlaskClient[Response]', tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    queued: List[Tuple[str, int]] = []
+    monkeypatch.setattr(celery.create_thumbnail, 'delay', lambda kind, obj_id: queued.append((kind, obj_id)))
+    Image.new('RGB', (1280, 720), 'red').save(tmp_path / 'background.png')
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, published=True, background='background.png')
+    db.add(mod)
+    db.commit()
+
+    # Act
+    with app.test_request_context():
+        first_url = Mod.query.get(1).background_thumb()
+        second_url = Mod.query.get(1).background_thumb()
+        celery.create_thumbnail('mod', 1)
+        ready_url = Mod.query.get(1).background_thumb()
+
+    # Assert
+    assert first_url == second_url == '/mod/1/Test%20Mod/background', 'Background should be shown until the thumbnail is ready'
+    assert queued == [('mod', 1)], 'Thumbnail should be queued once'
+    assert Image.open(tmp_path / 'thumb_background.jpg').size == (320, 195), 'Task should create the thumbnail'
+    assert ready_url == '/mod/1/Test%20Mod/thumb', 'Thumbnail should be shown once it is ready'
+
+
+def test_thumbnail_create(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'thumbnail_max_pixels', str(4000 * 3000))
+    Image.new('RGB', (3840, 2160), 'blue').save(tmp_path / 'large.jpg')
+    Image.new('RGB', (4001, 3000), 'blue').save(tmp_path / 'huge.jpg')
+
+    # Act
+    thumbnail.create(str(tmp_path / 'large.jpg'), str(tmp_path / 'thumb_large.jpg'))
+    with pytest.raises(ValueError) as huge_error:
+        thumbnail.create(str(tmp_path / 'huge.jpg'), str(tmp_path / 'thumb_huge.jpg'))
+
+    # Assert
+    thumb = Image.open(tmp_path / 'thumb_large.jpg')
+    assert thumb.size == (320, 195), 'JPEG thumbnail should have the configured size'
+    assert thumb.getpixel((160, 97)) == pytest.approx((0, 0, 255), abs=8), 'Thumbnail should look like the background'
+    assert 'too large' in str(huge_error.value), 'Too large backgrounds should be refused before decoding'
+    assert not (tmp_path / 'thumb_huge.jpg').exists(), 'No thumbnail should be created for too large backgrounds'
+
+
+@pytest.mark.usefixtures("client")
+def test_thumbnail_variants(client: 'FlaskClient[Response]', tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    monkeypatch.setitem(config[env], 'thumbnail_scales', '1,2,4')
+    monkeypatch.setitem(config[env], 'thumbnail_formats', 'jpeg,webp')
+    # The mod routes keep the game in the session
+    monkeypatch.setattr(app, 'secret_key', 'test')
+    Image.new('RGB', (1280, 720), 'red').save(tmp_path / 'background.png')
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, published=True, background='background.png')
+    db.add(mod)
+    db.commit()
+
+    # Act
+    celery.create_thumbnail('mod', 1)
+    with app.test_request_context():
+        thumb_set = Mod.query.get(1).background_thumb_set()
+    webp_resp = client.get('/mod/1/Test%20Mod/thumb?variant=2x.webp')
+    unknown_resp = client.get('/mod/1/Test%20Mod/thumb?variant=3x.png')
+
+    # Assert
+    assert Image.open(tmp_path / 'thumb_background.jpg').size == (320, 195), '1x JPEG should be created'
+    assert Image.open(tmp_path / 'thumb_background@2x.webp').size == (640, 390), '2x WebP should be created'
+    assert not (tmp_path / 'thumb_background@4x.jpg').exists(), 'Background should not be blown up for 4x'
+    assert thumb_set is not None and thumb_set.startswith('image-set(url("/mod/1/Test%20Mod/thumb?variant=1x.webp") type("image/webp") 1x'), \
+        'WebP should be offered first'
+    assert 'variant=2x.jpg") type("image/jpeg") 2x' in thumb_set, 'All created variants should be offered'
+    assert '4x' not in thumb_set, 'Missing variants should not be offered'
+    assert webp_resp.status_code == 200, 'Variant should be served'
+    assert webp_resp.data == (tmp_path / 'thumb_background@2x.webp').read_bytes(), 'Requested variant should be served'
+    assert unknown_resp.status_code == 404, 'Unknown variants should not be served'
+
+
+@pytest.mark.usefixtures("client")
+def test_thumbnail_queue_unavailable(client: 'FlaskClient[Response]', tmp_path: Path,
+                                     monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    queued: List[Tuple[str, int]] = []
+
+    def broker_down(kind: str, obj_id: int) -> None:
+        raise ConnectionError('Broker is down')
+
+    Image.new('RGB', (1280, 720), 'red').save(tmp_path / 'background.png')
+    game = Game(name='Kerbal Space Program', publisher=Publisher(name='SQUAD'),
+                short='kerbal-space-program', active=True)
+    mod = Mod(name='Test Mod', user=User(username='TestModAuthor', email='webmaster@spacedock.info'),
+              license='MIT', game=game, published=True, background='background.png')
+    db.add(mod)
+    db.commit()
+
+    # Act
+    with app.test_request_context():
+        monkeypatch.setattr(celery.create_thumbnail, 'delay', broker_down)
+        unavailable_url = Mod.query.get(1).background_thumb()
+        monkeypatch.setattr(celery.create_thumbnail, 'delay', lambda kind, obj_id: queued.append((kind, obj_id)))
+        Mod.query.get(1).background_thumb()
+
+    # Assert
+    assert unavailable_url == '/mod/1/Test%20Mod/background', \
+        'Background should be shown when the thumbnail cannot be queued'
+    assert queued == [('mod', 1)], 'Thumbnail should be queued again after the queue failed'
+
+
+def test_thumbnail_variants_replaced(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setitem(config[env], 'storage', str(tmp_path))
+    monkeypatch.setitem(config[env], 'thumbnail_scales', '1,2')
+    Image.new('RGB', (1280, 720), 'blue').save(tmp_path / 'large.jpg')
+    Image.new('RGB', (400, 300), 'blue').save(tmp_path / 'small.jpg')
+    thumbnail.create(str(tmp_path / 'large.jpg'), str(tmp_path / 'thumb.jpg'))
+    os.utime(tmp_path / 'thumb.jpg', (1000, 1000))
+
+    # Act
+    first_variants = thumbnail.available_variants('thumb.jpg')
+    # Another process replaces the background and its thumbnail
+    (tmp_path / 'thumb@2x.jpg').unlink()
+    thumbnail.create(str(tmp_path / 'small.jpg'), str(tmp_path / 'thumb.jpg'))
+    os.utime(tmp_path / 'thumb.jpg', (2000, 2000))
+    replaced_variants = thumbnail.available_variants('thumb.jpg')
+
+    # Assert
+    assert first_variants == [(1, 'jpeg'), (2, 'jpeg')], 'Both scales should be found'
+    assert replaced_variants == [(1, 'jpeg')], 'Variants of the replaced thumbnail should not be cached'
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from KerbalStuff.uploads import UploadError, discard_upload, receive_chunk, upload_status
+
+
+def _chunk_form(index: int, data: bytes, chunk_size: int, **extra: str) -> Dict[str, str]:
+    return {
+        'dzuuid': 'test-upload',
+        'dztotalchunkcount': str(-(-len(data) // chunk_size)),
+        'dztotalfilesize': str(len(data)),
+        'dzchunkindex': str(index),
+        'dzchunkbyteoffset': str(index * chunk_size),
+        **extra,
+    }
+
+
+def test_upload_chunks(tmp_path: Path) -> None:
+    # Arrange
+    chunk_size = 1000
+    data = bytes(range(256)) * 15
+
+    def send(index: int, **extra: str) -> None:
+        chunk = data[index * chunk_size:(index + 1) * chunk_size]
+        result = receive_chunk(str(tmp_path), 1, _chunk_form(index, data, chunk_size, **extra), BytesIO(chunk))
+        assert result is None, 'Upload should not be complete before all chunks arrived'
+
+    # Act
+    send(0)
+    send(2)
+    with pytest.raises(UploadError) as checksum_error:
+        send(1, dzchunksha256='0' * 64)
+    status = upload_status(str(tmp_path), 1, 'test-upload')
+    other_user_status = upload_status(str(tmp_path), 2, 'test-upload')
+    send(1, dzchunksha256=hashlib.sha256(data[1000:2000]).hexdigest())
+    upload = receive_chunk(str(tmp_path), 1, _chunk_form(3, data, chunk_size), BytesIO(data[3000:]))
+    assert upload is not None, 'Upload should be complete after the last chunk'
+    uploaded = Path(upload.path).read_bytes()
+    discard_upload(upload)
+
+    # Assert
+    assert 'Checksum' in str(checksum_error.value), 'Corrupted chunk should be refused'
+    assert status is not None and status['missing_chunks'] == [1, 3], 'Missing chunks should be listed'
+    assert status['received_size'] == 2000, 'Received bytes should be counted'
+    assert other_user_status is None, 'Uploads should only be visible to their uploader'
+    assert uploaded == data, 'Chunks should be assembled in order'
+    assert upload.sha256 == hashlib.sha256(data).hexdigest(), 'Hash of the whole file should be computed'
+    assert upload.size == len(data), 'Size of the whole file should be counted'
+    assert upload_status(str(tmp_path), 1, 'test-upload') is None, 'Session should be removed'
+
+
+def test_upload_single(tmp_path: Path) -> None:
+    # Arrange
+    data = b'PK' + bytes(100)
+
+    # Act
+    upload = receive_chunk(str(tmp_path), 1, {}, BytesIO(data))
+    with pytest.raises(UploadError) as mismatch_error:
+        receive_chunk(str(tmp_path), 1, {'sha256': '0' * 64}, BytesIO(data))
+    with pytest.raises(UploadError) as no_session_error:
+        receive_chunk(str(tmp_path), 1, {'dztotalchunkcount': '2'}, BytesIO(data))
+
+    # Assert
+    assert upload is not None and Path(upload.path).read_bytes() == data, 'Uploads without chunks should be complete'
+    assert 'does not match' in str(mismatch_error.value), 'Upload with wrong checksum should be refused'
+    assert 'dzuuid' in str(no_session_error.value), 'Chunked uploads should need a session id'
+
+
+def test_upload_bounds(tmp_path: Path) -> None:
+    # Arrange
+    data = b'PK' + bytes(100)
+    chunk_size = 51
+
+    # Act
+    with pytest.raises(UploadError) as too_many_error:
+        receive_chunk(str(tmp_path), 1, _chunk_form(0, data, chunk_size, dztotalchunkcount=str(10 ** 9)),
+                      BytesIO(data[:chunk_size]))
+    with pytest.raises(UploadError) as more_than_bytes_error:
+        receive_chunk(str(tmp_path), 1, _chunk_form(0, data, chunk_size, dztotalchunkcount='103'),
+                      BytesIO(data[:chunk_size]))
+    with pytest.raises(UploadError) as negative_offset_error:
+        receive_chunk(str(tmp_path), 1, _chunk_form(1, data, chunk_size, dzchunkbyteoffset='-1'),
+                      BytesIO(data[chunk_size:]))
+    with pytest.raises(UploadError) as past_end_error:
+        receive_chunk(str(tmp_path), 1, _chunk_form(1, data, chunk_size, dzchunkbyteoffset='100'),
+                      BytesIO(data[chunk_size:]))
+
+    # Assert
+    assert 'chunks' in str(too_many_error.value), 'Uploads with absurdly many chunks should be refused'
+    assert 'chunks' in str(more_than_bytes_error.value), 'Uploads with more chunks than bytes should be refused'
+    assert 'does not fit' in str(negative_offset_error.value), 'Chunks before the start should be refused'
+    assert 'does not fit' in str(past_end_error.value), 'Chunks past the end should be refused'
+
+
+def test_upload_died_while_finishing(tmp_path: Path) -> None:
+    # Arrange
+    chunk_size = 1000
+    data = bytes(range(256)) * 8
+    receive_chunk(str(tmp_path), 1, _chunk_form(0, data, chunk_size), BytesIO(data[:1000]))
+    # A request claimed the upload as the last chunks arrived, and died
+    marker = tmp_path / 'uploads' / '1' / 'test-upload' / 'finishing'
+    marker.touch()
+    for index in range(1, 3):
+        chunk = data[index * chunk_size:(index + 1) * chunk_size]
+        assert receive_chunk(str(tmp_path), 1, _chunk_form(index, data, chunk_size), BytesIO(chunk)) is None, \
+            'Upload should not be finished twice'
+    long_ago = time.time() - 3600
+    os.utime(marker, (long_ago, long_ago))
+
+    # Act
+    status = upload_status(str(tmp_path), 1, 'test-upload')
+    upload = receive_chunk(str(tmp_path), 1, _chunk_form(2, data, chunk_size), BytesIO(data[2000:]))
+
+    # Assert
+    assert status is not None and status['missing_chunks'] == [2], \
+        'Upload whose finishing request died should be reported unfinished'
+    assert upload is not None and Path(upload.path).read_bytes() == data, \
+        'Sending the last chunk again should finish the upload'
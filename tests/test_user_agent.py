@@ -0,0 +1,19 @@
+from KerbalStuff.user_agent import UserAgentClass, classify_user_agent, user_agent_classes
+
+
+def test_classify_user_agent() -> None:
+    # Arrange
+    browser = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:131.0) Gecko/20100101 Firefox/131.0'
+    crawler = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+    discord = 'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)'
+    user_agent_classes.invalidate()
+    hits = user_agent_classes.hits
+
+    # Act
+    classes = [classify_user_agent(ua) for ua in (browser, crawler, discord, browser)]
+
+    # Assert
+    assert classes == [UserAgentClass(False, False), UserAgentClass(True, False),
+                       UserAgentClass(True, True), UserAgentClass(False, False)], \
+        'User agents should be classified as bots and Discord'
+    assert user_agent_classes.hits - hits == 1, 'Classes should be cached'